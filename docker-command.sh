@@ -34,6 +34,8 @@ fi
 # Configure and start WSGI server
 
 num_workers="${NUM_WORKERS:-4}"
+# Threads per worker (gthread); long-polling and streaming of status keep a thread busy while waiting
+num_threads="${NUM_THREADS:-4}"
 server_port="5000"
 gunicorn_ssl_options=
 if [ -n "${TLS_CERTIFICATE}" ] && [ -n "${TLS_KEY}" ]; then
@@ -41,7 +43,7 @@ if [ -n "${TLS_CERTIFICATE}" ] && [ -n "${TLS_KEY}" ]; then
     server_port="5443"
 fi
 
-exec gunicorn --log-config ${logging_file_config} --access-logfile - \
-  --workers ${num_workers} \
+exec gunicorn --config python:ingest.server --log-config ${logging_file_config} --access-logfile - \
+  --workers ${num_workers} --threads ${num_threads} \
   --bind "0.0.0.0:${server_port}" ${gunicorn_ssl_options} \
   ingest.app:app
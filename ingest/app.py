@@ -1,31 +1,35 @@
 from flask import Flask
-from flask import request, current_app, make_response, g
+from flask import request, current_app, make_response, g, has_app_context, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import HTTPException, InternalServerError
 from flask_cors import CORS
-from os import path, getenv, environ, makedirs, unlink
-import sys
+from os import path, getenv, environ, makedirs, unlink, walk
 from shutil import rmtree
 import tempfile
 from uuid import uuid4
-from hashlib import md5
 from datetime import datetime, timezone
-from flask_executor import Executor
 from apispec import APISpec
 from apispec_webframeworks.flask import FlaskPlugin
-import zipfile
-import tarfile
 import json
+import threading
+import time
+from contextlib import nullcontext
+from functools import partial
 import distutils.util
 import sqlalchemy
 
 from .database import db
-from .database.model import Queue
-from .database.actions import db_queue, db_update_queue_status
+from .database.model import Queue, PRIORITY_CLASSES
+from .database.actions import db_queue, db_update_queue_status, db_update_queue_progress, db_enqueue_job
 from .postgres import Postgres
 from .geoserver import Geoserver
 from .logging import mainLogger, accountingLogger, exception_as_rfc5424_structured_data
-from .forms import IngestForm, PublishForm
+from .forms import IngestForm, PreviewForm, PublishForm
+from .readers import readPreviewSample, resolveSource
+from .wks import registry as wks_registry, headerSignature
+from .progress import Progress, PROGRESS_INTERVAL
+from .listener import QueueListener, TooManyWatchers
+from .worker import QueueWorker, inJobChild, reportProgress, DEFAULT_POLL_INTERVAL, DEFAULT_HEARTBEAT_INTERVAL, DEFAULT_STALE_AFTER, DEFAULT_MAX_ATTEMPTS
 
 #
 # Helpers
@@ -60,6 +64,38 @@ def _getWorkingPath(ticket):
     """Returns the working directory for each request."""
     return path.join(_getTempDir(), __name__, ticket)
 
+def _sizeOf(src_file):
+    """Return the size (in bytes) of a file, or of all files under a directory."""
+    if not path.isdir(src_file):
+        return path.getsize(src_file)
+    return sum(path.getsize(path.join(root, f)) for root, _, files in walk(src_file) for f in files)
+
+def _jobPriority(src_file, priority=None):
+    """Return the priority of a deferred job.
+
+    Parameters:
+        src_file (str): The source file of the job.
+        priority (str, optional): The requested priority class; if not given, the class is decided by
+            the size of the source file (small files first, see `QUEUE_SMALL_FILE_SIZE`, `QUEUE_LARGE_FILE_SIZE`).
+
+    Returns:
+        (int) The priority (see `PRIORITY_CLASSES`).
+    """
+    if priority is None:
+        try:
+            size = _sizeOf(src_file) / 1024 ** 2
+        except OSError:
+            size = None
+        if size is None:
+            priority = 'normal'
+        elif size < current_app.config['QUEUE_SMALL_FILE_SIZE']:
+            priority = 'high'
+        elif size >= current_app.config['QUEUE_LARGE_FILE_SIZE']:
+            priority = 'low'
+        else:
+            priority = 'normal'
+    return PRIORITY_CLASSES[priority]
+
 def _checkDirectoryWritable(d):
     fd, fname = tempfile.mkstemp(None, None, d)
     unlink(fname);
@@ -87,15 +123,55 @@ def _checkConnectToGeoserver():
         mainLogger.debug('_checkConnectToGeoserver(): Connected to %s', url)
 
 def _checkConnectToDB():
-    engine = sqlalchemy.create_engine(database_url)
-    with engine.connect() as conn:
+    with db.engine.connect() as conn:
         conn.execute('SELECT 1')
     mainLogger.debug("_checkConnectToDB(): Connected to %r", database_url)
 
-def _executorCallback(future):
-    """The callback function called when a job has been completed."""
+STATUS_KEEPALIVE_INTERVAL = 15
+"""The interval (in seconds) of keep-alive comments in a stream of status events (while no event is sent)"""
+
+def _readStatus(ticket):
+    """Read the queue record of a ticket, releasing the database connection afterwards (e.g. before waiting)."""
+    try:
+        return Queue().get(ticket=ticket)
+    finally:
+        db.session.remove()
+
+def _statusInfo(queue):
+    """Form the status of a process (as returned by `/status`) from its queue record."""
+    info = {
+        "completed": queue['completed'],
+        "success": queue['success'],
+        "requested": queue['initiated'].isoformat(),
+        "executionTime": queue['execution_time'],
+        "comment": queue['error_msg'],
+    }
+    if queue['completed'] and queue['success'] and queue['result']:
+        result = json.loads(queue['result'])
+        if isinstance(result, dict) and 'loadTime' in result:
+            info['loadTime'] = result['loadTime']
+            info['indexTime'] = result.get('indexTime')
+    if not queue['completed']:
+        if queue['progress_stage'] is not None:
+            info['progress'] = {
+                "stage": queue['progress_stage'],
+                "rows": queue['progress_rows'],
+                "bytes": queue['progress_bytes'],
+                "totalRows": queue['progress_total_rows'],
+                "totalBytes": queue['progress_total_bytes'],
+                "updated": queue['progress_at'].isoformat() if queue['progress_at'] else None,
+            }
+        elif queue['payload'] is not None and queue['claimed_by'] is None:
+            info['progress'] = {"stage": "queued"}
+    return info
+
+def _executorCallback(future, worker=None):
+    """The callback function called when a job has been completed (by the given worker, for a deferred job)."""
     ticket, result, success, error_msg, rows = future.result()
-    record = db_update_queue_status(ticket, completed=True, success=success, result=result, error_msg=error_msg, rows=rows)
+    record = db_update_queue_status(ticket, worker=worker, completed=True, success=success, result=result, error_msg=error_msg, rows=rows)
+    if record is None:
+        mainLogger.warning('Ignoring the completion of job %s: it is no longer claimed by worker %s', ticket, worker)
+        return
     accountingLogger(ticket=ticket, success=success, execution_start=record.initiated, execution_time=record.execution_time, comment=error_msg, rows=rows)
 
 
@@ -132,15 +208,33 @@ app.config.from_mapping(
     SQLALCHEMY_ENGINE_OPTIONS={'pool_size': int(environ.get('SQLALCHEMY_POOL_SIZE', '4')), 'pool_pre_ping': True},
     SQLALCHEMY_TRACK_MODIFICATIONS=False,
     JSON_SORT_KEYS=False,
-    EXECUTOR_TYPE="thread",
-    EXECUTOR_MAX_WORKERS="1"
+    QUEUE_WORKERS=int(environ.get('QUEUE_WORKERS', '1')),
+    QUEUE_POLL_INTERVAL=float(environ.get('QUEUE_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)),
+    QUEUE_HEARTBEAT_INTERVAL=float(environ.get('QUEUE_HEARTBEAT_INTERVAL', DEFAULT_HEARTBEAT_INTERVAL)),
+    QUEUE_STALE_AFTER=float(environ.get('QUEUE_STALE_AFTER', DEFAULT_STALE_AFTER)),
+    QUEUE_MAX_ATTEMPTS=int(environ.get('QUEUE_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)),
+    QUEUE_RESERVED_SLOTS=int(environ.get('QUEUE_RESERVED_SLOTS', '0')),
+    QUEUE_MAX_JOBS_PER_SHARD=int(environ.get('QUEUE_MAX_JOBS_PER_SHARD', '0')),
+    QUEUE_MAX_JOBS_PER_WORKSPACE=int(environ.get('QUEUE_MAX_JOBS_PER_WORKSPACE', '0')),
+    QUEUE_SMALL_FILE_SIZE=float(environ.get('QUEUE_SMALL_FILE_SIZE', '64')),
+    QUEUE_LARGE_FILE_SIZE=float(environ.get('QUEUE_LARGE_FILE_SIZE', '1024')),
+    QUEUE_EXECUTION=environ.get('QUEUE_EXECUTION', 'thread'),
+    QUEUE_MEMORY_LIMIT=int(environ.get('QUEUE_MEMORY_LIMIT', '0')),
+    QUEUE_CPU_LIMIT=int(environ.get('QUEUE_CPU_LIMIT', '0')),
+    PROGRESS_INTERVAL=float(environ.get('PROGRESS_INTERVAL', PROGRESS_INTERVAL)),
+    STATUS_MAX_WAIT=float(environ.get('STATUS_MAX_WAIT', '60')),
+    STATUS_STREAM_TIMEOUT=float(environ.get('STATUS_STREAM_TIMEOUT', '300')),
+    # By default, leave (at least) half of the threads of a server process to other requests
+    STATUS_MAX_WATCHERS=int(environ.get('STATUS_MAX_WATCHERS') or max(1, int(environ.get('NUM_THREADS', '4')) // 2)),
 );
 
-# Ensure the instance folder exists and initialize application, db and executor.
+# Ensure the instance folder exists and initialize application and db.
 
 _makeDir(app.instance_path)
 db.init_app(app)
-executor = Executor(app)
+
+# Listen (on demand) for changes of the status of processes
+queue_listener = QueueListener(database_url, max_watchers=app.config['STATUS_MAX_WATCHERS'])
 
 #Enable CORS
 if getenv('CORS') is not None:
@@ -169,17 +263,89 @@ def _prepareSession():
 
 def enqueue(src_file, ticket, tablename, schema, shard=None, csv_geom_column_name=None, replace=None,
             match_into_wks=False, **kwargs):
-    """Enqueue a transform job (in case requested response type is 'deferred')."""
+    """Process a deferred ingest job (in case requested response type is 'deferred')."""
     mainLogger.info("Processing ticket %s (%s)", ticket, src_file)
     try:
         result = _ingest(src_file, ticket, tablename, schema, shard, csv_geom_column_name, replace=replace,
-                         match_into_wks=match_into_wks, **kwargs)
+                         match_into_wks=match_into_wks, report_progress=partial(reportProgress, ticket), **kwargs)
     except Exception as e:
         return (ticket, None, 0, str(e), None)
     rows = result.pop('length')
     return (ticket, json.dumps(result), 1, None, rows)
 
 
+def _runJob(ticket, payload):
+    """Run a deferred job claimed from the queue table."""
+    return enqueue(ticket=ticket, **json.loads(payload))
+
+
+def _failedJob(ticket, message):
+    """The result of a deferred job which failed unexpectedly (e.g. its process crashed)."""
+    return (ticket, None, 0, message, None)
+
+
+def _jobProgress(ticket, progress, worker=None):
+    """Record the progress reported by a job (processed by the given worker, for a deferred job)."""
+    db_update_queue_progress(ticket, worker=worker, **progress)
+
+
+def _recordProgress(ticket, **progress):
+    """Record the progress of a prompt job (reported from any thread of the job)."""
+    if has_app_context():
+        _jobProgress(ticket, progress)
+    else:
+        with app.app_context():
+            _jobProgress(ticket, progress)
+
+
+def makeQueueWorker(slots=None):
+    """Create a worker processing the deferred jobs of the queue table.
+
+    Parameters:
+        slots (int, optional): The number of jobs processed concurrently (default is `QUEUE_WORKERS`).
+
+    Returns:
+        (QueueWorker) The worker (not started).
+    """
+    return QueueWorker(app, _runJob, _executorCallback, failed=_failedJob, progress=_jobProgress,
+                       slots=(slots or app.config['QUEUE_WORKERS']),
+                       poll_interval=app.config['QUEUE_POLL_INTERVAL'],
+                       heartbeat_interval=app.config['QUEUE_HEARTBEAT_INTERVAL'],
+                       stale_after=app.config['QUEUE_STALE_AFTER'],
+                       max_attempts=app.config['QUEUE_MAX_ATTEMPTS'],
+                       reserved_slots=app.config['QUEUE_RESERVED_SLOTS'],
+                       max_per_shard=app.config['QUEUE_MAX_JOBS_PER_SHARD'],
+                       max_per_workspace=app.config['QUEUE_MAX_JOBS_PER_WORKSPACE'],
+                       mode=app.config['QUEUE_EXECUTION'],
+                       memory_limit=app.config['QUEUE_MEMORY_LIMIT'] * 1024 ** 2,
+                       cpu_limit=app.config['QUEUE_CPU_LIMIT'],
+                       preload=[__name__])
+
+queue_worker = None
+"""The in-process worker of this process (if started, see `startQueueWorker`)"""
+
+_queue_worker_lock = threading.Lock()
+
+def startQueueWorker():
+    """Start the in-process worker (unless `QUEUE_WORKERS` is 0), if not already started.
+
+    The worker is never started on import: every process importing this module (e.g. a child process
+    executing jobs, or matching schemata) would claim jobs otherwise. It is started by each process of
+    the server (see `ingest.server`), or by `wsgi.py` along with the development server; never in a child
+    process executing jobs.
+
+    Returns:
+        (QueueWorker) The worker (None if disabled)
+    """
+    global queue_worker
+    with _queue_worker_lock:
+        if queue_worker is None and app.config['QUEUE_WORKERS'] > 0 and not inJobChild():
+            worker = makeQueueWorker()
+            worker.start()
+            queue_worker = worker
+    return queue_worker
+
+
 @app.after_request
 def _afterRequest(response):
     """Log request.
@@ -282,6 +448,44 @@ def healthCheck():
         return make_response({'status': 'FAILED', 'reason': 'cannot connect to GeoServer REST API.', 'detail': str(exc)}, 200)
     return make_response({'status': 'OK'}, 200)
 
+@app.route("/_pools")
+def poolStatus():
+    """Report the status of connection pools to PostGIS backends
+    ---
+    get:
+      tags:
+      - Health
+      summary: Get status of connection pools
+      description: 'Get statistics for the connection pool of each PostGIS backend (shard)'
+      operationId: 'getPoolStatus'
+      responses:
+        200:
+          description: An object with pool statistics keyed on shard identifier (empty if sharding is not used)
+          content:
+            application/json:
+              schema:
+                type: object
+                additionalProperties:
+                  type: object
+                  properties:
+                    size:
+                      type: integer
+                      description: The configured size of the pool
+                    checkedIn:
+                      type: integer
+                      description: The number of idle connections in the pool
+                    checkedOut:
+                      type: integer
+                      description: The number of connections currently in use
+                    overflow:
+                      type: integer
+                      description: The number of connections opened beyond the size of the pool
+              examples:
+                example-1:
+                  s1: { size: 5, checkedIn: 1, checkedOut: 0, overflow: -4 }
+    """
+    return make_response(postgis.poolStatus(), 200)
+
 
 def post_ingest_endpoint(wks_flag=False):
     form = IngestForm(**request.form)
@@ -308,6 +512,19 @@ def post_ingest_endpoint(wks_flag=False):
 
     replace = distutils.util.strtobool(form.replace) if not isinstance(form.replace, bool) else form.replace
     read_options = {opt: getattr(form, opt) for opt in ['encoding', 'crs'] if getattr(form, opt) is not None}
+    ingest_options = {opt: getattr(form, opt) for opt in ['loader', 'parallelism'] if getattr(form, opt) is not None}
+    if 'parallelism' in ingest_options:
+        ingest_options['parallelism'] = int(ingest_options['parallelism'])
+    if form.engine is not None:
+        ingest_options['read_engine'] = form.engine
+    if form.force2d is not None:
+        ingest_options['force_2d'] = distutils.util.strtobool(form.force2d) if not isinstance(form.force2d, bool) else form.force2d
+    if wks_flag and form.wks is not None:
+        ingest_options['wks'] = form.wks
+        if form.mapping is not None:
+            ingest_options['wks_mapping'] = json.loads(form.mapping) if not isinstance(form.mapping, dict) else form.mapping
+    if wks_flag and form.lenient is not None:
+        ingest_options['wks_lenient'] = distutils.util.strtobool(form.lenient) if not isinstance(form.lenient, bool) else form.lenient
 
     ticket = session['ticket']
     mainLogger.info("Starting {} request with ticket {}.".format(form.response, ticket))
@@ -329,15 +546,21 @@ def post_ingest_endpoint(wks_flag=False):
         g.response_type = 'prompt'
         try:
             result = _ingest(src_file, ticket, table_name, schema, shard, csv_geom_column_name,
-                             replace=replace, match_into_wks=wks_flag, **read_options)
+                             replace=replace, match_into_wks=wks_flag,
+                             report_progress=partial(_recordProgress, ticket),
+                             **ingest_options, **read_options)
         except Exception as e:
             return make_response({ 'error': str(e) }, 400)
         return make_response({**result, "type": form.response}, 200)
     else:
         g.response_type = 'deferred'
-        future = executor.submit(enqueue, src_file, ticket, table_name, schema, shard, csv_geom_column_name,
-                                 replace=replace, match_into_wks=wks_flag, **read_options)
-        future.add_done_callback(_executorCallback)
+        payload = dict(src_file=src_file, tablename=table_name, schema=schema, shard=shard,
+                       csv_geom_column_name=csv_geom_column_name, replace=replace, match_into_wks=wks_flag,
+                       **ingest_options, **read_options)
+        priority = _jobPriority(src_file, form.priority)
+        db_enqueue_job(ticket, json.dumps(payload), priority=priority, shard=shard, workspace=schema)
+        if queue_worker is not None:
+            queue_worker.notify()
         return make_response({"ticket": ticket, "status": "/status/{}".format(ticket), "type": form.response}, 202)
 
 
@@ -373,6 +596,10 @@ def ingest_wks():
                       enum: [prompt, deferred]
                       default: prompt
                       description: Determines whether the proccess should be promptly initiated (*prompt*) or queued (*deferred*). In the first case, the response waits for the result, in the second the response is immediate returning a ticket corresponding to the request.
+                    priority:
+                      type: string
+                      enum: [high, normal, low]
+                      description: The priority class of a deferred request; pending requests of higher priority are processed first. If not given, the class is decided by the size of the file (small files first).
                     table:
                       type: string
                       description: The name of the (new) table into which the data will be ingested
@@ -395,6 +622,33 @@ def ingest_wks():
                     geom:
                       type: string
                       description: The column name that contains the geometric information (In the case of a csv file)
+                    engine:
+                      type: string
+                      enum: [fiona, pyogrio]
+                      description: The engine reading vector (non-CSV) files; `fiona` reads feature by feature, `pyogrio` reads columnar batches from the GDAL Arrow stream (requires pyogrio and pyarrow). If not given, the service default is used.
+                    loader:
+                      type: string
+                      enum: [to_sql, copy, copy_binary]
+                      description: The engine writing data into the database; `to_sql` uses INSERT statements, `copy` and `copy_binary` stream data with COPY (in text or binary format). If not given, the service default is used.
+                    parallelism:
+                      type: integer
+                      minimum: 1
+                      default: 1
+                      description: The number of workers converting and loading chunks of data in parallel (each over a separate database connection); at most the configured maximum (`POSTGIS_MAX_PARALLELISM`).
+                    force2d:
+                      type: boolean
+                      description: Whether Z/M dimensions should be dropped from geometries. If not given, dimensions are dropped only for KML files.
+                    wks:
+                      type: string
+                      description: The name of the well known schema to match into. If not given, the best-matching schema is used (see `POST /ingest_wks/preview`).
+                    mapping:
+                      type: string
+                      description: A JSON object mapping columns of the well known schema (keys) to columns of the dataset (values); requires `wks`. If given, no matching is performed.
+                      example: '{"NAME": "name", "CATEGORY": "type"}'
+                    lenient:
+                      type: boolean
+                      default: false
+                      description: Whether values that cannot be cast into the declared types of the well known schema are set to null (and counted in the log); by default, such a value fails the ingest.
                   required:
                     - resource
                     - table
@@ -411,6 +665,10 @@ def ingest_wks():
                       enum: [prompt, deferred]
                       default: prompt
                       description: Determines whether the proccess should be promptly initiated (*prompt*) or queued (*deferred*). In the first case, the response waits for the result, in the second the response is immediate returning a ticket corresponding to the request.
+                    priority:
+                      type: string
+                      enum: [high, normal, low]
+                      description: The priority class of a deferred request; pending requests of higher priority are processed first. If not given, the class is decided by the size of the file (small files first).
                     table:
                       type: string
                       description: The name of the (new) table into which the data will be ingested
@@ -430,6 +688,33 @@ def ingest_wks():
                     crs:
                       type: string
                       description: CRS of the dataset.
+                    engine:
+                      type: string
+                      enum: [fiona, pyogrio]
+                      description: The engine reading vector (non-CSV) files; `fiona` reads feature by feature, `pyogrio` reads columnar batches from the GDAL Arrow stream (requires pyogrio and pyarrow). If not given, the service default is used.
+                    loader:
+                      type: string
+                      enum: [to_sql, copy, copy_binary]
+                      description: The engine writing data into the database; `to_sql` uses INSERT statements, `copy` and `copy_binary` stream data with COPY (in text or binary format). If not given, the service default is used.
+                    parallelism:
+                      type: integer
+                      minimum: 1
+                      default: 1
+                      description: The number of workers converting and loading chunks of data in parallel (each over a separate database connection); at most the configured maximum (`POSTGIS_MAX_PARALLELISM`).
+                    force2d:
+                      type: boolean
+                      description: Whether Z/M dimensions should be dropped from geometries. If not given, dimensions are dropped only for KML files.
+                    wks:
+                      type: string
+                      description: The name of the well known schema to match into. If not given, the best-matching schema is used (see `POST /ingest_wks/preview`).
+                    mapping:
+                      type: string
+                      description: A JSON object mapping columns of the well known schema (keys) to columns of the dataset (values); requires `wks`. If given, no matching is performed.
+                      example: '{"NAME": "name", "CATEGORY": "type"}'
+                    lenient:
+                      type: boolean
+                      default: false
+                      description: Whether values that cannot be cast into the declared types of the well known schema are set to null (and counted in the log); by default, such a value fails the ingest.
                   required:
                     - resource
                     - table
@@ -454,6 +739,14 @@ def ingest_wks():
                         type: integer
                         description: The number of features stored in the table.
                         example: 539
+                      loadTime:
+                        type: number
+                        description: The time (in seconds) spent loading data into the table.
+                        example: 2.815
+                      indexTime:
+                        type: number
+                        description: The time (in seconds) spent building indices (null if none were built).
+                        example: 0.427
                       type:
                         type: string
                         description: The response type as requested.
@@ -507,6 +800,149 @@ def ingest_wks():
     return post_ingest_endpoint(wks_flag=True)
 
 
+@app.route("/ingest_wks/preview", methods=["POST"])
+def previewWks():
+    """Preview the matching of a dataset into well known schemata.
+    ---
+    post:
+      summary: Match the header (and a small sample of rows) of a vector file into well known schemata.
+      description: Only the header and a small sample of rows are read. Results are cached by the header signature (column names and types) of the dataset. A schema and a mapping may then be passed explicitly to `POST /ingest_wks`.
+      tags:
+        - Ingest
+      operationId: 'previewWks'
+      requestBody:
+        required: true
+        content:
+          multipart/form-data:
+            schema:
+              type: object
+              properties:
+                resource:
+                  type: string
+                  format: binary
+                  description: The vector file.
+                encoding:
+                  type: string
+                  description: File encoding.
+              required:
+                - resource
+          application/x-www-form-urlencoded:
+            schema:
+              type: object
+              properties:
+                resource:
+                  type: string
+                  description: The vector file resolvable path.
+                encoding:
+                  type: string
+                  description: File encoding.
+              required:
+                - resource
+      responses:
+        200:
+          description: The ranked matches into well known schemata.
+          content:
+            application/json:
+              schema:
+                type: object
+                properties:
+                  signature:
+                    type: string
+                    description: The header signature of the dataset.
+                  columns:
+                    type: array
+                    description: The columns (attributes) of the dataset.
+                    items:
+                      type: string
+                  matches:
+                    type: array
+                    description: The matches, best first.
+                    items:
+                      type: object
+                      properties:
+                        schema:
+                          type: string
+                          description: The name of the well known schema.
+                        title:
+                          type: string
+                          description: The title of the well known schema.
+                        score:
+                          type: number
+                          description: The total similarity of matched columns.
+                        matched:
+                          type: integer
+                          description: The number of matched columns.
+                        mapping:
+                          type: object
+                          description: The columns of the dataset (values) keyed on the matched columns of the schema.
+                          additionalProperties:
+                            type: string
+              examples:
+                example-1:
+                  signature: "0b7a6e3d52f3c1b2a3e2d1f0c9b8a7e6"
+                  columns: [osm_id, name, category]
+                  matches: [{ schema: osm_pois, title: OSM POIs, score: 2.71, matched: 3, mapping: { ID: osm_id, NAME: name, CATEGORY: category } }]
+        400:
+          description: Encountered a validation error
+          content:
+            application/json:
+              schema:
+                type: object
+                properties:
+                  error:
+                    type: string
+                    description: A error message for the entire request
+                  errors:
+                    type: object
+                    description: A map of validation errors keyed on a request parameter
+                    additionalProperties:
+                      type: array
+                      items:
+                        type: string
+        404:
+          description: The resource was not found.
+          content:
+            application/json:
+              schema:
+                type: object
+                properties:
+                  error:
+                    type: string
+                    description: A error message
+    """
+    form = PreviewForm(**request.form)
+    if not form.validate():
+        return make_response({'errors': form.errors}, 400)
+
+    working_path = path.join(_getTempDir(), __name__, 'preview-' + uuid4().hex)
+    try:
+        if request.values.get('resource') is not None:
+            src_file = path.join(environ['INPUT_DIR'], form.resource)
+        else:
+            resource = request.files.get('resource')
+            if resource is None:
+                return make_response({'errors': {'resource': ['expected a file upload field']}}, 400)
+            src_path = path.join(working_path, 'src')
+            _makeDir(src_path)
+            src_file = path.join(src_path, secure_filename(resource.filename))
+            resource.save(src_file)
+        try:
+            sample = readPreviewSample(src_file, path.join(working_path, 'extracted'), encoding=form.encoding)
+            matches = wks_registry.rank(sample, cached=True, **postgis.wks_options)
+        except FileNotFoundError as e:
+            return make_response({'error': str(e)}, 404)
+        except Exception as e:
+            return make_response({'error': str(e)}, 400)
+    finally:
+        rmtree(working_path, ignore_errors=True)
+
+    return make_response({
+        'signature': headerSignature(sample),
+        'columns': [str(c) for c in sample.columns],
+        'matches': [m.asDict() for m in matches],
+    }, 200)
+
+
 @app.route("/ingest", methods=["POST"])
 def ingest():
     """The ingest endpoint.
@@ -539,6 +975,10 @@ def ingest():
                   enum: [prompt, deferred]
                   default: prompt
                   description: Determines whether the proccess should be promptly initiated (*prompt*) or queued (*deferred*). In the first case, the response waits for the result, in the second the response is immediate returning a ticket corresponding to the request.
+                priority:
+                  type: string
+                  enum: [high, normal, low]
+                  description: The priority class of a deferred request; pending requests of higher priority are processed first. If not given, the class is decided by the size of the file (small files first).
                 table:
                   type: string
                   description: The name of the (new) table into which the data will be ingested
@@ -561,6 +1001,22 @@ def ingest():
                 geom:
                   type: string
                   description: The column name that contains the geometric information (In the case of a csv file)
+                engine:
+                  type: string
+                  enum: [fiona, pyogrio]
+                  description: The engine reading vector (non-CSV) files; `fiona` reads feature by feature, `pyogrio` reads columnar batches from the GDAL Arrow stream (requires pyogrio and pyarrow). If not given, the service default is used.
+                loader:
+                  type: string
+                  enum: [to_sql, copy, copy_binary]
+                  description: The engine writing data into the database; `to_sql` uses INSERT statements, `copy` and `copy_binary` stream data with COPY (in text or binary format). If not given, the service default is used.
+                parallelism:
+                  type: integer
+                  minimum: 1
+                  default: 1
+                  description: The number of workers converting and loading chunks of data in parallel (each over a separate database connection); at most the configured maximum (`POSTGIS_MAX_PARALLELISM`).
+                force2d:
+                  type: boolean
+                  description: Whether Z/M dimensions should be dropped from geometries. If not given, dimensions are dropped only for KML files.
               required:
                 - resource
                 - table
@@ -577,6 +1033,10 @@ def ingest():
                   enum: [prompt, deferred]
                   default: prompt
                   description: Determines whether the proccess should be promptly initiated (*prompt*) or queued (*deferred*). In the first case, the response waits for the result, in the second the response is immediate returning a ticket corresponding to the request.
+                priority:
+                  type: string
+                  enum: [high, normal, low]
+                  description: The priority class of a deferred request; pending requests of higher priority are processed first. If not given, the class is decided by the size of the file (small files first).
                 table:
                   type: string
                   description: The name of the (new) table into which the data will be ingested
@@ -596,6 +1056,22 @@ def ingest():
                 crs:
                   type: string
                   description: CRS of the dataset.
+                engine:
+                  type: string
+                  enum: [fiona, pyogrio]
+                  description: The engine reading vector (non-CSV) files; `fiona` reads feature by feature, `pyogrio` reads columnar batches from the GDAL Arrow stream (requires pyogrio and pyarrow). If not given, the service default is used.
+                loader:
+                  type: string
+                  enum: [to_sql, copy, copy_binary]
+                  description: The engine writing data into the database; `to_sql` uses INSERT statements, `copy` and `copy_binary` stream data with COPY (in text or binary format). If not given, the service default is used.
+                parallelism:
+                  type: integer
+                  minimum: 1
+                  default: 1
+                  description: The number of workers converting and loading chunks of data in parallel (each over a separate database connection); at most the configured maximum (`POSTGIS_MAX_PARALLELISM`).
+                force2d:
+                  type: boolean
+                  description: Whether Z/M dimensions should be dropped from geometries. If not given, dimensions are dropped only for KML files.
               required:
                 - resource
                 - table
@@ -620,6 +1096,14 @@ def ingest():
                     type: integer
                     description: The number of features stored in the table.
                     example: 539
+                  loadTime:
+                    type: number
+                    description: The time (in seconds) spent loading data into the table.
+                    example: 2.815
+                  indexTime:
+                    type: number
+                    description: The time (in seconds) spent building indices (null if none were built).
+                    example: 0.427
                   type:
                     type: string
                     description: The response type as requested.
@@ -910,6 +1394,13 @@ def status(ticket):
           required: true
           schema:
             type: string
+        - name: wait
+          in: query
+          description: If given (and the process is not completed), wait (up to this number of seconds, and up to the maximum wait of the service) until the status or the progress of the process changes, before responding (long polling). If the service is already serving the maximum number of waiting requests, it responds immediately.
+          required: false
+          schema:
+            type: number
+            minimum: 0
       responses:
         200:
           description: Ticket found and status returned.
@@ -934,6 +1425,36 @@ def status(ticket):
                   executionTime:
                     type: integer
                     description: The execution time in seconds.
+                  loadTime:
+                    type: number
+                    description: The time (in seconds) spent loading data, for a completed ingest.
+                  indexTime:
+                    type: number
+                    description: The time (in seconds) spent building indices, for a completed ingest.
+                  progress:
+                    type: object
+                    description: The progress of a process (updated periodically while it runs).
+                    properties:
+                      stage:
+                        type: string
+                        enum: [queued, preparing, reading, matching, loading, indexing, committing]
+                        description: The current stage of the process.
+                      rows:
+                        type: integer
+                        description: The number of rows loaded so far.
+                      bytes:
+                        type: integer
+                        description: The number of bytes read so far (may be estimated).
+                      totalRows:
+                        type: integer
+                        description: The (estimated) total number of rows, if known.
+                      totalBytes:
+                        type: integer
+                        description: The total number of bytes to be read, if known.
+                      updated:
+                        type: string
+                        format: datetime
+                        description: The timestamp of the last update.
         404:
           description: Ticket not found
         400:
@@ -941,17 +1462,95 @@ def status(ticket):
     """
     if ticket is None:
         return make_response({ 'error': 'Ticket is missing' }, 400)
-    queue = Queue().get(ticket=ticket)
+    try:
+        wait = min(float(request.args.get('wait', 0)), app.config['STATUS_MAX_WAIT'])
+    except ValueError:
+        return make_response({ 'error': 'Parameter wait must be a number (of seconds)' }, 400)
+    if wait <= 0:
+        queue = Queue().get(ticket=ticket)
+        if queue is None:
+            return make_response({ 'error': 'No job found for ticket [{0}]'.format(ticket) }, 404)
+        return make_response(_statusInfo(queue), 200)
+
+    # Watch before reading, so that no change is missed
+    try:
+        watch = queue_listener.watch(ticket)
+    except TooManyWatchers:
+        # Degrade to an immediate response, rather than holding one more thread
+        watch = None
+    with (watch or nullcontext()):
+        queue = _readStatus(ticket)
+        if queue is not None and not queue['completed'] and watch is not None:
+            watch.wait(wait)
+            queue = _readStatus(ticket)
     if queue is None:
         return make_response({ 'error': 'No job found for ticket [{0}]'.format(ticket) }, 404)
-    info = {
-        "completed": queue['completed'],
-        "success": queue['success'],
-        "requested": queue['initiated'].isoformat(),
-        "executionTime": queue['execution_time'],
-        "comment": queue['error_msg'],
-    }
-    return make_response(info, 200)
+    return make_response(_statusInfo(queue), 200)
+
+@app.route("/status/<ticket>/events")
+def statusEvents(ticket):
+    """Stream the status of a specific ticket (Server-Sent Events).
+    ---
+    get:
+      summary: Stream the status of a request.
+      operationId: getStatusEvents
+      description: Streams (as Server-Sent Events) the status of a request corresponding to a specific ticket. An event (of type `status`) is sent with the current status, and then on every change of the status (or the progress) of the process; the stream ends after the process is completed (or after the maximum duration of a stream, so that the client should reconnect).
+      tags:
+        - Status
+      parameters:
+        - name: ticket
+          in: path
+          description: The ticket of the request
+          required: true
+          schema:
+            type: string
+      responses:
+        200:
+          description: Ticket found and status streamed; the data of each event is the status (as returned by `/status/{ticket}`).
+          content:
+            text/event-stream:
+              schema:
+                type: string
+        404:
+          description: Ticket not found
+        503:
+          description: The service is already serving the maximum number of streams (or waiting requests); the client should poll `/status/{ticket}` instead, or retry later.
+    """
+    if Queue().get(ticket=ticket) is None:
+        return make_response({ 'error': 'No job found for ticket [{0}]'.format(ticket) }, 404)
+    db.session.remove()
+    try:
+        watch = queue_listener.watch(ticket)
+    except TooManyWatchers:
+        return make_response({ 'error': 'Too many status streams; poll /status/{0} instead'.format(ticket) }, 503,
+                             {'Retry-After': str(STATUS_KEEPALIVE_INTERVAL)})
+
+    def events():
+        deadline = time.monotonic() + app.config['STATUS_STREAM_TIMEOUT']
+        sent = None
+        with watch:
+            while True:
+                queue = _readStatus(ticket)
+                if queue is None:
+                    # The record was deleted meanwhile
+                    yield 'event: error\ndata: {0}\n\n'.format(json.dumps({'error': 'No job found for ticket [{0}]'.format(ticket)}))
+                    break
+                info = _statusInfo(queue)
+                if info != sent:
+                    yield 'event: status\ndata: {0}\n\n'.format(json.dumps(info))
+                    sent = info
+                remaining = deadline - time.monotonic()
+                if queue['completed'] or remaining <= 0:
+                    break
+                if not watch.wait(min(remaining, STATUS_KEEPALIVE_INTERVAL)):
+                    # Keep the connection open (through proxies)
+                    yield ': keep-alive\n\n'
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Release the watch even if the stream is never iterated (e.g. the client went away)
+    response.call_on_close(watch.close)
+    return response
 
 @app.route("/result/<ticket>")
 def result(ticket):
@@ -986,6 +1585,12 @@ def result(ticket):
                   length:
                     type: integer
                     description: The number of features stored in the table.
+                  loadTime:
+                    type: number
+                    description: The time (in seconds) spent loading data into the table.
+                  indexTime:
+                    type: number
+                    description: The time (in seconds) spent building indices (null if none were built).
         404:
           description: Ticket not found or ingest has not been completed.
         400:
@@ -1042,17 +1647,20 @@ def getTicketByKey(key):
 
 with app.test_request_context():
     spec.path(view=ingest)
+    spec.path(view=previewWks)
     spec.path(view=publish)
     spec.path(view=status)
+    spec.path(view=statusEvents)
     spec.path(view=result)
     spec.path(view=healthCheck)
+    spec.path(view=poolStatus)
     spec.path(view=getTicketByKey)
     spec.path(view=drop)
     spec.path(view=unpublish)
 
 
 def _ingest(src_file, ticket, tablename, schema, shard=None, csv_geom_column_name=None, replace=False,
-            match_into_wks=False, **kwargs):
+            match_into_wks=False, report_progress=None, **kwargs):
     """Ingest file content to PostgreSQL and publish to geoserver.
 
     Parameters:
@@ -1064,30 +1672,25 @@ def _ingest(src_file, ticket, tablename, schema, shard=None, csv_geom_column_nam
         csv_geom_column_name (str): The geometric column name in the case of a csv file
         replace (bool, optional): if True, the table will be replaced if it exists.
         match_into_wks (bool, optional): If True, the table will be attempted to be matched into a well known schema
+        report_progress (callable, optional): A function reporting the progress (see `Progress`).
         **kwargs: additional arguments for GeoPandas read file.
 
     Returns:
-        (dict) Schema, table name and length.
+        (dict) Schema, table name, length, and the time (in seconds) spent loading data and building indices.
     """
     
     global postgis
     
-    # Check if source file is compressed
+    progress = Progress(report_progress, interval=app.config['PROGRESS_INTERVAL'])
+    progress.start('preparing')
+
+    # Check if source file is an archive (datasets are read in place, if possible)
     working_path = _getWorkingPath(ticket)
-    src_path = path.join(working_path, 'extracted')
-    if tarfile.is_tarfile(src_file):
-        handle = tarfile.open(src_file)
-        handle.extractall(src_path)
-        src_file = src_path
-        handle.close()
-    elif zipfile.is_zipfile(src_file):
-        with zipfile.ZipFile(src_file, 'r') as handle:
-            handle.extractall(src_path)
-        src_file = src_path
+    src_file = resolveSource(src_file, path.join(working_path, 'extracted'))
     
     try:
         result = postgis.ingest(src_file, tablename, schema, shard, csv_geom_column_name, replace=replace,
-                                match_into_wks=match_into_wks**kwargs)
+                                match_into_wks=match_into_wks, progress=progress, **kwargs)
     except Exception as e:
         mainLogger.error("Failed to ingest %s into PostGIS table \"%s\".\"%s\" on shard [%s]: %s",
                          src_file, schema, tablename, shard or '', str(e))
@@ -1102,7 +1705,9 @@ def _ingest(src_file, ticket, tablename, schema, shard=None, csv_geom_column_nam
         mainLogger.warning("Failed to clean temporary files [ticket=%s]: %s", ticket, str(e))
         pass
     
-    return dict(zip(('schema', 'table', 'length'), result))
+    schema, table, rows, load_time, index_time = result
+    return {'schema': schema, 'table': table, 'length': rows, 'loadTime': round(load_time, 3),
+            'indexTime': round(index_time, 3) if index_time is not None else None}
 
 def _getGeoserverServiceEndpoints(workspace, layer):
     """Form GeoServer WMS/WFS endpoints.
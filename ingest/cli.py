@@ -5,7 +5,28 @@ import click
 def init_db():
 	"""Initialize database."""
 	from ingest.database import db
+	from ingest.database.model import UPGRADE_DDL
 	db.create_all()
+	# Upgrade tables created by older versions
+	with db.engine.begin() as conn:
+		for statement in UPGRADE_DDL:
+			conn.execute(db.text(statement))
+
+@app.cli.command()
+@click.option("--threads", default=None, type=int, help="The number of jobs processed concurrently (default: QUEUE_WORKERS).")
+def worker(threads):
+	"""Process deferred jobs of the queue table (in the foreground)."""
+	import signal
+	from ingest.app import makeQueueWorker
+	queue_worker = makeQueueWorker(threads)
+	# Stop claiming jobs on SIGTERM (as on Ctrl-C), and wait for the running ones
+	signal.signal(signal.SIGTERM, signal.default_int_handler)
+	try:
+		queue_worker.run()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		queue_worker.stop()
 
 @app.cli.command()
 @click.argument("path")
@@ -20,3 +41,36 @@ def create_doc(path):
     with open(path, 'w') as specfile:
         json.dump(spec.to_dict(), specfile)
     print("Wrote OpenAPI specification to {path}.".format(path=path))
+
+@app.cli.command()
+@click.argument("path")
+@click.option("--engine", "engines", multiple=True, help="A read engine to benchmark (default: all engines).")
+@click.option("--chunksize", default=5000, show_default=True, help="The number of features in each chunk.")
+@click.option("--repeat", default=3, show_default=True, help="The number of runs for each engine.")
+def benchmark_read(path, engines, chunksize, repeat):
+	"""Compare the read engines on a vector file.
+
+	Every engine reads the whole file (in chunks) a number of times; the best time is reported.
+
+	Arguments:
+		path (str): The path of the vector file (or archive).
+	"""
+	import tempfile
+	import time
+	from ingest.readers import AVAILABLE_READ_ENGINES, readVectorChunks, resolveSource
+	with tempfile.TemporaryDirectory() as extract_dir:
+		source = resolveSource(path, extract_dir)
+		for engine in (engines or AVAILABLE_READ_ENGINES):
+			timings = []
+			rows = 0
+			try:
+				for _ in range(max(1, repeat)):
+					started = time.perf_counter()
+					rows = sum(len(df) for df in readVectorChunks(source, chunksize, engine=engine))
+					timings.append(time.perf_counter() - started)
+			except Exception as e:
+				print("{engine:>10}: failed: {error}".format(engine=engine, error=e))
+				continue
+			best = min(timings)
+			print("{engine:>10}: {rows} rows in {best:.3f}s (best of {n}), {rate:.0f} rows/s".format(
+				engine=engine, rows=rows, best=best, n=len(timings), rate=(rows / best if best > 0 else 0)))
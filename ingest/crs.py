@@ -0,0 +1,55 @@
+"""A process-wide cache for resolving coordinate reference systems.
+
+Building a `pyproj.CRS` from user input (and, even more, identifying its EPSG code) may be
+expensive, so resolved CRS objects and SRIDs are kept in LRU caches shared by the whole process.
+"""
+
+from functools import lru_cache
+
+DEFAULT_SRID = 4326
+
+
+def _normalize(value):
+    """Normalize user input, so that e.g. `4326` and `'4326'` share a cache entry."""
+    if isinstance(value, str):
+        value = value.strip()
+    try:
+        # parse as an integer EPSG code
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+@lru_cache(maxsize=256)
+def _resolve(value):
+    import pyproj
+    crs = pyproj.crs.CRS.from_user_input(value)
+    return (crs, _sridFromWkt(crs.to_wkt()))
+
+
+@lru_cache(maxsize=256)
+def _sridFromWkt(wkt):
+    import pyproj
+    return pyproj.crs.CRS.from_wkt(wkt).to_epsg()
+
+
+def resolveCrs(value):
+    """Resolve a CRS from user input.
+
+    Parameters:
+        value (str|int): An EPSG code, or any other input understood by `pyproj.CRS.from_user_input`.
+
+    Raises:
+        pyproj.exceptions.CRSError: If the input cannot be parsed as a CRS.
+
+    Returns:
+        (tuple) The CRS object and its SRID (None if no EPSG code can be identified)
+    """
+    return _resolve(_normalize(value))
+
+
+def sridFor(crs):
+    """Return the SRID of a CRS object (`DEFAULT_SRID` if no CRS is given)."""
+    if crs is None:
+        return DEFAULT_SRID
+    return _sridFromWkt(crs.to_wkt())
@@ -3,9 +3,17 @@
 from . import db
 from .model import *
 
+QUEUE_CHANNEL = 'ingest_queue'
+"""The channel notified (with the ticket as payload) on every change of the status of a process"""
+
 class DBItemNotFound(Exception):
     """Raised when an item not found on update."""
 
+def _notify(*tickets):
+    """Notify the changes of processes (delivered when the current transaction commits)."""
+    for ticket in tickets:
+        db.session.execute(db.text("SELECT pg_notify(:channel, :ticket)"), {'channel': QUEUE_CHANNEL, 'ticket': ticket})
+
 def db_queue(**data):
     """Add a record to queue table.
 
@@ -22,13 +30,20 @@ def db_queue(**data):
     db.session.commit()
     return dict(queue)
 
-def db_update_queue_status(ticket, **data):
+def db_update_queue_status(ticket, worker=None, **data):
     """Update Queue status.
 
+    If a worker is given, the process is updated only if it is (still) claimed by this worker; e.g. a job
+    that was released (as stale) and claimed again is only completed by its last claimer.
+
     Arguments:
         ticket (str): Request ticket.
+        worker (str): The identifier of the worker processing the (deferred) job.
         **data: Data to update.
 
+    Returns:
+        The updated record, or None if the job is not claimed by the given worker (or already completed).
+
     Raises:
         DBItemNotFound -- Ticket not found in table.
     """
@@ -36,14 +51,45 @@ def db_update_queue_status(ticket, **data):
     elem = Queue.query.filter_by(ticket=ticket).first()
     if elem is None:
         raise DBItemNotFound("Item with ticket '{}' not found in table queue.".format(ticket))
+    if worker is not None:
+        # Lock the record, so that a concurrent release (or claim) is seen
+        elem = Queue.query.filter_by(ticket=ticket, claimed_by=worker, completed=False).with_for_update().first()
+        if elem is None:
+            db.session.rollback()
+            return None
     for key in data.keys():
         setattr(elem, key, data[key])
     elem.execution_time = (datetime.now(timezone.utc) - elem.initiated).total_seconds()
     db.session.add(elem)
+    _notify(ticket)
     db.session.commit()
 
     return elem
 
+def db_update_queue_progress(ticket, stage=None, rows=None, bytes=None, total_rows=None, total_bytes=None, worker=None):
+    """Update the progress of a (running) process.
+
+    Unlike `db_update_queue_status`, the execution time is not updated; a completed process is left untouched.
+
+    Arguments:
+        ticket (str): Request ticket.
+        stage (str): The current stage.
+        rows (int): The number of rows processed so far.
+        bytes (int): The number of bytes read so far.
+        total_rows (int): The (estimated) total number of rows.
+        total_bytes (int): The total number of bytes.
+        worker (str): If given, the process is updated only if it is (still) claimed by this worker.
+    """
+    query = Queue.query.filter_by(ticket=ticket, completed=False)
+    if worker is not None:
+        query = query.filter_by(claimed_by=worker)
+    query.update({
+        'progress_stage': stage, 'progress_rows': rows, 'progress_bytes': bytes,
+        'progress_total_rows': total_rows, 'progress_total_bytes': total_bytes, 'progress_at': db.func.now(),
+    }, synchronize_session=False)
+    _notify(ticket)
+    db.session.commit()
+
 def db_get_active_jobs():
     """Returns a list with all the active jobs.
 
@@ -59,3 +105,120 @@ def db_get_active_jobs():
         .all()
 
     return [dict(zip(['ticket', 'idempotencyKey', 'requestType', 'initiated'], job)) for job in jobs]
+
+def db_enqueue_job(ticket, payload, priority=PRIORITY_CLASSES['normal'], shard=None, workspace=None):
+    """Turn a queue record into a deferred job, to be claimed by a worker.
+
+    Arguments:
+        ticket (str): Request ticket.
+        payload (str): The arguments of the job (as JSON).
+        priority (int): The priority of the job (see `PRIORITY_CLASSES`).
+        shard (str): The shard the job writes into.
+        workspace (str): The workspace the job writes into.
+
+    Raises:
+        DBItemNotFound -- Ticket not found in table.
+    """
+    elem = Queue.query.filter_by(ticket=ticket).first()
+    if elem is None:
+        raise DBItemNotFound("Item with ticket '{}' not found in table queue.".format(ticket))
+    elem.payload = payload
+    elem.priority = priority
+    elem.shard = shard
+    elem.workspace = workspace
+    db.session.add(elem)
+    db.session.commit()
+
+_CLAIM_LOCK = 0x696e67657374
+"""The key of the advisory lock serializing claims (so that concurrency limits are respected among workers)"""
+
+def db_claim_job(worker, max_priority=None, max_per_shard=None, max_per_workspace=None):
+    """Claim the pending job of the highest priority (the oldest one, among jobs of the same priority).
+
+    Pending jobs are locked with SKIP LOCKED, so that concurrent workers (of any process or node)
+    never claim the same job. If concurrency limits are given, jobs writing into a shard (or a workspace)
+    that already has as many running jobs (of all workers) are skipped; claims are serialized then,
+    so that concurrent claims do not exceed the limits.
+
+    Arguments:
+        worker (str): The identifier of the claiming worker.
+        max_priority (int): If given, only jobs of this priority (or higher) are claimed.
+        max_per_shard (int): The maximum number of running jobs per shard.
+        max_per_workspace (int): The maximum number of running jobs per workspace (of a shard).
+
+    Returns:
+        (tuple): The ticket, the payload and the priority of the claimed job, or None if no job is pending.
+    """
+    conditions = ["NOT q.completed", "q.payload IS NOT NULL", "q.claimed_by IS NULL"]
+    params = {'worker': worker}
+    running = "SELECT count(*) FROM ingest_queue r WHERE NOT r.completed AND r.claimed_by IS NOT NULL"
+    if max_priority is not None:
+        conditions.append("q.priority <= :max_priority")
+        params['max_priority'] = max_priority
+    if max_per_shard:
+        conditions.append("(" + running + " AND r.shard IS NOT DISTINCT FROM q.shard) < :max_per_shard")
+        params['max_per_shard'] = max_per_shard
+    if max_per_workspace:
+        conditions.append("(" + running + " AND r.shard IS NOT DISTINCT FROM q.shard AND r.workspace IS NOT DISTINCT FROM q.workspace) < :max_per_workspace")
+        params['max_per_workspace'] = max_per_workspace
+    if max_per_shard or max_per_workspace:
+        db.session.execute(db.text("SELECT pg_advisory_xact_lock(:key)"), {'key': _CLAIM_LOCK})
+    sql = db.text(
+        "UPDATE ingest_queue SET claimed_by = :worker, claimed_at = now(), heartbeat_at = now(), attempts = attempts + 1 "
+        ", progress_stage = NULL, progress_rows = NULL, progress_bytes = NULL, progress_total_rows = NULL, "
+        "  progress_total_bytes = NULL, progress_at = NULL "
+        "WHERE id = ("
+        "  SELECT q.id FROM ingest_queue q WHERE " + " AND ".join(conditions) +
+        "  ORDER BY q.priority, q.id LIMIT 1 FOR UPDATE SKIP LOCKED) "
+        "RETURNING ticket, payload, priority")
+    row = db.session.execute(sql, params).first()
+    if row is not None:
+        _notify(row[0])
+    db.session.commit()
+    return tuple(row) if row is not None else None
+
+def db_heartbeat_jobs(worker, tickets):
+    """Record a heartbeat for the jobs claimed by a worker.
+
+    Arguments:
+        worker (str): The identifier of the worker.
+        tickets (list): The tickets of the jobs being processed by the worker.
+
+    Returns:
+        (list): The tickets (of the given ones) that are still claimed by the worker.
+    """
+    if not tickets:
+        return []
+    sql = db.text(
+        "UPDATE ingest_queue SET heartbeat_at = now() "
+        "WHERE claimed_by = :worker AND NOT completed AND ticket = ANY(:tickets) RETURNING ticket")
+    claimed = [ticket for (ticket,) in db.session.execute(sql, {'worker': worker, 'tickets': list(tickets)})]
+    db.session.commit()
+    return claimed
+
+def db_requeue_stale_jobs(stale_after, max_attempts):
+    """Release the jobs whose worker has stopped sending heartbeats (e.g. it was killed).
+
+    Released jobs are claimed again, unless they have been already claimed `max_attempts` times;
+    then, they are marked as failed.
+
+    Arguments:
+        stale_after (float): The seconds without a heartbeat after which a claim is stale.
+        max_attempts (int): The maximum number of claims for a job.
+
+    Returns:
+        (tuple): The number of requeued jobs and the number of failed jobs.
+    """
+    stale = "NOT completed AND claimed_by IS NOT NULL AND heartbeat_at < now() - make_interval(secs => :stale_after)"
+    failed = db.session.execute(db.text(
+        "UPDATE ingest_queue SET completed = true, success = false, "
+        "  error_msg = 'Job abandoned after ' || attempts || ' attempts (worker stopped responding)', "
+        "  execution_time = extract(epoch from now() - initiated) "
+        "WHERE " + stale + " AND attempts >= :max_attempts RETURNING ticket"),
+        {'stale_after': stale_after, 'max_attempts': max_attempts}).fetchall()
+    requeued = db.session.execute(db.text(
+        "UPDATE ingest_queue SET claimed_by = NULL, claimed_at = NULL WHERE " + stale + " RETURNING ticket"),
+        {'stale_after': stale_after}).fetchall()
+    _notify(*(ticket for (ticket,) in failed + requeued))
+    db.session.commit()
+    return (len(requeued), len(failed))
@@ -1 +1 @@
-from .queue import Queue
+from .queue import Queue, UPGRADE_DDL, PRIORITY_CLASSES
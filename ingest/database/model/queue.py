@@ -7,6 +7,28 @@ import uuid
 from hashlib import md5
 from ingest.database import db
 
+UPGRADE_DDL = [
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS payload text",
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS claimed_by varchar(255)",
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS claimed_at timestamp with time zone",
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS heartbeat_at timestamp with time zone",
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS attempts integer NOT NULL DEFAULT 0",
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS priority smallint NOT NULL DEFAULT 1",
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS shard varchar(255)",
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS workspace varchar(255)",
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS progress_stage varchar(63)",
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS progress_rows bigint",
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS progress_bytes bigint",
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS progress_total_rows bigint",
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS progress_total_bytes bigint",
+    "ALTER TABLE ingest_queue ADD COLUMN IF NOT EXISTS progress_at timestamp with time zone",
+    "CREATE INDEX IF NOT EXISTS ix_ingest_queue_pending ON ingest_queue (priority, id) WHERE NOT completed AND payload IS NOT NULL",
+]
+"""Statements upgrading a queue table created by an older version (safe to run on an up-to-date table)"""
+
+PRIORITY_CLASSES = {'high': 0, 'normal': 1, 'low': 2}
+"""The priority classes of deferred jobs; pending jobs are claimed in order of priority (lower first)"""
+
 class Queue(db.Model):
     """Queue Model
 
@@ -25,6 +47,20 @@ class Queue(db.Model):
         error_msg (str): The error message in case of failure.
         result (str): The path of the result.
         rows (int): Number of records.
+        payload (str): The arguments (as JSON) of a deferred job; only deferred jobs are claimed by workers.
+        claimed_by (str): The worker processing the job (if claimed).
+        claimed_at (datetime): The timestamp the job was claimed.
+        heartbeat_at (datetime): The last heartbeat of the worker processing the job.
+        attempts (int): The number of times the job has been claimed.
+        priority (int): The priority of the job (see `PRIORITY_CLASSES`).
+        shard (str): The shard a job writes into.
+        workspace (str): The workspace (database schema) a job writes into.
+        progress_stage (str): The current stage of the process.
+        progress_rows (int): The number of rows processed so far.
+        progress_bytes (int): The number of bytes read so far (if known).
+        progress_total_rows (int): The (estimated) total number of rows (if known).
+        progress_total_bytes (int): The total number of bytes to be read (if known).
+        progress_at (datetime): The timestamp of the last progress update.
     """
     __tablename__ = "ingest_queue"
     id = db.Column(db.BigInteger(), primary_key=True)
@@ -38,9 +74,29 @@ class Queue(db.Model):
     error_msg = db.Column(db.Text(), nullable=True)
     result = db.Column(db.Text(), nullable=True)
     rows = db.Column(db.Integer(), nullable=True)
+    payload = db.Column(db.Text(), nullable=True)
+    claimed_by = db.Column(db.String(255), nullable=True)
+    claimed_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    heartbeat_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    attempts = db.Column(db.Integer(), server_default='0', nullable=False)
+    priority = db.Column(db.SmallInteger(), server_default='1', nullable=False)
+    shard = db.Column(db.String(255), nullable=True)
+    workspace = db.Column(db.String(255), nullable=True)
+    progress_stage = db.Column(db.String(63), nullable=True)
+    progress_rows = db.Column(db.BigInteger(), nullable=True)
+    progress_bytes = db.Column(db.BigInteger(), nullable=True)
+    progress_total_rows = db.Column(db.BigInteger(), nullable=True)
+    progress_total_bytes = db.Column(db.BigInteger(), nullable=True)
+    progress_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # Pending (i.e. claimable) deferred jobs
+        db.Index('ix_ingest_queue_pending', 'priority', 'id', postgresql_where=db.text('NOT completed AND payload IS NOT NULL')),
+    )
 
     def __iter__(self):
-        for key in ['ticket', 'idempotency_key', 'request', 'initiated', 'execution_time', 'completed', 'success', 'error_msg', 'result', 'rows']:
+        for key in ['ticket', 'idempotency_key', 'request', 'initiated', 'execution_time', 'completed', 'success', 'error_msg', 'result', 'rows', 'payload', 'claimed_by', 'attempts',
+                    'progress_stage', 'progress_rows', 'progress_bytes', 'progress_total_rows', 'progress_total_bytes', 'progress_at']:
             yield (key, getattr(self, key))
 
     def get(self, **kwargs):
@@ -1,5 +1,11 @@
 from dataclasses import dataclass, field, fields
 
+from .crs import resolveCrs
+from .loaders import LOADERS
+from .postgres import maxParallelism
+from .readers import AVAILABLE_READ_ENGINES
+from .database.model import PRIORITY_CLASSES
+
 class ValidationError(Exception):
     pass
 
@@ -11,17 +17,11 @@ class CRSValidator:
         self.message = message
 
     def __call__(self, field):
-        import pyproj
         from pyproj.exceptions import CRSError
         if field is None:
             return
         try:
-            # parse as an integer EPSG code
-            field = int(field)
-        except ValueError as ex:
-            pass # nevermind, try to parse as string
-        try:
-            pyproj.crs.CRS.from_user_input(field)
+            resolveCrs(field)
         except CRSError as ex:
             raise ValidationError(self.message + ": " + str(ex))
 
@@ -65,6 +65,38 @@ class FileValidator:
         if not os.path.isfile(path) and not os.path.isdir(path):
             raise ValidationError(self.message)
 
+class WellKnownSchemaValidator:
+    """Validates a field as the name of a well known schema."""
+    def __init__(self, message=None):
+        if not message:
+            message = 'Field must be the name of a well known schema'
+        self.message = message
+
+    def __call__(self, field):
+        from .wks import registry
+        if field is None:
+            return
+        if registry.get(field) is None:
+            raise ValidationError(self.message)
+
+class JsonObject:
+    """Validates a field as a JSON object with string values."""
+    def __init__(self, message=None):
+        if not message:
+            message = 'Field must be a JSON object with string values'
+        self.message = message
+
+    def __call__(self, field):
+        import json
+        if field is None or isinstance(field, dict):
+            return
+        try:
+            value = json.loads(field)
+        except ValueError:
+            raise ValidationError(self.message)
+        if not isinstance(value, dict) or not all(isinstance(v, str) for v in value.values()):
+            raise ValidationError(self.message)
+
 class Boolean:
     """Validates a field as a boolean."""
     def __init__(self, message=None):
@@ -74,13 +106,33 @@ class Boolean:
 
     def __call__(self, field):
         import distutils.util
-        if isinstance(field, bool):
+        if field is None or isinstance(field, bool):
             return
         try:
             bool_value = distutils.util.strtobool(field)
         except ValueError:
             raise ValidationError(self.message)
 
+class PositiveInteger:
+    """Validates a field as a positive integer (optionally, not greater than a maximum)."""
+    def __init__(self, maximum=None, message=None):
+        if not message:
+            message = 'Field must be a positive integer'
+            if maximum is not None:
+                message += ' not greater than {}'.format(maximum)
+        self.maximum = maximum
+        self.message = message
+
+    def __call__(self, field):
+        if field is None:
+            return
+        try:
+            value = int(field)
+        except (TypeError, ValueError):
+            raise ValidationError(self.message)
+        if value < 1 or (self.maximum is not None and value > self.maximum):
+            raise ValidationError(self.message)
+
 class Required:
     def __init__(self, message=None):
         if not message:
@@ -137,6 +189,20 @@ class IngestForm(Form):
     encoding: str = field(default='utf-8', metadata={'validate': [EncodingValidator()]})
     crs: str = field(default=None, metadata={'validate': [CRSValidator()]})
     geom: str = field(default=None)
+    loader: str = field(default=None, metadata={'validate': [AnyOf([None, *LOADERS])]})
+    engine: str = field(default=None, metadata={'validate': [AnyOf([None, *AVAILABLE_READ_ENGINES])]})
+    parallelism: int = field(default=None, metadata={'validate': [PositiveInteger(maxParallelism())]})
+    force2d: bool = field(default=None, metadata={'validate': [Boolean()]})
+    wks: str = field(default=None, metadata={'validate': [WellKnownSchemaValidator()]})
+    mapping: str = field(default=None, metadata={'validate': [JsonObject()]})
+    lenient: bool = field(default=None, metadata={'validate': [Boolean()]})
+    priority: str = field(default=None, metadata={'validate': [AnyOf([None, *PRIORITY_CLASSES])]})
+
+
+@dataclass
+class PreviewForm(Form):
+    resource: str = field(default=None, metadata={'validate': [FileValidator()]})
+    encoding: str = field(default='utf-8', metadata={'validate': [EncodingValidator()]})
 
 
 @dataclass
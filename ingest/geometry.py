@@ -0,0 +1,145 @@
+"""Vectorized conversions between geometries and their WKT/WKB encodings.
+
+The conversions operate on whole arrays of geometries, using the vectorized functions of
+Shapely 2, or of PyGEOS (with Shapely 1.x, where GeoPandas itself is backed by PyGEOS; this is
+the pinned production stack). The element-wise loop with Shapely 1.x is only a (slow) fallback,
+for environments without PyGEOS. Missing geometries are mapped to None.
+"""
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from .logging import mainLogger
+logger = mainLogger.getChild('geometry')
+
+try:
+    import pygeos
+    from geopandas._compat import USE_PYGEOS
+except ImportError:
+    pygeos = None
+    USE_PYGEOS = False
+
+if hasattr(shapely, 'to_wkb'):
+    BACKEND = 'shapely'
+elif pygeos is not None and USE_PYGEOS:
+    # Geometries of GeoPandas are PyGEOS geometries; results are wrapped into a GeometryArray
+    BACKEND = 'pygeos'
+else:
+    BACKEND = 'python'
+    logger.warning('Neither Shapely 2 nor a PyGEOS-enabled GeoPandas is available: '
+                   'geometries will be converted element-wise (slow)')
+
+
+def _objectArray(values):
+    """Convert values to an object array, mapping missing values to None."""
+    values = np.asarray(values, dtype=object)
+    return np.where(pd.isna(values), None, values)
+
+
+def _geometryData(geoms):
+    """Return the underlying array of a GeoSeries, a GeometryArray or a sequence of geometries."""
+    if isinstance(geoms, pd.Series):
+        geoms = geoms.values
+    data = getattr(geoms, '_data', None)
+    if data is None:
+        data = getattr(geoms, 'data', None)
+    if not isinstance(data, np.ndarray):
+        data = np.asarray(geoms, dtype=object)
+    return data
+
+
+def _toPygeos(data):
+    """Convert to PyGEOS geometries (unless already converted, e.g. by a PyGEOS-enabled GeoPandas)."""
+    sample = next((g for g in data if g is not None), None)
+    if sample is None or isinstance(sample, pygeos.Geometry):
+        return data
+    return pygeos.from_shapely(data)
+
+
+def _geometryArray(data):
+    """Wrap an array of PyGEOS geometries into a GeometryArray (of a PyGEOS-enabled GeoPandas)."""
+    from geopandas.array import GeometryArray
+    return GeometryArray(data)
+
+
+def fromWkt(values):
+    """Parse an array of WKT strings into an array of (shapely) geometries.
+
+    Parameters:
+        values (array-like): The WKT representations.
+
+    Returns:
+        (array) The geometries (an array or a GeometryArray, suitable for a GeoDataFrame).
+    """
+    values = _objectArray(values)
+    if BACKEND == 'shapely':
+        return shapely.from_wkt(values, on_invalid='raise')
+    elif BACKEND == 'pygeos':
+        # GeoPandas parses with PyGEOS and wraps the result into a GeometryArray
+        import geopandas as gpd
+        return gpd.array.from_wkt(values)
+    from shapely import wkt
+    return np.array([None if v is None else wkt.loads(v) for v in values], dtype=object)
+
+
+def fromWkb(values):
+    """Parse an array of (hex-encoded or binary) WKB values into an array of (shapely) geometries.
+
+    Parameters:
+        values (array-like): The WKB representations.
+
+    Returns:
+        (array) The geometries (an array or a GeometryArray, suitable for a GeoDataFrame).
+    """
+    values = _objectArray(values)
+    if BACKEND == 'shapely':
+        return shapely.from_wkb(values, on_invalid='raise')
+    elif BACKEND == 'pygeos':
+        return _geometryArray(pygeos.from_wkb(values))
+    from shapely import wkb
+    return np.array([None if v is None else wkb.loads(v, hex=isinstance(v, str)) for v in values], dtype=object)
+
+
+def toEwkb(geoms, srid=None, hex=False):
+    """Encode an array of geometries into (E)WKB.
+
+    Parameters:
+        geoms (GeoSeries|GeometryArray|array-like): The geometries.
+        srid (int, optional): If given, the SRID is embedded into the output (i.e. EWKB is produced).
+        hex (bool, optional): If True, the output is hex-encoded.
+
+    Returns:
+        (array) An array of bytes (or str, if `hex`).
+    """
+    data = _geometryData(geoms)
+    if BACKEND == 'shapely':
+        if srid:
+            data = shapely.set_srid(data, srid)
+        return shapely.to_wkb(data, hex=hex, include_srid=bool(srid))
+    elif BACKEND == 'pygeos':
+        data = _toPygeos(data)
+        if srid:
+            data = pygeos.set_srid(data, srid)
+        return pygeos.to_wkb(data, hex=hex, include_srid=bool(srid))
+    from shapely import wkb
+    options = {'srid': srid} if srid else {}
+    return np.array([None if g is None else wkb.dumps(g, hex=hex, **options) for g in data], dtype=object)
+
+
+def force2d(geoms):
+    """Drop the Z (and M) dimensions of an array of geometries.
+
+    Parameters:
+        geoms (GeoSeries|GeometryArray|array-like): The geometries.
+
+    Returns:
+        (array) The 2D geometries.
+    """
+    data = _geometryData(geoms)
+    if BACKEND == 'shapely':
+        return shapely.force_2d(data)
+    elif BACKEND == 'pygeos':
+        return _geometryArray(pygeos.force_2d(_toPygeos(data)))
+    from shapely import wkb
+    return np.array([None if g is None else wkb.loads(wkb.dumps(g, output_dimension=2)) for g in data], dtype=object)
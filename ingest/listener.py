@@ -0,0 +1,181 @@
+"""A listener of notifications on changes of the queue table (Postgres LISTEN/NOTIFY).
+
+Every change of the status (or the progress) of a process is notified on the channel `QUEUE_CHANNEL`,
+with the ticket as payload (see `ingest.database.actions`). A single thread (per process) listens on
+this channel over a dedicated connection, and wakes up the requests waiting for a change of a ticket;
+so, waiting requests do not poll the database (and do not hold a connection of the pool).
+
+If the connection is lost, waiting requests are woken up (to check the status for themselves) and,
+while the listener reconnects, waits are limited to `FALLBACK_POLL_INTERVAL`.
+
+A waiting request still holds a thread of the server; so, the number of concurrent watches may be
+bounded (see `QueueListener`), leaving threads available to other requests.
+"""
+
+import select
+import threading
+import time
+
+import sqlalchemy
+from sqlalchemy.pool import NullPool
+
+from .database.actions import QUEUE_CHANNEL
+from .logging import mainLogger
+logger = mainLogger.getChild('listener')
+
+FALLBACK_POLL_INTERVAL = 5.0
+"""The maximum wait (in seconds) for a notification, while the listener is not connected"""
+
+_SELECT_TIMEOUT = 5.0
+
+_RECONNECT_DELAY = (1.0, 30.0)
+
+
+class TooManyWatchers(Exception):
+    pass
+
+
+class Watch(object):
+    """A watch on the changes of a ticket (see `QueueListener.watch`).
+
+    A watch should be closed (or used as a context manager), to release its slot.
+    """
+
+    def __init__(self, listener, ticket):
+        self.listener = listener
+        self.ticket = ticket
+        self.closed = False
+        self._seen = (listener._versions.get(ticket, 0), listener._epoch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop watching (if not already stopped)."""
+        self.listener._unwatch(self)
+
+    def wait(self, timeout):
+        """Wait for a change (since the last wait, or since the watch started).
+
+        Parameters:
+            timeout (float): The maximum time (in seconds) to wait.
+
+        Returns:
+            (bool) True if a change was notified (or notifications may have been missed); False on timeout.
+        """
+        listener = self.listener
+        with listener._cond:
+            if not listener.connected:
+                timeout = min(timeout, FALLBACK_POLL_INTERVAL)
+            current = lambda: (listener._versions.get(self.ticket, 0), listener._epoch)
+            changed = listener._cond.wait_for(lambda: current() != self._seen, timeout)
+            self._seen = current()
+            return bool(changed)
+
+
+class QueueListener(object):
+    """A listener of notifications on changes of the queue table.
+
+    Parameters:
+        url (str|URL): The connection URL of the database.
+        channel (str): The notification channel.
+        max_watchers (int, optional): The maximum number of concurrent watches (unbounded if None).
+    """
+
+    def __init__(self, url, channel=QUEUE_CHANNEL, max_watchers=None):
+        self.url = url
+        self.channel = channel
+        self.max_watchers = max_watchers
+        self.connected = False
+        self._cond = threading.Condition()
+        self._versions = {}
+        self._watchers = {}
+        self._epoch = 0
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start listening on a background (daemon) thread (if not already started)."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='queue-listener')
+                self._thread.start()
+
+    def watch(self, ticket):
+        """Watch the changes of a ticket.
+
+        A watch should start before checking the status of the ticket, so that no change is missed
+        between the check and the wait.
+
+        Returns:
+            (Watch) The watch (to be closed, or used as a context manager).
+
+        Raises:
+            TooManyWatchers: If the maximum number of concurrent watches is reached.
+        """
+        self.start()
+        with self._cond:
+            if self.max_watchers is not None and sum(self._watchers.values()) >= self.max_watchers:
+                raise TooManyWatchers('Too many concurrent watches (%d)' % (self.max_watchers))
+            self._watchers[ticket] = self._watchers.get(ticket, 0) + 1
+            self._versions.setdefault(ticket, 0)
+            return Watch(self, ticket)
+
+    def _unwatch(self, watch):
+        with self._cond:
+            if watch.closed:
+                return
+            watch.closed = True
+            ticket = watch.ticket
+            self._watchers[ticket] -= 1
+            if self._watchers[ticket] == 0:
+                del self._watchers[ticket]
+                self._versions.pop(ticket, None)
+
+    def _notify(self, tickets):
+        with self._cond:
+            for ticket in tickets:
+                if ticket in self._versions:
+                    self._versions[ticket] += 1
+            self._cond.notify_all()
+
+    def _interrupt(self):
+        """Wake up all waiters (e.g. notifications may have been missed)."""
+        with self._cond:
+            self._epoch += 1
+            self._cond.notify_all()
+
+    def _run(self):
+        engine = sqlalchemy.create_engine(self.url, poolclass=NullPool)
+        delay = _RECONNECT_DELAY[0]
+        while True:
+            try:
+                raw = engine.raw_connection()
+                try:
+                    conn = raw.connection
+                    conn.autocommit = True
+                    with conn.cursor() as cursor:
+                        cursor.execute('LISTEN "{0}"'.format(self.channel))
+                    self.connected = True
+                    delay = _RECONNECT_DELAY[0]
+                    logger.info('Listening for notifications on channel "%s"', self.channel)
+                    while True:
+                        # Poll also on timeout, so that a lost connection is detected
+                        select.select([conn], [], [], _SELECT_TIMEOUT)
+                        conn.poll()
+                        tickets = set()
+                        while conn.notifies:
+                            tickets.add(conn.notifies.pop(0).payload)
+                        if tickets:
+                            self._notify(tickets)
+                finally:
+                    self.connected = False
+                    raw.close()
+            except Exception as e:
+                logger.warning('Lost connection listening for notifications (retrying in %.0fs): %s', delay, str(e))
+            self._interrupt()
+            time.sleep(delay)
+            delay = min(2 * delay, _RECONNECT_DELAY[1])
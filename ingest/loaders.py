@@ -0,0 +1,329 @@
+"""Loader engines writing chunks of features into a PostGIS table.
+
+A loader receives a dataframe chunk whose geometries are kept (as a geometry
+array) in a column named after `GEOMETRY_COLUMN`, and writes it into a
+database table through an open SQLAlchemy connection. The connection is never
+committed here: transaction handling is the responsibility of the caller.
+
+Writing a chunk is split into two steps: encoding (CPU-bound, no database access)
+and writing the encoded chunk (I/O-bound); so, the caller may encode a chunk
+while the previous one is being written.
+"""
+
+import csv
+import io
+import numbers
+import struct
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from datetime import datetime, date
+
+import pandas as pd
+import sqlalchemy
+from geoalchemy2 import Geometry
+
+from .geometry import toEwkb
+from .logging import mainLogger
+logger = mainLogger.getChild('loaders')
+
+GEOMETRY_COLUMN = 'geom'
+
+
+def _quoteIdent(name):
+    return '"{0}"'.format(str(name).replace('"', '""'))
+
+
+def _qualifiedName(table, schema):
+    return '{0}.{1}'.format(_quoteIdent(schema), _quoteIdent(table))
+
+
+def _sqlTypes(srid, gtype, column_types=None):
+    dtype = dict(column_types or {})
+    dtype[GEOMETRY_COLUMN] = Geometry(gtype, srid=srid, spatial_index=False)
+    return dtype
+
+
+def _toInteger(v):
+    """Convert a value to an integer, refusing to truncate (non-integral) numbers."""
+    if isinstance(v, numbers.Real) and not isinstance(v, numbers.Integral) and not float(v).is_integer():
+        raise ValueError('Non-integer value {0!r} for an integer column'.format(v))
+    return int(v)
+
+
+EncodedChunk = namedtuple('EncodedChunk', ['data', 'columns', 'rows', 'srid', 'format', 'null'], defaults=(None,))
+EncodedChunk.__doc__ = """A chunk encoded by a loader, ready to be written into a table.
+
+The `null` field is the representation of NULL values (for COPY in text format).
+"""
+
+
+class Loader(ABC):
+    """Base class for a loader engine."""
+
+    name = None
+
+    def tableTypes(self, con, table, schema):
+        """Return the information about the target table needed for encoding chunks (None if not needed)."""
+        return None
+
+    @abstractmethod
+    def encode(self, df, srid=4326, table_types=None):
+        """Encode a chunk (without accessing the database).
+
+        Parameters:
+            df (DataFrame): The chunk to be written.
+            srid (int): The SRID of the geometry column.
+            table_types: The information about the target table, as returned by `tableTypes`.
+
+        Returns:
+            (EncodedChunk) The encoded chunk
+        """
+
+    @abstractmethod
+    def write(self, con, encoded, table, schema):
+        """Write an encoded chunk into an (existing) table.
+
+        Parameters:
+            con (Connection): An open SQLAlchemy connection.
+            encoded (EncodedChunk): The encoded chunk, as returned by `encode`.
+            table (str): The table name.
+            schema (str): The database schema.
+
+        Returns:
+            (int) The number of rows written
+        """
+
+    def createTable(self, con, df, table, schema, if_exists='fail', srid=4326, gtype='GEOMETRY', column_types=None):
+        """Create (or replace) the target table using the column types of the given chunk.
+
+        The table is created without any index (the spatial index included); indices are expected
+        to be built after all data are loaded.
+
+        Parameters:
+            con (Connection): An open SQLAlchemy connection.
+            df (DataFrame): A chunk of data (only its columns and dtypes are used).
+            table (str): The table name.
+            schema (str): The database schema.
+            if_exists (str): One of 'fail', 'replace', 'append' (as in `DataFrame.to_sql`).
+            srid (int): The SRID of the geometry column.
+            gtype (str): The geometry type of the geometry column.
+            column_types (dict, optional): SQLAlchemy types keyed on column names, overriding the types
+                inferred from the dtypes of the chunk.
+        """
+        df.head(0).to_sql(table, con=con, schema=schema, if_exists=if_exists, index=False,
+                          dtype=_sqlTypes(srid, gtype, column_types))
+
+    def load(self, con, df, table, schema, if_exists='append', srid=4326, gtype='GEOMETRY', column_types=None):
+        """Write a chunk into a table.
+
+        Parameters:
+            con (Connection): An open SQLAlchemy connection.
+            df (DataFrame): The chunk to be written.
+            table (str): The table name.
+            schema (str): The database schema.
+            if_exists (str): One of 'fail', 'replace', 'append' (as in `DataFrame.to_sql`).
+            srid (int): The SRID of the geometry column.
+            gtype (str): The geometry type of the geometry column (used only if table is created).
+            column_types (dict, optional): SQLAlchemy types keyed on column names (used only if table is created).
+
+        Returns:
+            (int) The number of rows written
+        """
+        if if_exists != 'append':
+            self.createTable(con, df, table, schema, if_exists=if_exists, srid=srid, gtype=gtype,
+                             column_types=column_types)
+        if len(df) == 0:
+            return 0
+        return self.write(con, self.encode(df, srid, self.tableTypes(con, table, schema)), table, schema)
+
+
+class InsertLoader(Loader):
+    """Write chunks with `DataFrame.to_sql` (i.e. with multi-row INSERT statements)."""
+
+    name = 'to_sql'
+
+    def encode(self, df, srid=4326, table_types=None):
+        df = df.copy()
+        # Hex-encoded EWKB is accepted by ST_GeomFromEWKT (i.e. the bind expression of Geometry)
+        df[GEOMETRY_COLUMN] = toEwkb(df[GEOMETRY_COLUMN], srid, hex=True)
+        return EncodedChunk(df, list(df.columns), len(df), srid, None)
+
+    def write(self, con, encoded, table, schema):
+        encoded.data.to_sql(table, con=con, schema=schema, if_exists='append', index=False,
+                            dtype=_sqlTypes(encoded.srid, 'GEOMETRY'))
+        return encoded.rows
+
+
+class CopyLoader(Loader):
+    """Stream chunks with `COPY ... FROM STDIN`, sending geometries as EWKB.
+
+    Two formats are supported:
+        * 'text': rows are serialized as CSV (NULL as `\\N`, so that empty strings are kept),
+          geometries as hex-encoded EWKB.
+        * 'binary': rows are serialized in the binary COPY format, geometries as raw EWKB.
+          Attributes are encoded according to the actual column types of the target table;
+          if any of those types is not supported, the chunk is sent in 'text' format.
+    """
+
+    _PGCOPY_HEADER = b'PGCOPY\n\377\r\n\0' + struct.pack('>ii', 0, 0)
+    _PGCOPY_TRAILER = struct.pack('>h', -1)
+    _PG_EPOCH_DATE = date(2000, 1, 1)
+    _PG_EPOCH = datetime(2000, 1, 1)
+
+    _INTEGER_TYPES = ('bigint', 'integer', 'smallint')
+
+    _NULL = '\\N'
+
+    def __init__(self, format='text'):
+        assert format in ('text', 'binary')
+        self.format = format
+        self.name = 'copy' if format == 'text' else 'copy_binary'
+        self._column_types = {}
+
+    def tableTypes(self, con, table, schema):
+        return self._columnTypes(con, table, schema)
+
+    def load(self, con, df, table, schema, if_exists='append', srid=4326, gtype='GEOMETRY', column_types=None):
+        if if_exists != 'append':
+            # Column types are to be read again from the (re)created table
+            self._column_types.pop((schema, table), None)
+        return super().load(con, df, table, schema, if_exists=if_exists, srid=srid, gtype=gtype,
+                            column_types=column_types)
+
+    def encode(self, df, srid=4326, table_types=None):
+        payload = None
+        if self.format == 'binary':
+            payload = self._binaryPayload(df, table_types or {}, srid)
+            if payload is None:
+                logger.debug('Falling back to text COPY (unsupported column types)')
+        if payload is None:
+            data, null = self._textPayload(df, table_types or {}, srid)
+            return EncodedChunk(data, list(df.columns), len(df), srid, 'text', null)
+        return EncodedChunk(payload, list(df.columns), len(df), srid, 'binary')
+
+    def write(self, con, encoded, table, schema):
+        if encoded.format == 'binary':
+            options = "FORMAT binary"
+        else:
+            options = "FORMAT csv, NULL '{0}'".format(encoded.null.replace("'", "''"))
+        sql = 'COPY {0} ({1}) FROM STDIN WITH ({2})'.format(
+            _qualifiedName(table, schema), ', '.join(_quoteIdent(c) for c in encoded.columns), options)
+        cursor = con.connection.cursor()
+        try:
+            cursor.copy_expert(sql, encoded.data)
+        finally:
+            cursor.close()
+        return encoded.rows
+
+    def _textPayload(self, df, column_types, srid):
+        """Serialize a chunk as CSV; return the buffer and the representation of NULL values."""
+        df = df.copy()
+        df[GEOMETRY_COLUMN] = toEwkb(df[GEOMETRY_COLUMN], srid, hex=True)
+        # Type inference may differ among chunks: an integer column of the table may arrive as
+        # float (e.g. because of missing values), which has to be formatted as an integer.
+        for column in df.columns:
+            if column_types.get(column) in self._INTEGER_TYPES and df[column].dtype.kind == 'f':
+                values = df[column].dropna()
+                fractional = values[values % 1 != 0]
+                if len(fractional) > 0:
+                    raise ValueError('Non-integer value {0} for an integer column ("{1}")'.format(fractional.iloc[0], column))
+                df[column] = df[column].astype('Int64')
+        # NULL must not match any (unquoted) string value
+        null = self._NULL
+        strings = [df[c] for c in df.columns if c != GEOMETRY_COLUMN and pd.api.types.is_string_dtype(df[c])]
+        while any((values == null).any() for values in strings):
+            null += '_'
+        buf = io.StringIO()
+        df.to_csv(buf, header=False, index=False, na_rep=null, quoting=csv.QUOTE_MINIMAL)
+        buf.seek(0)
+        return buf, null
+
+    def _columnTypes(self, con, table, schema, refresh=False):
+        """Return (and cache) the column types of a table as a dict keyed on column names."""
+        key = (schema, table)
+        if refresh or key not in self._column_types:
+            sql = sqlalchemy.text(
+                "SELECT attname, format_type(atttypid, NULL) FROM pg_attribute "
+                "WHERE attrelid = CAST(:rel AS regclass) AND attnum > 0 AND NOT attisdropped")
+            res = con.execute(sql, rel=_qualifiedName(table, schema))
+            self._column_types[key] = dict(res.fetchall())
+        return self._column_types[key]
+
+    def _columnEncoder(self, pg_type):
+        """Return a function encoding a (non-null) value into the binary COPY representation.
+
+        Note that geometries are expected to be already encoded as EWKB.
+        """
+        if pg_type == 'geometry':
+            return lambda v: v
+        if pg_type in ('text', 'character varying', 'character'):
+            return lambda v: str(v).encode('utf-8')
+        if pg_type == 'bigint':
+            return lambda v: struct.pack('>q', _toInteger(v))
+        if pg_type == 'integer':
+            return lambda v: struct.pack('>i', _toInteger(v))
+        if pg_type == 'smallint':
+            return lambda v: struct.pack('>h', _toInteger(v))
+        if pg_type == 'double precision':
+            return lambda v: struct.pack('>d', float(v))
+        if pg_type == 'real':
+            return lambda v: struct.pack('>f', float(v))
+        if pg_type == 'boolean':
+            return lambda v: struct.pack('>?', bool(v))
+        if pg_type == 'date':
+            return lambda v: struct.pack('>i', (pd.Timestamp(v).date() - self._PG_EPOCH_DATE).days)
+        if pg_type == 'timestamp without time zone':
+            def encode_timestamp(v):
+                delta = pd.Timestamp(v).to_pydatetime() - self._PG_EPOCH
+                return struct.pack('>q', (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+            return encode_timestamp
+        return None
+
+    def _binaryPayload(self, df, column_types, srid):
+        df = df.copy()
+        df[GEOMETRY_COLUMN] = toEwkb(df[GEOMETRY_COLUMN], srid)
+        encoders = []
+        for column in df.columns:
+            encoder = self._columnEncoder(column_types.get(column))
+            if encoder is None:
+                return None
+            encoders.append(encoder)
+
+        null = struct.pack('>i', -1)
+        na = getattr(pd, 'NA', None)
+        def encode_column(column, encoder):
+            encoded = []
+            try:
+                for v in df[column].tolist():
+                    if v is None or (isinstance(v, float) and v != v) or v is pd.NaT or (na is not None and v is na):
+                        encoded.append(null)
+                    else:
+                        b = encoder(v)
+                        encoded.append(struct.pack('>i', len(b)) + b)
+            except ValueError as e:
+                raise ValueError('{0} ("{1}")'.format(e, column)) from e
+            return encoded
+
+        columns = [encode_column(c, e) for c, e in zip(df.columns, encoders)]
+        tuple_header = struct.pack('>h', len(columns))
+        buf = io.BytesIO()
+        buf.write(self._PGCOPY_HEADER)
+        for fields in zip(*columns):
+            buf.write(tuple_header)
+            buf.write(b''.join(fields))
+        buf.write(self._PGCOPY_TRAILER)
+        buf.seek(0)
+        return buf
+
+
+LOADERS = ('to_sql', 'copy', 'copy_binary')
+
+def makeLoader(name):
+    """Create a loader engine by its name (one of `LOADERS`)."""
+    if name == 'to_sql':
+        return InsertLoader()
+    elif name == 'copy':
+        return CopyLoader('text')
+    elif name == 'copy_binary':
+        return CopyLoader('binary')
+    raise ValueError('Unknown loader engine: {0}'.format(name))
@@ -0,0 +1,169 @@
+"""A pipeline of stages, each running on its own thread, linked by bounded queues.
+
+The first stage iterates over a source (e.g. reads chunks from a file), and every following stage
+transforms the items produced by the previous one. The items of the last stage are consumed by the
+thread iterating over the pipeline. Since queues are bounded, a slow stage (or consumer) blocks the
+stages before it (backpressure), so memory usage is bounded by the depth of the queues.
+
+If any stage fails (or the consumer stops early), all stages are cancelled; the error of a failed
+stage is raised to the consumer. A pipeline should be used as a context manager, so that its stages
+are stopped even if the consumer fails:
+
+    with Pipeline(chunks, [('prepare', prepare), ('encode', encode)]) as pipeline:
+        for item in pipeline:
+            write(item)
+"""
+
+import queue
+import threading
+import time
+
+from .logging import mainLogger
+logger = mainLogger.getChild('pipeline')
+
+PIPELINE_DEPTH = 2
+"""The default capacity of each queue linking two stages (i.e. the items prepared ahead of a stage)"""
+
+_END = object()
+
+_POLL_INTERVAL = 0.1
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class Pipeline(object):
+    """A pipeline of stages.
+
+    Parameters:
+        source (iterable): The source of items (iterated over by the first stage). If it is a generator,
+            it is closed on the thread of the first stage.
+        stages (list): A list of (name, function) tuples; each function transforms an item of the
+            previous stage.
+        depth (int): The capacity of each queue.
+        name (str): A name for the pipeline (used for naming threads and logging).
+    """
+
+    def __init__(self, source, stages, depth=PIPELINE_DEPTH, name='pipeline'):
+        self.source = source
+        self.stages = list(stages)
+        self.depth = max(1, int(depth))
+        self.name = name
+        self._cancelled = threading.Event()
+        self._error = None
+        self._error_lock = threading.Lock()
+        self._threads = []
+        self._busy = {}
+
+    def cancel(self):
+        """Cancel all stages."""
+        self._cancelled.set()
+
+    def close(self):
+        """Cancel all stages, and wait for their threads to finish."""
+        self._cancelled.set()
+        for t in self._threads:
+            t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _fail(self, stage, error):
+        with self._error_lock:
+            if self._error is None:
+                logger.error('Stage "%s" of %s failed: %s', stage, self.name, str(error))
+                self._error = error
+        self._cancelled.set()
+
+    def _put(self, q, item):
+        while not self._cancelled.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self._cancelled.is_set():
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+        raise PipelineCancelled()
+
+    def _read(self, out):
+        busy = 0.0
+        iterator = iter(self.source)
+        try:
+            while not self._cancelled.is_set():
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                busy += time.perf_counter() - started
+                if not self._put(out, item):
+                    break
+            self._put(out, _END)
+        except Exception as e:
+            self._fail('read', e)
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                try:
+                    close()
+                except Exception as e:
+                    logger.warning('Failed to close the source of %s: %s', self.name, str(e))
+            self._busy['read'] = busy
+
+    def _transform(self, stage, function, inp, out):
+        busy = 0.0
+        try:
+            while True:
+                item = self._get(inp)
+                if item is _END:
+                    self._put(out, _END)
+                    break
+                started = time.perf_counter()
+                item = function(item)
+                busy += time.perf_counter() - started
+                if not self._put(out, item):
+                    break
+        except PipelineCancelled:
+            pass
+        except Exception as e:
+            self._fail(stage, e)
+        finally:
+            self._busy[stage] = busy
+
+    def __iter__(self):
+        queues = [queue.Queue(maxsize=self.depth) for _ in range(len(self.stages) + 1)]
+        self._threads = [threading.Thread(target=self._read, args=(queues[0],), daemon=True,
+                                          name='{0}-read'.format(self.name))]
+        for k, (stage, function) in enumerate(self.stages):
+            self._threads.append(threading.Thread(target=self._transform, args=(stage, function, queues[k], queues[k + 1]),
+                                                  daemon=True, name='{0}-{1}'.format(self.name, stage)))
+        for t in self._threads:
+            t.start()
+        try:
+            while True:
+                try:
+                    item = self._get(queues[-1])
+                except PipelineCancelled:
+                    break
+                if item is _END:
+                    break
+                yield item
+        finally:
+            # Stop all stages (if not already finished), e.g. if the consumer stopped early
+            self.close()
+        if self._error is not None:
+            raise self._error
+        logger.debug('Pipeline %s finished; busy time per stage: %s', self.name,
+                     ', '.join('%s=%.3fs' % (k, v) for k, v in self._busy.items()))
@@ -1,25 +1,69 @@
-from random import sample
-
 import geopandas as gpd
 import pandas as pd
-import csv
-from shapely import wkt
-from geoalchemy2 import Geometry, WKTElement
 import sqlalchemy
-import shapely
-from os import path, environ, listdir
+import psycopg2
+import psycopg2.errors
+import dataclasses
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from itertools import chain
+from os import environ
+from queue import Queue
+from uuid import uuid4
 import warnings
-
-from valentine.algorithms import Coma
-from yaml import safe_load
-from valentine import valentine_match
-
+import time
+import weakref
+
+from .loaders import makeLoader, GEOMETRY_COLUMN
+from .pipeline import Pipeline, PIPELINE_DEPTH
+from .progress import Progress
+from .readers import readVectorChunks, readCsvChunks, sourceExtension, sourceSize, countFeatures, AVAILABLE_READ_ENGINES
+from .geometry import force2d
+from .crs import resolveCrs, sridFor
+from .wks import registry as wks_registry, ColumnMapping
 from .logging import mainLogger
 logger = mainLogger.getChild('postgres')
 
 
-class GeometricColumnNotFound(Exception):
-    pass
+STAGING_TABLE_PREFIX = '_ingest_'
+"""The prefix of the names of staging tables"""
+
+_STAGING_LOCK_SPACE = 0x696e67
+"""The first key of the (session) advisory locks held on staging tables while they are in use"""
+
+
+def stagingTableName():
+    """Return a (unique) name for a staging table."""
+    return STAGING_TABLE_PREFIX + uuid4().hex[:12]
+
+
+DEFAULT_MAX_PARALLELISM = 4
+"""The default maximum number of workers of a parallel ingest"""
+
+
+def maxParallelism():
+    """Return the maximum number of workers of a parallel ingest, as configured (`POSTGIS_MAX_PARALLELISM`).
+
+    Each worker holds a connection of the pool of the shard, besides the connection of the ingest itself,
+    so the maximum is kept below the capacity of the pool (`POSTGIS_POOL_SIZE` + `POSTGIS_MAX_OVERFLOW`).
+    """
+    capacity = int(environ.get("POSTGIS_POOL_SIZE", "5")) + int(environ.get("POSTGIS_MAX_OVERFLOW", "10"))
+    value = int(environ.get("POSTGIS_MAX_PARALLELISM", str(DEFAULT_MAX_PARALLELISM)))
+    return max(1, min(value, capacity - 1))
+
+
+_instances = weakref.WeakSet()
+"""The (live) instances of `Postgres`, whose engines are reset in a forked child"""
+
+
+def _resetEnginesAfterFork():
+    for instance in list(_instances):
+        instance._resetEnginesAfterFork()
+
+
+os.register_at_fork(after_in_child=_resetEnginesAfterFork)
 
 
 class SchemaException(Exception):
@@ -30,6 +74,22 @@ class InsufficientPrivilege(Exception):
     pass
 
 
+@contextmanager
+def _translatingDatabaseErrors(schema):
+    """Translate database errors (raised inside the context) to our own exceptions."""
+    try:
+        yield
+    except ValueError as e:
+        raise e
+    except (sqlalchemy.exc.ProgrammingError, psycopg2.ProgrammingError) as e:
+        if 'InvalidSchemaName' in str(e) or isinstance(e, psycopg2.errors.InvalidSchemaName):
+            raise SchemaException('Schema "%s" does not exist.' % (schema))
+        elif 'InsufficientPrivilege' in str(e) or isinstance(e, psycopg2.errors.InsufficientPrivilege):
+            raise InsufficientPrivilege('Permission denied for schema "%s".' % (schema))
+        else:
+            raise e
+
+
 class Postgres(object):
     """Creates a connection to PostgreSQL database"""
     
@@ -57,14 +117,64 @@ class Postgres(object):
         
         default_schema = environ.get("POSTGIS_DEFAULT_SCHEMA", "public");
         
-        return Postgres(url_template, username, password, port_map, default_schema);
+        loader = environ.get("POSTGIS_LOADER", "copy");
+        
+        maintenance_work_mem = environ.get("POSTGIS_MAINTENANCE_WORK_MEM") or None;
+        max_parallel_maintenance_workers = environ.get("POSTGIS_MAX_PARALLEL_MAINTENANCE_WORKERS");
+        if max_parallel_maintenance_workers:
+            max_parallel_maintenance_workers = int(max_parallel_maintenance_workers);
+        else:
+            max_parallel_maintenance_workers = None;
+        
+        pool_options = {
+            'pool_size': int(environ.get("POSTGIS_POOL_SIZE", "5")),
+            'max_overflow': int(environ.get("POSTGIS_MAX_OVERFLOW", "10")),
+            'pool_pre_ping': environ.get("POSTGIS_POOL_PRE_PING", "true").lower() in ('true', 'yes', 'on', '1'),
+        };
+        
+        wks_options = {};
+        if environ.get("WKS_MATCH_WORKERS"):
+            wks_options['workers'] = int(environ["WKS_MATCH_WORKERS"]);
+        if environ.get("WKS_MATCH_TIMEOUT"):
+            wks_options['timeout'] = float(environ["WKS_MATCH_TIMEOUT"]);
+        if environ.get("WKS_MATCH_CANDIDATES"):
+            wks_options['candidates'] = int(environ["WKS_MATCH_CANDIDATES"]);
+        
+        pipeline_depth = int(environ.get("POSTGIS_PIPELINE_DEPTH", str(PIPELINE_DEPTH)));
+        
+        read_engine = environ.get("READ_ENGINE", "fiona");
+        
+        return Postgres(url_template, username, password, port_map, default_schema, loader=loader,
+            maintenance_work_mem=maintenance_work_mem, max_parallel_maintenance_workers=max_parallel_maintenance_workers,
+            pool_options=pool_options, wks_options=wks_options, pipeline_depth=pipeline_depth,
+            read_engine=read_engine, max_parallelism=maxParallelism());
     
-    def __init__(self, url_template, username, password, port_map, default_schema='public'):
+    def __init__(self, url_template, username, password, port_map, default_schema='public', loader='copy',
+                 maintenance_work_mem=None, max_parallel_maintenance_workers=None, pool_options=None, wks_options=None,
+                 pipeline_depth=PIPELINE_DEPTH, read_engine='fiona', max_parallelism=DEFAULT_MAX_PARALLELISM):
         self.url_template = url_template;
         self.username = username;
         self.password = password;
         self.port_map = port_map;
         self.default_schema = default_schema;
+        self.loader = loader;
+        # Fail early on a misconfigured loader engine
+        makeLoader(loader);
+        self.maintenance_work_mem = maintenance_work_mem;
+        self.max_parallel_maintenance_workers = max_parallel_maintenance_workers;
+        self.pool_options = pool_options or {};
+        self.wks_options = wks_options or {};
+        self.pipeline_depth = pipeline_depth;
+        # Workers of a parallel ingest (and the ingest itself) must fit in the connection pool of a shard
+        capacity = self.pool_options.get('pool_size', 5) + self.pool_options.get('max_overflow', 10);
+        self.max_parallelism = max(1, min(max_parallelism, capacity - 1));
+        if read_engine not in AVAILABLE_READ_ENGINES:
+            raise ValueError('The read engine {0} is not available (one of: {1})'.format(read_engine, ', '.join(AVAILABLE_READ_ENGINES)));
+        self.read_engine = read_engine;
+        # Engines (i.e. connection pools) are kept per shard
+        self._engines = {};
+        self._engines_lock = threading.Lock();
+        _instances.add(self);
 
     def urlFor(self, shard=None):
         url = self.url_template;
@@ -74,16 +184,50 @@ class Postgres(object):
         u = sqlalchemy.engine.url.make_url(url);
         return u.set(username=self.username, password=self.password);
          
+    def engineFor(self, shard=None):
+        """Return the (long-lived) engine for a shard, creating it on first use."""
+        with self._engines_lock:
+            engine = self._engines.get(shard)
+            if engine is None:
+                engine = sqlalchemy.create_engine(self.urlFor(shard), **self.pool_options)
+                self._engines[shard] = engine
+        return engine
+
+    def _resetEnginesAfterFork(self):
+        """Discard engines inherited from a parent process (e.g. the gunicorn master).
+
+        Pooled connections of the parent must never be used by the child, but they should not be
+        closed either (they still belong to the parent).
+        """
+        self._engines_lock = threading.Lock()
+        engines, self._engines = self._engines, {}
+        for engine in engines.values():
+            engine.dispose(close=False)
+
+    def poolStatus(self):
+        """Return statistics for the connection pool of each shard.
+
+        Returns:
+            (dict) Statistics keyed on shard identifier (empty string if no sharding is used)
+        """
+        with self._engines_lock:
+            engines = dict(self._engines)
+        return {(shard or ''): {
+            'size': engine.pool.size(),
+            'checkedIn': engine.pool.checkedin(),
+            'checkedOut': engine.pool.checkedout(),
+            'overflow': engine.pool.overflow(),
+        } for shard, engine in engines.items()}
+
     def check(self, shard=None):
         """Check database connection.
         Returns:
             (str) database URI
         """
-        url = self.urlFor(shard);
-        engine = sqlalchemy.create_engine(url);
+        engine = self.engineFor(shard);
         with engine.connect() as con:
             con.execute('SELECT 1')
-        return url
+        return engine.url
 
     def checkIfTableExists(self, table, schema=None, shard=None):
         """Check if table exists.
@@ -97,8 +241,7 @@ class Postgres(object):
         sql_template = """
         SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_schema = '{0}' AND table_name = '{1}')
         """
-        url = self.urlFor(shard);
-        engine = sqlalchemy.create_engine(url);
+        engine = self.engineFor(shard);
         with engine.connect() as con:
             cur = con.execute(sql_template.format(schema, table))
             exists = cur.fetchone()[0]
@@ -110,217 +253,496 @@ class Postgres(object):
         
         schema = schema or self.default_schema
         
-        url = self.urlFor(shard);
-        engine = sqlalchemy.create_engine(url);
+        engine = self.engineFor(shard);
         with engine.connect() as con:
             cur = con.execute('DROP TABLE IF EXISTS "{0}"."{1}"'.format(schema, table))
 
-    @staticmethod
-    def _sniffCsvDelimiter(input_path):
-        """ Returns the delimiter of the csv file """
-        if input_path.split('.')[-1] != 'csv':
-            return None
-        with open(input_path) as f:
-            first_line = f.readline()
-            s = csv.Sniffer()
-            return str(s.sniff(first_line).delimiter)
-
     def _findIndicesOfUniqueFieldsInDataframe(self, df):
         """Identifies unique fields in the dataframe"""
         index = []
         for col in df.columns:
-            if col == 'geometry':
+            if col in ('geometry', GEOMETRY_COLUMN):
                 continue
             if df[col].is_unique:
                 index.append(col)
         return index
 
+    def _buildIndices(self, con, table, schema, unique_columns):
+        """Build the indices of a (freshly loaded) table.
+
+        The spatial index is built on the geometry column. The first of the unique columns becomes
+        the primary key, and a unique index is built for each of the rest; a failure on any of those
+        is logged and does not affect the rest of the transaction. Settings for index creation
+        (`maintenance_work_mem`, `max_parallel_maintenance_workers`) are local to the transaction.
+
+        Parameters:
+            con (Connection): An open SQLAlchemy connection (within a transaction).
+            table (str): The table name.
+            schema (str): The database schema.
+            unique_columns (list): The columns identified as unique.
+
+        Returns:
+            (float) The time spent (in seconds) building indices
+        """
+        started = time.perf_counter()
+        
+        if self.maintenance_work_mem:
+            con.execute(sqlalchemy.text("SELECT set_config('maintenance_work_mem', :value, true)"),
+                value=str(self.maintenance_work_mem))
+        if self.max_parallel_maintenance_workers is not None:
+            con.execute(sqlalchemy.text("SELECT set_config('max_parallel_maintenance_workers', :value, true)"),
+                value=str(self.max_parallel_maintenance_workers))
+        
+        con.execute('CREATE INDEX ON "{0}"."{1}" USING GIST ("{2}")'.format(schema, table, GEOMETRY_COLUMN))
+        
+        primary = False
+        for column in unique_columns:
+            savepoint = con.begin_nested()
+            try:
+                if not primary:
+                    con.execute('ALTER TABLE "{0}"."{1}" ADD PRIMARY KEY ("{2}")'.format(schema, table, column))
+                    primary = True
+                else:
+                    con.execute('CREATE UNIQUE INDEX ON "{0}"."{1}" ("{2}")'.format(schema, table, column))
+            except sqlalchemy.exc.DBAPIError as e:
+                savepoint.rollback()
+                logger.warning("Failed to create unique index on column \"%s\" of table \"%s\".\"%s\": %s",
+                    column, schema, table, str(e.orig).strip())
+            else:
+                savepoint.commit()
+        
+        elapsed = time.perf_counter() - started
+        logger.info("Built indices for table \"%s\".\"%s\" in %.3fs", schema, table, elapsed)
+        return elapsed
+
+    def _prepareChunk(self, df, crs=None, mapping=None, force_2d=False):
+        """Convert a chunk of features into a frame ready to be written by a loader.
+
+        Parameters:
+            df (GeoDataFrame): The chunk of features.
+            crs (tuple): A resolved CRS (as returned by `resolveCrs`) overriding the CRS of the dataset.
+            mapping (ColumnMapping): If given, attributes are mapped into a well known schema.
+            force_2d (bool): Whether Z/M dimensions are to be dropped from geometries.
+
+        Returns:
+            (tuple) The frame, the SRID and the geometry type of the chunk
+        """
+        if crs is None:
+            srid = sridFor(df.crs)
+        else:
+            srid = crs[1]
+        
+        if force_2d:
+            df = df.set_geometry(force2d(df.geometry), crs=df.crs)
+        
+        gtype = df.geometry.geom_type.unique()
+        if len(gtype) == 1:
+            gtype = gtype[0]
+        else:
+            gtype = 'GEOMETRY'
+        if not force_2d and df.geometry.has_z.any():
+            gtype = gtype.upper() + 'Z'
+        
+        geom = df.geometry.values
+        df = pd.DataFrame(df.drop(columns='geometry'))
+        if mapping is not None:
+            df = mapping.apply(df)
+        df[GEOMETRY_COLUMN] = geom
+        
+        return (df, srid, gtype)
+
+    def _wksMapping(self, df, wks=None, wks_mapping=None):
+        """Map the attributes of a dataset into a well known schema.
+
+        Parameters:
+            df (DataFrame): A sample of the attributes of the dataset.
+            wks (str, optional): The name of the well known schema (if not given, the best-matching one).
+            wks_mapping (dict, optional): An explicit mapping into `wks` (source columns keyed on target columns).
+
+        Raises:
+            ValueError: If the well known schema is not found, or the explicit mapping does not apply.
+
+        Returns:
+            (ColumnMapping) The mapping (None if no well known schema matches)
+        """
+        if wks is not None and wks_registry.get(wks) is None:
+            raise ValueError('Unknown well known schema: %s' % (wks))
+        if wks_mapping:
+            if wks is None:
+                raise ValueError('An explicit mapping requires a well known schema')
+            schema = wks_registry.get(wks)
+            unknown_targets = [c for c in wks_mapping if c not in schema.columns]
+            if unknown_targets:
+                raise ValueError('Not in well known schema %s: %s' % (wks, ', '.join(unknown_targets)))
+            unknown_sources = [c for c in wks_mapping.values() if c not in df.columns]
+            if unknown_sources:
+                raise ValueError('Not in dataset: %s' % (', '.join(unknown_sources)))
+            return ColumnMapping(schema, dict(wks_mapping))
+        if wks is not None:
+            return wks_registry.match(df, schemata=[wks], **self.wks_options)
+        return wks_registry.match(df, **self.wks_options)
+
+    @staticmethod
+    def _loadChunk(loader, con, df, table, schema, **kwargs):
+        """Write a chunk with a loader, translating database errors to our own exceptions."""
+        with _translatingDatabaseErrors(schema):
+            return loader.load(con, df, table, schema, **kwargs)
+
     @staticmethod
-    def _findCSVGeomColumn(df) -> str:
-        """Detect the name of the column containing the geometric information"""
-        NUMBER_OF_SAMPLES = 1000
-        IS_GEOM_THRESHOLD = 0.9
-        SET_OF_ACCEPTABLE_SHAPES = ['point', 'linestring', 'multipoint', 'multilinestring',
-                                    'polygon', 'multipolygon', 'geometrycollection', 'linearring']
-
-        def is_geom(column_data):
-            if column_data.dtype != 'object':
-                return False
+    def _writeChunk(loader, con, encoded, table, schema):
+        """Write an encoded chunk with a loader, translating database errors to our own exceptions."""
+        with _translatingDatabaseErrors(schema):
+            return loader.write(con, encoded, table, schema)
+
+    def _loadPipelined(self, con, loader, chunks, table, schema, prepare, progress=None):
+        """Load chunks through a pipeline of stages: read, prepare, encode (each on its own thread) and write.
+
+        So, the next chunks are read, converted and encoded while the current one is being written.
+        If any stage fails, the pipeline is cancelled and the error is raised.
+
+        Parameters:
+            con (Connection): The connection (within a transaction) where the target table is created.
+            loader (Loader): The loader engine.
+            chunks (iterable): The remaining chunks (of features) to be loaded.
+            table (str): The target table name.
+            schema (str): The database schema.
+            prepare (callable): A function converting a chunk into a tuple as returned by `_prepareChunk`.
+            progress (Progress, optional): A tracker counting the loaded rows.
+
+        Returns:
+            (int) The number of rows loaded
+        """
+        progress = progress or Progress()
+        table_types = loader.tableTypes(con, table, schema)
+        def encode(prepared):
+            df, srid, _ = prepared
+            logger.info("Processing a chunk of %d rows for table %s.%s", len(df), schema, table)
+            return loader.encode(df, srid, table_types)
+
+        rows = 0
+        stages = [('prepare', prepare), ('encode', encode)]
+        with Pipeline(chunks, stages, depth=self.pipeline_depth, name='ingest-{0}'.format(table)) as pipeline:
+            for encoded in pipeline:
+                n = self._writeChunk(loader, con, encoded, table, schema)
+                progress.advance(n)
+                rows += n
+        return rows
+
+    def _loadParallel(self, engine, chunks, table, schema, first, parallelism, loader_name, srid, gtype, prepare,
+                      column_types=None, progress=None):
+        """Load chunks in parallel, by workers writing (each over its own connection) into the same table.
+
+        The table is created (and the first chunk is loaded) in a separate transaction, so that it is seen
+        by the workers; each worker commits every chunk it writes. So, this is meant for a staging table,
+        which is renamed to the target table in the transaction of the ingest (see `_swapTable`), and which
+        should be dropped if the ingest fails (see `dropOrphanStagingTables` for the tables of processes
+        that crashed). Every row is written once.
+
+        Parameters:
+            engine (Engine): The engine for the target database.
+            chunks (iterable): The remaining chunks (of features) to be loaded.
+            table (str): The (staging) table name.
+            schema (str): The database schema.
+            first (DataFrame): The first chunk (prepared, see `_prepareChunk`); it also defines the table.
+            parallelism (int): The number of workers.
+            loader_name (str): The loader engine to be used by workers.
+            srid (int): The SRID of the geometry column.
+            gtype (str): The geometry type of the geometry column.
+            prepare (callable): A function converting a chunk into a tuple as returned by `_prepareChunk`.
+            column_types (dict, optional): SQLAlchemy types (keyed on column names) for the table.
+            progress (Progress, optional): A tracker counting the loaded rows.
+
+        Returns:
+            (int) The number of rows loaded
+        """
+        progress = progress or Progress()
+        with engine.begin() as scon:
+            rows = self._loadChunk(makeLoader(loader_name), scon, first, table, schema, if_exists='fail',
+                                   srid=srid, gtype=gtype, column_types=column_types)
+        progress.advance(rows)
+        
+        pending = Queue(maxsize=(2 * parallelism))
+        failed = threading.Event()
+        errors = []
+        
+        def work():
+            loader = makeLoader(loader_name)
+            n = 0
+            with engine.connect() as wcon:
+                # Keep consuming (even after a failure), so that the producer is never blocked
+                while True:
+                    chunk = pending.get()
+                    if chunk is None:
+                        break
+                    if failed.is_set():
+                        continue
+                    try:
+                        df, chunk_srid, _ = prepare(chunk)
+                        with wcon.begin():
+                            self._loadChunk(loader, wcon, df, table, schema, srid=chunk_srid)
+                        n += len(df)
+                        progress.advance(len(df))
+                    except Exception as e:
+                        failed.set()
+                        errors.append(e)
+            return n
+        
+        with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='ingest-worker') as pool:
+            futures = [pool.submit(work) for _ in range(parallelism)]
+            try:
+                for chunk in chunks:
+                    if failed.is_set():
+                        break
+                    logger.info("Processing a chunk of %d rows for table %s.%s", len(chunk), schema, table)
+                    pending.put(chunk)
+            finally:
+                for _ in futures:
+                    pending.put(None)
+            rows += sum(f.result() for f in futures)
+        if errors:
+            raise errors[0]
+        
+        return rows
+
+    def _lockStagingTable(self, con, table, lock=True):
+        """Hold (or release) the advisory lock of a staging table on the session of a connection.
+
+        The lock marks the (committed) staging table as in use; it is released if the process crashes
+        (i.e. its connection is closed), so that `dropOrphanStagingTables` may tell orphan tables.
+        """
+        con.execute(sqlalchemy.text("SELECT {0}(:space, hashtext(:table))".format(
+            'pg_advisory_lock' if lock else 'pg_advisory_unlock')), space=_STAGING_LOCK_SPACE, table=table)
+
+    @contextmanager
+    def _stagingTable(self, engine, con, table, schema):
+        """Hold a (committed) staging table, as long as the context; the table is dropped on exit (if it still exists)."""
+        self._lockStagingTable(con, table)
+        try:
+            yield table
+        finally:
+            # The transaction of the ingest (if left open by a failure) may hold locks on the table
+            transaction = con.get_transaction()
+            if transaction is not None and transaction.is_active:
+                transaction.rollback()
+            self._dropTables(engine, [table], schema)
             try:
-                matches = 0
-                for row in sample(list(column_data), NUMBER_OF_SAMPLES):
-                    is_shape = row.strip().lower().split('(')[0].strip() in SET_OF_ACCEPTABLE_SHAPES
-                    if row.strip().endswith(')') and is_shape:
-                        matches += 1
-                return matches > IS_GEOM_THRESHOLD * NUMBER_OF_SAMPLES
-            except AttributeError:
-                return False
-        schema = df.columns
-        if 'wkt' in schema:
-            return 'wkt'
-        elif 'WKT' in schema:
-            return 'WKT'
-        elif 'geometry' in schema:
-            return 'geometry'
-        elif 'GEOMETRY' in schema:
-            return 'GEOMETRY'
-        for column in schema:
-            if is_geom(df[column]):
-                return column
-        return 'wkt'
+                self._lockStagingTable(con, table, lock=False)
+            except Exception as e:
+                logger.warning("Failed to release the lock of staging table \"%s\": %s", table, str(e))
+
+    def dropOrphanStagingTables(self, shard=None):
+        """Drop the staging tables left behind by ingest processes that crashed (of any schema).
+
+        A staging table in use is locked by its process (see `_lockStagingTable`); the rest are orphans.
+
+        Returns:
+            (list) The dropped tables (as "schema"."table")
+        """
+        engine = self.engineFor(shard)
+        dropped = []
+        with engine.connect() as con:
+            res = con.execute(sqlalchemy.text(
+                "SELECT schemaname, tablename FROM pg_tables WHERE tablename LIKE :pattern"),
+                pattern=STAGING_TABLE_PREFIX.replace('_', '\\_') + '%')
+            for schema, table in res.fetchall():
+                acquired = con.execute(sqlalchemy.text("SELECT pg_try_advisory_lock(:space, hashtext(:table))"),
+                    space=_STAGING_LOCK_SPACE, table=table).scalar()
+                if not acquired:
+                    continue
+                try:
+                    con.execute('DROP TABLE IF EXISTS "{0}"."{1}"'.format(schema, table))
+                    dropped.append('"{0}"."{1}"'.format(schema, table))
+                except sqlalchemy.exc.DBAPIError as e:
+                    logger.warning("Failed to drop orphan staging table \"%s\".\"%s\": %s", schema, table, str(e.orig).strip())
+                finally:
+                    self._lockStagingTable(con, table, lock=False)
+        if dropped:
+            logger.warning("Dropped orphan staging tables on shard [%s]: %s", shard or '', ', '.join(dropped))
+        return dropped
+
+    def _swapTable(self, con, staging_table, table, schema, replace=True):
+        """Replace a table with a (fully loaded and indexed) staging table.
+
+        The existing table is dropped (if `replace`; otherwise, the table must not exist) and the staging
+        table (along with its indices) is renamed after it. This is meant to run at the very end of the
+        ingest transaction, so that the replaced table is locked only for a short time (until the
+        transaction is committed).
+        """
+        if replace:
+            con.execute('DROP TABLE IF EXISTS "{0}"."{1}"'.format(schema, table))
+        con.execute('ALTER TABLE "{0}"."{1}" RENAME TO "{2}"'.format(schema, staging_table, table))
+        res = con.execute(sqlalchemy.text("SELECT indexname FROM pg_indexes WHERE schemaname = :schema AND tablename = :table"),
+            schema=schema, table=table)
+        for (index,) in res.fetchall():
+            if index.startswith(staging_table):
+                con.execute('ALTER INDEX "{0}"."{1}" RENAME TO "{2}"'.format(
+                    schema, index, table + index[len(staging_table):]))
+
+    def _dropTables(self, engine, tables, schema):
+        """Drop (if they exist) a list of tables, in a separate transaction."""
+        if not tables:
+            return
+        try:
+            with engine.begin() as con:
+                for name in tables:
+                    con.execute('DROP TABLE IF EXISTS "{0}"."{1}"'.format(schema, name))
+        except Exception as e:
+            logger.warning("Failed to drop tables [%s] from schema \"%s\": %s", ', '.join(tables), schema, str(e))
 
     def ingest(self, input_path, table, schema, shard=None, csv_geom_column_name=None,
-               chunksize=5000, commit=True, replace=False, match_into_wks=False, **kwargs):
+               chunksize=5000, commit=True, replace=False, match_into_wks=False, loader=None, parallelism=1,
+               force_2d=None, wks=None, wks_mapping=None, wks_lenient=False, read_engine=None, progress=None, **kwargs):
         """Creates a DB table and ingests a vector file into it.
 
         It reads a vector file with geopandas (fiona) and writes the attributes into a database table.
         The table will contain an indexed geometry column, and also indices for the fields identified as
-        unique (if they exist). The first of them will be the primary key.
+        unique (if they exist). The first of them will be the primary key. All indices are built after
+        data are loaded (into an index-free table).
 
         Parameters:
-            input_path (str): The path of the vector file.
+            input_path (str|ArchiveMember): The path of the vector file, or a dataset inside an archive.
             table (str): The table name (it will be created if does not exist).
             schema (str): The database schema
             shard (str): The shard identifier, or None if no sharding is used
-            csv_geom_column_name (str): The geometric column name in the case of a csv file
+            csv_geom_column_name (str): The geometric column name in the case of a csv file (or a comma-separated
+                pair of longitude/latitude columns). If not given, it will be detected.
             chunksize (int): Number of records that will be read from the file in each turn.
             commit (bool, optional): If False, the database changes will roll back.
-            replace (bool, optional): If True, the table will be replace if it exists.
+            replace (bool, optional): If True, the table will be replace if it exists. Data are loaded (and
+                indexed) into a staging table which, at the end of the transaction, is renamed to replace
+                the existing table. So, readers of the existing table are blocked only for a short time,
+                and a failed ingest leaves existing data untouched.
             match_into_wks (bool, optional): If True, the table will be attempted to be matched into a well known schema
-            **kwargs: Additional arguments for GeoPandas read file.
+            wks (str, optional): The name of the well known schema to match into (instead of the best-matching one).
+            wks_mapping (dict, optional): An explicit mapping of columns into the well known schema `wks`, as source
+                columns keyed on target columns (no matching is performed).
+            wks_lenient (bool, optional): If True, values that cannot be cast into the declared types of the well
+                known schema are set to null (and counted in the log); by default, such a value fails the ingest.
+            read_engine (str, optional): The engine reading vector (non-CSV) files; one of `AVAILABLE_READ_ENGINES`.
+                If not given, the default engine (see `READ_ENGINE`) is used.
+            loader (str, optional): The loader engine writing chunks into the database; one of `to_sql`,
+                `copy` (COPY in text format) or `copy_binary` (COPY in binary format). If not given,
+                the default engine (see `POSTGIS_LOADER`) is used.
+            parallelism (int, optional): The number of workers converting and loading chunks in parallel
+                (each over a separate connection); it is capped at `max_parallelism`. If greater than 1, data
+                are loaded into a staging table, committed on its own (as are the database schema, if created,
+                and every chunk), which is renamed to the target table at the end of the ingest transaction.
+            force_2d (bool, optional): If True, Z/M dimensions are dropped from geometries; if False, they are
+                kept (as a 3D geometry column). If not given, this is enabled only for KML input.
+            progress (Progress, optional): A tracker of the progress of the ingest; the stages are `reading`,
+                `matching` (into a well known schema), `loading`, `indexing` and `committing`.
+            **kwargs: Additional arguments for reading the vector file (see `fiona.open`), and `crs`
+                to override the CRS of the dataset.
 
         Returns:
-            (tuple) The schema, the table name, and number of rows
+            (tuple) The schema, the table name, the number of rows, the time spent (in seconds) loading
+            data, and the time spent building indices (None if no indices were built)
         """
-        import pyproj
-        
         schema = schema or self.default_schema
+        parallelism = max(1, int(parallelism or 1))
+        if parallelism > self.max_parallelism:
+            logger.warning('Parallelism %d exceeds the maximum; using %d workers', parallelism, self.max_parallelism)
+            parallelism = self.max_parallelism
+        progress = progress or Progress()
+        
+        engine = self.engineFor(shard)
         
-        url = self.urlFor(shard)
-        engine = sqlalchemy.create_engine(url)
+        loader_name = loader or self.loader
+        loader = makeLoader(loader_name)
         
-        extension = path.splitext(input_path)[1]
+        extension = sourceExtension(input_path)
         if extension == '.kml':
             gpd.io.file.fiona.drvsupport.supported_drivers['KML'] = 'r'
 
-        eof = False
-        i = 0
+        user_crs = kwargs.pop('crs', None)
+        crs = resolveCrs(user_crs) if user_crs is not None else None
+        if extension == ".csv":
+            progress.start('reading', total_bytes=sourceSize(input_path))
+            chunks = readCsvChunks(input_path, chunksize, csv_geom_column_name, encoding=kwargs.get('encoding'),
+                                   on_read=progress.read)
+        else:
+            progress.start('reading', total_rows=countFeatures(input_path), total_bytes=sourceSize(input_path))
+            chunks = readVectorChunks(input_path, chunksize, engine=(read_engine or self.read_engine), **kwargs)
+        chunks = (df for df in chunks if len(df) > 0)
+        
+        if force_2d is None:
+            force_2d = extension == '.kml'
+
+        # Match into a well known schema once (on the first chunk); the mapping is reused for every chunk
+        mapping = None
+        if match_into_wks:
+            progress.start('matching')
+            first = next(chunks, None)
+            if first is not None:
+                mapping = self._wksMapping(pd.DataFrame(first.drop(columns='geometry')), wks, wks_mapping)
+                if mapping is not None and wks_lenient:
+                    mapping = dataclasses.replace(mapping, lenient=True)
+                chunks = chain([first], chunks)
+            if mapping is None:
+                logger.warning("No well known schema matches table %s.%s", schema, table)
+        # The table of a well known schema is created with the declared column types
+        column_types = mapping.schema.sqlTypes() if mapping is not None else None
+        prepare = lambda df: self._prepareChunk(df, crs, mapping, force_2d)
+        
+        if parallelism > 1:
+            if not replace and self.checkIfTableExists(table, schema, shard):
+                raise ValueError("Table '{0}' already exists.".format(table))
+            try:
+                self.dropOrphanStagingTables(shard)
+            except Exception as e:
+                logger.warning("Failed to drop orphan staging tables on shard [%s]: %s", shard or '', str(e))
+            # Workers (on other connections) must see the schema
+            with engine.begin() as con:
+                con.execute('CREATE SCHEMA IF NOT EXISTS "{0}"'.format(schema))
+
+        # On replace (or for parallel workers), data are loaded into a staging table (to be swapped with the target table)
+        target_table = table
+        if replace or parallelism > 1:
+            target_table = stagingTableName()
+
         rows = 0
+        indices = []
+        index_time = None
+        started = time.perf_counter()
         with engine.connect() as con:
-            trans = con.begin()
-            # Create schema if not exists
-            con.execute('CREATE SCHEMA IF NOT EXISTS "{0}"'.format(schema))
-            # Read input
-            while not eof:
+            # Workers commit into the staging table; it is held (and dropped at the end, unless renamed) here
+            with self._stagingTable(engine, con, target_table, schema) if parallelism > 1 else nullcontext():
+                trans = con.begin()
+                # Create schema if not exists
+                con.execute('CREATE SCHEMA IF NOT EXISTS "{0}"'.format(schema))
+                # Read input
                 with warnings.catch_warnings():
                     warnings.filterwarnings("ignore", category=RuntimeWarning)
-                    if extension == ".csv":
-                        df = pd.read_csv(input_path, sep=self._sniffCsvDelimiter(input_path))
-                        if csv_geom_column_name is None:
-                            csv_geom_column_name = self._findCSVGeomColumn(df)
-                        try:
-                            df['geometry'] = df[csv_geom_column_name].apply(wkt.loads)
-                        except KeyError:
-                            raise GeometricColumnNotFound(f'{csv_geom_column_name} is not the column containing'
-                                                          f' the geometric information')
-                        # Geopandas GeoDataFrame
-                        df = gpd.GeoDataFrame(df, geometry='geometry')
-                    else:
-                        df = gpd.read_file(input_path, rows=slice(i*chunksize, (i+1)*chunksize), **kwargs)
-                    length = len(df)
-                    if length == 0:
-                        eof = True
-                        continue
-                    
-                    logger.info("Processing a chunk of %d rows for table %s.%s", length, schema, table)
-                    
-                    rows = rows + length
-
-                    crs = kwargs.pop('crs', None)
-                    if crs is None:
-                        crs = df.crs
-                    else:
-                        try:
-                            crs = int(crs)
-                        except ValueError:
-                            pass
-                        crs = pyproj.crs.CRS.from_user_input(crs)
-                    
-                    srid = 4326 if crs is None else crs.to_epsg()
-
-                    if extension == '.kml':
-                        df.geometry = df.geometry.map(lambda polygon: shapely.ops.transform(lambda x, y: (x, y), polygon))
-                    df['geom'] = df['geometry'].apply(lambda x: WKTElement(x.wkt, srid=srid))
-                    if i == 0:
+                    first = next(chunks, None)
+                    if first is not None:
+                        progress.start('loading')
+                        logger.info("Processing a chunk of %d rows for table %s.%s", len(first), schema, table)
+                        df, srid, gtype = prepare(first)
                         indices = self._findIndicesOfUniqueFieldsInDataframe(df)
-                        gtype = df.geometry.geom_type.unique()
-                        if len(gtype) == 1:
-                            gtype = gtype[0]
-                        else:
-                            gtype = 'GEOMETRY'
-                        if_exists = 'fail' if not replace else 'replace'
-                    else:
-                        if_exists = 'append'
-                    df.drop('geometry', 1, inplace=True)
-                    try:
-                        if match_into_wks:
-                            df = match_wks(df)
-                        df.to_sql(table, con=con, schema=schema, if_exists=if_exists, index=False,
-                                  dtype={'geom': Geometry(gtype, srid=srid)})
-                    except ValueError as e:
-                        raise e
-                    except sqlalchemy.exc.ProgrammingError as e:
-                        if 'InvalidSchemaName' in str(e):
-                            raise SchemaException('Schema "%s" does not exist.' % (schema))
-                        elif 'InsufficientPrivilege' in str(e):
-                            raise InsufficientPrivilege('Permission denied for schema "%s".' % (schema))
+                        if parallelism > 1:
+                            rows += self._loadParallel(engine, chunks, target_table, schema, df, parallelism,
+                                loader_name, srid, gtype, prepare, column_types, progress)
                         else:
-                            raise e
-                    if extension == ".csv":
-                        eof = True
-                    i += 1
-            
-            logger.info("Processed all %d rows for table \"%s\".\"%s\" on shard [%s]", rows, schema, table, shard or '')
-
-            if commit:
-                trans.commit()
-
-                # Try to create unique indices
-                primary = False
-                for index in indices:
-                    try:
-                        if primary == False:
-                            con.execute('ALTER TABLE {0}."{1}" ADD PRIMARY KEY ("{2}")'.format(schema, table, index))
-                            primary = True
-                        else:
-                            con.execute('CREATE UNIQUE INDEX ON {0}."{1}" ("{2}")'.format(schema, table, index))
-                    except Exception as e:
-                        pass
-            else:
-                trans.rollback()
-            trans.close()
-
-        return (schema, table, rows)
-
-
-def match_wks(df2):
-    max_matches = 0
-    max_matches_column_names = tuple()
-    for f in listdir('/home/kyriakos/PycharmProjects/profile/geoprofile/schemata'):
-        p = path.join('/home/kyriakos/PycharmProjects/profile/geoprofile/schemata', f)
-        if path.isfile(p):
-            with open(p, 'r') as schema_file:
-                column_names = list(pd.json_normalize(safe_load(schema_file)['attributes'])['name'])
-                df = pd.DataFrame(columns=column_names)
-                matcher = Coma()
-                matches = {match: sim for match, sim in valentine_match(df, df2, matcher).items()}
-                cleaned_matches = {match[0][1]: match[1][1] for match in matches.keys()}
-                if max_matches < len(cleaned_matches):
-                    max_matches = len(cleaned_matches)
-                    max_matches_column_names = (column_names, cleaned_matches)
-
-    column_names, cleaned_matches = max_matches_column_names
-    df = pd.DataFrame(columns=column_names)
-    for df1_col, df2_col in cleaned_matches.items():
-        df[df1_col] = df2[df2_col]
-    return df
+                            n = self._loadChunk(loader, con, df, target_table, schema, if_exists='fail', srid=srid,
+                                                gtype=gtype, column_types=column_types)
+                            progress.advance(n)
+                            rows += n
+                            rows += self._loadPipelined(con, loader, chunks, target_table, schema, prepare, progress)
+                
+                load_time = time.perf_counter() - started
+                logger.info("Processed all %d rows for table \"%s\".\"%s\" on shard [%s] in %.3fs",
+                    rows, schema, table, shard or '', load_time)
+
+                if commit:
+                    if rows > 0:
+                        progress.start('indexing')
+                        index_time = self._buildIndices(con, target_table, schema, indices)
+                        if target_table != table:
+                            self._swapTable(con, target_table, table, schema, replace=replace)
+                    progress.start('committing')
+                    trans.commit()
+                else:
+                    trans.rollback()
+                trans.close()
+
+        return (schema, table, rows, load_time, index_time)
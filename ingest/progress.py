@@ -0,0 +1,91 @@
+"""Progress of an ingest job.
+
+An ingest reports its progress (the current stage, the rows loaded and the bytes read so far, and the
+estimated totals) to a tracker, which forwards it to a reporting function. Since rows are counted for
+every chunk, reports are throttled: a change of stage is reported immediately, while rows (and bytes) at
+most once per interval.
+"""
+
+import threading
+import time
+
+from .logging import mainLogger
+logger = mainLogger.getChild('progress')
+
+PROGRESS_INTERVAL = 5.0
+"""The default minimum interval (in seconds) between two reports of a tracker"""
+
+
+class Progress(object):
+    """A (thread-safe) tracker of the progress of a job.
+
+    Parameters:
+        report (callable): The function called as ``report(**progress)``, with the keys `stage`, `rows`,
+            `bytes`, `total_rows` and `total_bytes` (the last three may be None, if unknown).
+        interval (float): The minimum interval (in seconds) between reports of rows (or bytes).
+    """
+
+    def __init__(self, report=None, interval=PROGRESS_INTERVAL):
+        self.report = report
+        self.interval = float(interval)
+        self.stage = None
+        self.rows = 0
+        self.bytes = None
+        self.total_rows = None
+        self.total_bytes = None
+        self._counted = False
+        self._lock = threading.Lock()
+        self._reported_at = None
+
+    def start(self, stage, total_rows=None, total_bytes=None):
+        """Enter a stage (reported immediately), optionally setting the (estimated) totals."""
+        with self._lock:
+            self.stage = stage
+            if total_rows is not None:
+                self.total_rows = total_rows
+                self._counted = True
+            if total_bytes is not None:
+                self.total_bytes = total_bytes
+        self._report(force=True)
+
+    def advance(self, rows):
+        """Count a number of rows (as loaded)."""
+        with self._lock:
+            self.rows += rows
+        self._report()
+
+    def read(self, bytes_read, rows_read):
+        """Set the number of bytes (and rows) read from the source, so far.
+
+        If the number of rows is not known in advance, it is estimated from the size of the source
+        and the (average) size of the rows read so far.
+        """
+        with self._lock:
+            self.bytes = bytes_read
+            if not self._counted and self.total_bytes and bytes_read and rows_read:
+                self.total_rows = max(rows_read, int(rows_read * self.total_bytes / bytes_read))
+        self._report()
+
+    def asDict(self):
+        """Return the progress (as a dictionary)."""
+        bytes_read = self.bytes
+        if bytes_read is None and self.total_bytes and self.total_rows:
+            # Read at the same rate as rows are loaded
+            bytes_read = int(self.total_bytes * min(1.0, self.rows / self.total_rows))
+        return {'stage': self.stage, 'rows': self.rows, 'bytes': bytes_read,
+                'total_rows': self.total_rows, 'total_bytes': self.total_bytes}
+
+    def _report(self, force=False):
+        if self.report is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._reported_at is not None and now - self._reported_at < self.interval:
+                return
+            self._reported_at = now
+            progress = self.asDict()
+        try:
+            self.report(**progress)
+        except Exception as e:
+            # Progress is informative; never fail the job
+            logger.warning('Failed to report progress: %s', str(e))
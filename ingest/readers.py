@@ -0,0 +1,837 @@
+"""Readers yielding the contents of an input file as a stream of chunks."""
+
+import codecs
+import csv
+import gzip
+import io
+import re
+import tarfile
+import zipfile
+from collections import namedtuple
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from itertools import islice
+from os import listdir, makedirs, path, walk
+
+import geopandas as gpd
+import pandas as pd
+
+from .crs import resolveCrs
+from .geometry import fromWkt, fromWkb
+from .logging import mainLogger
+logger = mainLogger.getChild('readers')
+
+
+ARCHIVE_DATASET_EXTENSIONS = ('.shp', '.kml', '.gpkg', '.geojson', '.csv', '.json')
+"""The extensions of datasets looked up inside archives, in order of preference (a generic .json file,
+e.g. metadata accompanying a CSV file, comes last)"""
+
+_SHAPEFILE_SIDECAR_EXTENSIONS = ('.shp', '.shx', '.dbf', '.prj', '.cpg', '.qix', '.sbn', '.sbx')
+
+
+def _isDatasetFile(name, dataset):
+    """Check if a file belongs to a dataset, i.e. it is the dataset itself or (for a shapefile) one of its sidecar files."""
+    stem, extension = path.splitext(dataset)
+    if extension.lower() == '.shp':
+        base, ext = path.splitext(name)
+        return base == stem and ext.lower() in _SHAPEFILE_SIDECAR_EXTENSIONS
+    return name == dataset
+
+
+class ArchiveMember(namedtuple('ArchiveMember', ['kind', 'archive', 'name', 'compressed'])):
+    """A dataset inside an archive, to be read without extracting the archive.
+
+    The kind is one of: 'zip', 'tar', or 'gzip' (a single gzip-compressed file). For a tar archive,
+    `compressed` tells if the archive itself is compressed.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return self.vsiPath
+
+    @property
+    def extension(self):
+        return path.splitext(self.name)[1].lower()
+
+    @property
+    def vsiPath(self):
+        """The path of the dataset in a GDAL virtual file system."""
+        if self.kind == 'gzip':
+            return '/vsigzip/' + path.abspath(self.archive)
+        return '/vsi{0}/{1}/{2}'.format(self.kind, path.abspath(self.archive), self.name)
+
+    def needsExtraction(self):
+        """Check if the dataset has to be extracted, i.e. if random access is needed on a compressed stream.
+
+        Only CSV files are read sequentially; other formats (e.g. shapefiles) may seek in any direction,
+        which, inside a compressed tar archive, means decompressing again from the start of the archive.
+        """
+        return self.kind == 'tar' and self.compressed and self.extension != '.csv'
+
+    @contextmanager
+    def open(self):
+        """Open the dataset as a (decompressed) binary stream."""
+        if self.kind == 'zip':
+            with zipfile.ZipFile(self.archive) as archive, archive.open(self.name) as f:
+                yield f
+        elif self.kind == 'tar':
+            # Stream the archive, i.e. without seeking back
+            with tarfile.open(self.archive, 'r|*') as archive:
+                for info in archive:
+                    if info.name == self.name:
+                        yield archive.extractfile(info)
+                        return
+            raise FileNotFoundError('%s not found in %s' % (self.name, self.archive))
+        else:
+            with gzip.open(self.archive, 'rb') as f:
+                yield f
+
+    def extract(self, directory):
+        """Extract (only) the files of the dataset into a directory.
+
+        Returns:
+            (str) The path of the extracted dataset
+        """
+        wanted = lambda name: _isDatasetFile(name, self.name)
+        if self.kind == 'zip':
+            with zipfile.ZipFile(self.archive) as archive:
+                for name in archive.namelist():
+                    if wanted(name):
+                        archive.extract(name, directory)
+        elif self.kind == 'tar':
+            with tarfile.open(self.archive) as archive:
+                archive.extractall(directory, members=[m for m in archive.getmembers() if m.isfile() and wanted(m.name)])
+        else:
+            raise ValueError('Nothing to extract from a single compressed file')
+        return path.join(directory, self.name)
+
+
+def _isCompressed(input_path):
+    with open(input_path, 'rb') as f:
+        magic = f.read(6)
+    return magic.startswith((b'\x1f\x8b', b'BZh', b'\xfd7zXZ'))
+
+
+def _isHidden(name):
+    """Check if a member of an archive is metadata of archivers (e.g. __MACOSX/) or a hidden file."""
+    return any(part.startswith(('.', '__')) for part in name.split('/'))
+
+
+def findArchiveMember(input_path):
+    """Find the dataset inside an archive (zip, tar, possibly compressed, or a gzip-compressed file).
+
+    Parameters:
+        input_path (str): The path of the file.
+
+    Returns:
+        (ArchiveMember) The dataset (the first found, by order of `ARCHIVE_DATASET_EXTENSIONS`); None if
+        the file is not an archive, or no known dataset is found inside it.
+    """
+    if path.isdir(input_path):
+        return None
+    if zipfile.is_zipfile(input_path):
+        with zipfile.ZipFile(input_path) as archive:
+            names = [i.filename for i in archive.infolist() if not i.is_dir()]
+        kind, compressed = 'zip', False
+    elif tarfile.is_tarfile(input_path):
+        with tarfile.open(input_path) as archive:
+            names = [m.name for m in archive.getmembers() if m.isfile()]
+        kind, compressed = 'tar', _isCompressed(input_path)
+    elif _isCompressed(input_path) and input_path.lower().endswith('.gz'):
+        name = path.basename(input_path)[:-3]
+        return ArchiveMember('gzip', input_path, name, True) if path.splitext(name)[1].lower() in ARCHIVE_DATASET_EXTENSIONS else None
+    else:
+        return None
+    names = sorted(n for n in names if not _isHidden(n))
+    for extension in ARCHIVE_DATASET_EXTENSIONS:
+        name = next((n for n in names if n.lower().endswith(extension)), None)
+        if name is not None:
+            return ArchiveMember(kind, input_path, name, compressed)
+    return None
+
+
+def resolveSource(input_path, extract_dir):
+    """Resolve the source to be read for a (possibly archived) file.
+
+    Datasets inside archives are read in place (see `ArchiveMember`); only the files of a dataset that
+    needs random access on a compressed stream are extracted. Archives with no known dataset inside
+    are extracted as a whole (to be read as a directory).
+
+    Parameters:
+        input_path (str): The path of the (uploaded) file.
+        extract_dir (str): The directory where archives are extracted into (if needed).
+
+    Returns:
+        (str|ArchiveMember) The path of the file (or directory) to be read, or the dataset inside an archive.
+    """
+    member = findArchiveMember(input_path)
+    if member is not None:
+        if member.needsExtraction():
+            logger.debug('Extracting %s from %s', member.name, input_path)
+            return member.extract(extract_dir)
+        return member
+    if not path.isdir(input_path) and (zipfile.is_zipfile(input_path) or tarfile.is_tarfile(input_path)):
+        logger.debug('Extracting %s (no known dataset found inside)', input_path)
+        if zipfile.is_zipfile(input_path):
+            with zipfile.ZipFile(input_path, 'r') as handle:
+                handle.extractall(extract_dir)
+        else:
+            with tarfile.open(input_path) as handle:
+                handle.extractall(extract_dir)
+        return extract_dir
+    return input_path
+
+
+def sourceExtension(source):
+    """Return the (lowercase) extension of a source (a path or an `ArchiveMember`)."""
+    if isinstance(source, ArchiveMember):
+        return source.extension
+    return path.splitext(source)[1].lower()
+
+
+_COUNTABLE_EXTENSIONS = ('.shp', '.gpkg')
+"""The extensions of vector formats whose features are counted (by the driver) without a full scan"""
+
+
+def sourceSize(source):
+    """Return the size (in bytes) of a source, as read; None if it is not known in advance.
+
+    The size of a dataset inside an archive is its uncompressed size (unknown for a compressed tar archive),
+    and the size of a directory is the total size of its files. The size of a shapefile includes its
+    sidecar files (e.g. .dbf, .shx).
+    """
+    try:
+        if isinstance(source, ArchiveMember):
+            if source.kind == 'zip':
+                with zipfile.ZipFile(source.archive) as archive:
+                    archive.getinfo(source.name)
+                    return sum(info.file_size for info in archive.infolist() if _isDatasetFile(info.filename, source.name))
+            elif source.kind == 'tar':
+                if source.compressed:
+                    return None
+                with tarfile.open(source.archive) as archive:
+                    archive.getmember(source.name)
+                    return sum(m.size for m in archive.getmembers() if m.isfile() and _isDatasetFile(m.name, source.name))
+            else:
+                # The size (modulo 2^32) of the uncompressed data is the trailer of a gzip file
+                with open(source.archive, 'rb') as f:
+                    f.seek(-4, io.SEEK_END)
+                    return int.from_bytes(f.read(4), 'little')
+        if path.isdir(source):
+            return sum(path.getsize(path.join(root, name)) for root, _, names in walk(source) for name in names)
+        size = path.getsize(source)
+        if sourceExtension(source) == '.shp':
+            directory, name = path.split(source)
+            size += sum(path.getsize(path.join(directory, f)) for f in listdir(directory or '.')
+                        if f != name and _isDatasetFile(f, name))
+        return size
+    except (OSError, KeyError, tarfile.TarError, zipfile.BadZipFile) as e:
+        logger.debug('Failed to find the size of %s: %s', source, str(e))
+        return None
+
+
+def countFeatures(source):
+    """Count the features of a vector file, if this is cheap (i.e. the format keeps a count of features).
+
+    Returns:
+        (int) The number of features; None if unknown.
+    """
+    import fiona
+
+    extension = sourceExtension(source)
+    if not isinstance(source, ArchiveMember) and path.isdir(source):
+        # A directory containing a shapefile
+        extension = '.shp'
+    if extension not in _COUNTABLE_EXTENSIONS:
+        return None
+    try:
+        with fiona.open(_fionaPath(source)) as collection:
+            return len(collection)
+    except Exception as e:
+        logger.debug('Failed to count the features of %s: %s', source, str(e))
+        return None
+
+
+@contextmanager
+def _openBinary(source):
+    if isinstance(source, ArchiveMember):
+        with source.open() as f:
+            yield f
+    else:
+        with open(source, 'rb') as f:
+            yield f
+
+
+def _fionaPath(source):
+    return source.vsiPath if isinstance(source, ArchiveMember) else source
+
+
+def _encodingHint(source):
+    return None if isinstance(source, ArchiveMember) else cpgEncoding(source)
+
+
+def _driverOptions(input_path):
+    """Return the options of `fiona.open` pinning the driver for the given file (if needed).
+
+    The drivers not enabled by default are enabled (read-only); e.g. KML files are read with the KML driver
+    (never with LIBKML, which yields a different set of columns).
+    """
+    import fiona
+
+    if sourceExtension(input_path) == '.kml':
+        fiona.drvsupport.supported_drivers['KML'] = 'r'
+        return {'driver': 'KML'}
+    return {}
+
+
+READ_ENGINES = ('fiona', 'pyogrio')
+"""The engines for reading vector files: 'fiona' (feature by feature), or 'pyogrio' (GDAL Arrow stream)"""
+
+_ARROW_MIN_GDAL_VERSION = (3, 6, 0)
+
+
+def _arrowEngineAvailable():
+    """Check if the (optional) packages of the 'pyogrio' engine are installed, and GDAL has Arrow streams."""
+    try:
+        import pyarrow
+        import pyogrio
+        from pyogrio.raw import open_arrow
+    except ImportError:
+        return False
+    return tuple(pyogrio.__gdal_version__) >= _ARROW_MIN_GDAL_VERSION
+
+
+AVAILABLE_READ_ENGINES = tuple(e for e in READ_ENGINES if e != 'pyogrio' or _arrowEngineAvailable())
+"""The read engines available in this environment"""
+
+
+def readVectorChunks(input_path, chunksize=5000, engine='fiona', **kwargs):
+    """Read a vector file (Shapefile, KML, ...) in chunks of features.
+
+    The source is opened only once and its features are consumed from a single iterator,
+    so the total cost of reading is linear to the size of the file.
+
+    Parameters:
+        input_path (str|ArchiveMember): The path of the vector file (or of a directory containing a
+            Shapefile), or a dataset inside an archive.
+        chunksize (int): The (maximum) number of features in each chunk.
+        engine (str): The read engine (one of `AVAILABLE_READ_ENGINES`). KML files are always read with
+            fiona, with the KML driver (GDAL would open them with LIBKML for pyogrio, yielding other columns).
+        **kwargs: Additional arguments for the engine (e.g. `encoding`).
+
+    Yields:
+        (GeoDataFrame) A chunk of features.
+    """
+    if engine not in READ_ENGINES:
+        raise ValueError('Unknown read engine: {0}'.format(engine))
+    elif engine not in AVAILABLE_READ_ENGINES:
+        raise ValueError('The {0} read engine is not available'.format(engine))
+    if engine == 'pyogrio' and sourceExtension(input_path) != '.kml':
+        yield from _readArrowChunks(input_path, chunksize, **kwargs)
+        return
+
+    import fiona
+
+    with fiona.open(_fionaPath(input_path), **_driverOptions(input_path), **kwargs) as source:
+        # Resolve the CRS once, instead of letting every chunk parse it again
+        crs = resolveCrs(source.crs_wkt)[0] if source.crs_wkt else None
+        columns = list(source.schema['properties']) + ['geometry']
+        features = iter(source)
+        while True:
+            batch = list(islice(features, chunksize))
+            if not batch:
+                break
+            yield gpd.GeoDataFrame.from_features(batch, crs=crs, columns=columns)
+
+
+def _readArrowChunks(input_path, chunksize=5000, encoding=None):
+    """Read a vector file in chunks from the Arrow stream of GDAL (through pyogrio).
+
+    Features are read in columnar batches: attributes as Arrow arrays, and geometries as WKB,
+    parsed with a vectorized function; i.e. no (Python) object is created per feature.
+    """
+    try:
+        from pyogrio.raw import open_arrow
+    except ImportError:
+        raise ValueError('The pyogrio read engine is not available (pyogrio and pyarrow are required)')
+
+    options = {'batch_size': chunksize}
+    if encoding:
+        options['encoding'] = encoding
+    try:
+        stream = open_arrow(_fionaPath(input_path), use_pyarrow=True, **options)
+    except TypeError:
+        # Older versions always return a pyarrow reader
+        stream = open_arrow(_fionaPath(input_path), **options)
+    with stream as (meta, reader):
+        crs = resolveCrs(meta['crs'])[0] if meta.get('crs') else None
+        geometry_name = meta.get('geometry_name') or 'wkb_geometry'
+        for batch in reader:
+            if batch.num_rows == 0:
+                continue
+            names = batch.schema.names
+            geometries = batch.column(names.index(geometry_name)).to_numpy(zero_copy_only=False)
+            attributes = batch.select([n for n in names if n != geometry_name]) if hasattr(batch, 'select') else \
+                batch.drop_columns([geometry_name])
+            df = attributes.to_pandas()
+            df['geometry'] = fromWkb(geometries)
+            yield gpd.GeoDataFrame(df, geometry='geometry', crs=crs)
+
+
+def readAttributeSample(input_path, rows=100, encoding=None):
+    """Read the header and the first few rows of the attributes (i.e. everything but geometries) of a file.
+
+    Parameters:
+        input_path (str|ArchiveMember): The path of the file (CSV, or any vector file readable by fiona),
+            or a dataset inside an archive.
+        rows (int): The (maximum) number of rows.
+        encoding (str, optional): The encoding of the file.
+
+    Returns:
+        (DataFrame) The sample of attributes.
+    """
+    if sourceExtension(input_path) == '.csv':
+        with _openBinary(input_path) as f:
+            probe, _ = probeCsv(f, encoding, _encodingHint(input_path), rows=rows)
+        return probe.sample
+
+    import fiona
+
+    options = {'encoding': encoding} if encoding else {}
+    with fiona.open(_fionaPath(input_path), **_driverOptions(input_path), **options) as source:
+        columns = list(source.schema['properties'])
+        records = [feature['properties'] for feature in islice(source, rows)]
+    return pd.DataFrame.from_records([dict(r) for r in records], columns=columns)
+
+
+def _extractDbfHead(stream, target, rows):
+    """Write the header and (at most) the first rows of a dBASE file (e.g. the attributes of a shapefile).
+
+    Returns:
+        (str) The path of the written file
+    """
+    header = stream.read(32)
+    header_size = int.from_bytes(header[8:10], 'little')
+    record_size = int.from_bytes(header[10:12], 'little')
+    if len(header) < 32 or header_size < 32 or record_size == 0:
+        raise ValueError('Not a valid dBASE file: ' + target)
+    count = min(int.from_bytes(header[4:8], 'little'), rows)
+    rest = stream.read(header_size - 32 + count * record_size)
+    count = max(0, (len(rest) - (header_size - 32)) // record_size)
+    with open(target, 'wb') as f:
+        f.write(header[:4] + count.to_bytes(4, 'little') + header[8:])
+        f.write(rest[:(header_size - 32 + count * record_size)])
+        f.write(b'\x1a')
+    return target
+
+
+def _readTarAttributeSample(input_path, extract_dir, rows, encoding):
+    """Read a sample of the attributes of the first dataset found in a tar archive, in a single streaming pass.
+
+    Only what the attributes need is read: a CSV file is probed from the stream, the attributes of a
+    shapefile (its .dbf file) are extracted up to the rows of the sample, and any other dataset is
+    extracted (as a single file).
+
+    Returns:
+        (DataFrame) The sample of attributes; None, if no known dataset is found.
+    """
+    with tarfile.open(input_path, 'r|*') as archive:
+        for info in archive:
+            if not info.isfile() or _isHidden(info.name):
+                continue
+            extension = path.splitext(info.name)[1].lower()
+            if extension == '.csv':
+                probe, _ = probeCsv(archive.extractfile(info), encoding, rows=rows)
+                return probe.sample
+            if extension == '.dbf':
+                makedirs(extract_dir, exist_ok=True)
+                target = _extractDbfHead(archive.extractfile(info), path.join(extract_dir, 'sample.dbf'), rows)
+                return readAttributeSample(target, rows, encoding)
+            if extension in ARCHIVE_DATASET_EXTENSIONS and extension != '.shp':
+                makedirs(extract_dir, exist_ok=True)
+                info.name = path.basename(info.name)
+                archive.extract(info, extract_dir)
+                return readAttributeSample(path.join(extract_dir, info.name), rows, encoding)
+    return None
+
+
+def readPreviewSample(input_path, extract_dir, rows=100, encoding=None):
+    """Read the header and the first few rows of the attributes of a (possibly archived) file.
+
+    Unlike `resolveSource`, a tar archive is not listed (i.e. decompressed as a whole): it is streamed up to
+    the first dataset found inside it (see `_readTarAttributeSample`).
+
+    Parameters:
+        input_path (str): The path of the (uploaded) file.
+        extract_dir (str): The directory where files are extracted into (if needed).
+        rows (int): The (maximum) number of rows.
+        encoding (str, optional): The encoding of the file.
+
+    Returns:
+        (DataFrame) The sample of attributes.
+    """
+    if not path.exists(input_path):
+        raise FileNotFoundError('File not found: %s' % (path.basename(input_path)))
+    if path.isfile(input_path) and not zipfile.is_zipfile(input_path) and tarfile.is_tarfile(input_path):
+        sample = _readTarAttributeSample(input_path, extract_dir, rows, encoding)
+        if sample is not None:
+            return sample
+    return readAttributeSample(resolveSource(input_path, extract_dir), rows, encoding)
+
+
+class GeometricColumnNotFound(Exception):
+    pass
+
+
+GeometryColumns = namedtuple('GeometryColumns', ['kind', 'columns'])
+GeometryColumns.__doc__ = """The column(s) of a CSV file holding geometries.
+
+The kind is one of: 'wkt' (a WKT column), 'wkb' (a hex-encoded WKB column), or 'xy' (a pair of
+longitude/latitude columns).
+"""
+
+CSV_SAMPLE_SIZE = 1000
+"""The number of rows (at the head of a CSV file) examined to detect the geometric column(s)"""
+
+_IS_GEOM_THRESHOLD = 0.9
+
+_WKT_PATTERN = (r'^\s*(?:SRID=\d+\s*;\s*)?'
+    r'(?:POINT|LINESTRING|LINEARRING|POLYGON|MULTIPOINT|MULTILINESTRING|MULTIPOLYGON|GEOMETRYCOLLECTION)'
+    r'\s*(?:ZM|Z|M)?\s*(?:\(.*\)|EMPTY)\s*$')
+
+_WKB_PATTERN = r'^\s*0[01](?:[0-9A-Fa-f]{2}){20,}\s*$'
+
+_GEOMETRY_COLUMN_NAMES = ('wkt', 'WKT', 'geometry', 'GEOMETRY')
+
+_LONGITUDE_COLUMN_NAMES = ('lon', 'lng', 'long', 'longitude', 'x')
+
+_LATITUDE_COLUMN_NAMES = ('lat', 'latitude', 'y')
+
+
+def _matchRatios(sample, pattern):
+    """Compute, for every column of a sample, the ratio of (non-null) values matching a pattern.
+
+    All columns are matched at once, as a single (stacked) series of strings.
+    """
+    if sample.empty:
+        return pd.Series(dtype=float)
+    values = sample.stack()
+    values = values[values.map(type) == str]
+    if values.empty:
+        return pd.Series(dtype=float)
+    matches = values.str.match(pattern, case=False)
+    return matches.groupby(level=1).mean()
+
+
+def findCsvGeometryCandidates(sample):
+    """Find all (single or paired) columns of a CSV sample that look like holding geometries.
+
+    Parameters:
+        sample (DataFrame): A sample of rows (at the head) of the CSV file.
+
+    Returns:
+        (list) A list of `GeometryColumns`, most probable first
+    """
+    candidates = []
+    text = sample.select_dtypes(include=['object'])
+    for kind, pattern in (('wkt', _WKT_PATTERN), ('wkb', _WKB_PATTERN)):
+        ratios = _matchRatios(text, pattern)
+        matched = [c for c in text.columns if ratios.get(c, 0.0) > _IS_GEOM_THRESHOLD]
+        # Prefer conventional names among matched columns
+        matched.sort(key=lambda c: c not in _GEOMETRY_COLUMN_NAMES)
+        candidates.extend(GeometryColumns(kind, (c,)) for c in matched)
+
+    numeric = {str(c).lower(): c for c in sample.select_dtypes(include=['number']).columns}
+    lon = next((numeric[n] for n in _LONGITUDE_COLUMN_NAMES if n in numeric), None)
+    lat = next((numeric[n] for n in _LATITUDE_COLUMN_NAMES if n in numeric), None)
+    if lon is not None and lat is not None and \
+            sample[lon].dropna().between(-180, 180).all() and sample[lat].dropna().between(-90, 90).all():
+        candidates.append(GeometryColumns('xy', (lon, lat)))
+
+    return candidates
+
+
+def findCsvGeometryColumns(sample, name=None, candidates=None):
+    """Detect the column(s) containing the geometric information in a sample of a CSV file.
+
+    Parameters:
+        sample (DataFrame): A sample of rows (at the head) of the CSV file.
+        name (str, optional): The name of the geometric column, if known; it may also be a pair of
+            longitude/latitude columns separated by comma (e.g. 'lon,lat').
+        candidates (list, optional): The candidates as found by `findCsvGeometryCandidates` (if
+            not given, they will be computed).
+
+    Returns:
+        (GeometryColumns) The detected geometric column(s)
+    """
+    def kind_of(column):
+        if column in sample.columns and sample[column].dtype == object:
+            ratios = _matchRatios(sample[[column]], _WKB_PATTERN)
+            if ratios.get(column, 0.0) > _IS_GEOM_THRESHOLD:
+                return 'wkb'
+        return 'wkt'
+
+    if name is not None:
+        names = [n.strip() for n in name.split(',')]
+        if len(names) == 2:
+            return GeometryColumns('xy', tuple(names))
+        return GeometryColumns(kind_of(name), (name,))
+
+    for column in _GEOMETRY_COLUMN_NAMES:
+        if column in sample.columns:
+            return GeometryColumns(kind_of(column), (column,))
+
+    if candidates is None:
+        candidates = findCsvGeometryCandidates(sample)
+    if candidates:
+        return candidates[0]
+
+    return GeometryColumns('wkt', ('wkt',))
+
+
+CSV_PROBE_SIZE = 1 << 20
+"""The (maximum) number of bytes read from the start of a CSV file to probe its dialect, encoding and header"""
+
+_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+_DEFAULT_ENCODING = 'utf-8'
+
+
+class InvalidEncoding(Exception):
+    pass
+
+
+@dataclass
+class CsvProbe:
+    """The results of probing the start of a CSV file."""
+    delimiter: str
+    quotechar: str
+    encoding: str
+    header: bool
+    sample: pd.DataFrame = field(repr=False)
+    candidates: list
+
+    def readOptions(self):
+        """Return the options for `pandas.read_csv` matching the probed dialect."""
+        return {'sep': self.delimiter, 'quotechar': self.quotechar, 'header': (0 if self.header else None)}
+
+    def dtypes(self):
+        """Return the column types settled from the sample, for every chunk read after it.
+
+        Numeric columns are read as floating point (an integral sample says nothing of the rows after it),
+        while textual or empty columns are read as text, so that a type inferred per chunk never
+        disagrees with the table created from the first one.
+        """
+        dtypes = {}
+        for name, values in self.sample.items():
+            if pd.api.types.is_bool_dtype(values):
+                continue
+            if values.isna().all() or not pd.api.types.is_numeric_dtype(values):
+                dtypes[name] = object
+            else:
+                dtypes[name] = 'float64'
+        return dtypes
+
+
+def cpgEncoding(input_path):
+    """Return the encoding declared in a .cpg file accompanying the given file (None if there is none)."""
+    cpg_path = path.splitext(input_path)[0] + '.cpg'
+    if not path.isfile(cpg_path):
+        return None
+    with open(cpg_path, 'r', encoding='ascii', errors='ignore') as f:
+        declared = f.read().strip()
+    if declared.isdigit():
+        declared = 'cp' + declared
+    try:
+        return codecs.lookup(declared).name
+    except LookupError:
+        return None
+
+
+def _detectEncoding(head, encoding=None, encoding_hint=None):
+    """Choose the encoding for a file given its first bytes.
+
+    A BOM always wins; otherwise the hint (e.g. from a .cpg file) is trusted over the requested encoding.
+    The chosen encoding is checked against the contents; no other encoding is guessed.
+
+    Raises:
+        InvalidEncoding: If the contents cannot be decoded with the chosen encoding.
+    """
+    for bom, name in _BOMS:
+        if head.startswith(bom):
+            return name
+    name = encoding_hint or encoding or _DEFAULT_ENCODING
+    try:
+        # An incomplete multi-byte sequence may be left at the end of the buffer
+        codecs.getincrementaldecoder(name)().decode(head, final=False)
+    except UnicodeDecodeError as e:
+        raise InvalidEncoding(f'The file cannot be decoded as {name} (invalid byte at position {e.start});'
+                              f' specify the encoding of the file')
+    return name
+
+
+def _splitRecords(text, quotechar='"', limit=None, final=True):
+    """Split CSV text into records (keeping the line terminators), without splitting quoted fields.
+
+    As with the csv module, only \\r and \\n terminate records. Unless `final`, the text is a prefix of
+    the file, and a trailing unterminated record (e.g. cut inside a quoted field) is dropped.
+    """
+    q = re.escape(quotechar)
+    pattern = re.compile(r'(?:{0}[^{0}]*{0}|[^{0}\r\n])*(?:\r\n|\n|\r)'.format(q))
+    records = []
+    position = 0
+    while limit is None or len(records) < limit:
+        match = pattern.match(text, position)
+        if match is None:
+            break
+        records.append(match.group())
+        position = match.end()
+    if final and position < len(text) and (limit is None or len(records) < limit):
+        records.append(text[position:])
+    return records
+
+
+def _looksLikeData(row):
+    """Check if a (parsed) row looks like a data row rather than a header row."""
+    values = [v.strip() for v in row if v.strip()]
+    if not values:
+        return False
+    if any(re.match(_WKT_PATTERN, v, re.IGNORECASE) or re.match(_WKB_PATTERN, v) for v in values):
+        return True
+    try:
+        [float(v) for v in values]
+        return True
+    except ValueError:
+        return False
+
+
+def probeCsv(stream, encoding=None, encoding_hint=None, size=CSV_PROBE_SIZE, rows=CSV_SAMPLE_SIZE):
+    """Probe the start of a CSV file, reading (once) a bounded buffer.
+
+    Parameters:
+        stream (file): A binary stream positioned at the start of the CSV file.
+        encoding (str, optional): The requested encoding (checked against the contents).
+        encoding_hint (str, optional): An encoding hint (e.g. from a .cpg file).
+        size (int): The (maximum) number of bytes to read.
+        rows (int): The (maximum) number of rows in the sample.
+
+    Returns:
+        (tuple) The probe results (a CsvProbe), and the buffer read from the stream (to be replayed).
+
+    Raises:
+        InvalidEncoding: If the contents cannot be decoded.
+    """
+    head = stream.read(size)
+    final = len(head) < size
+    encoding = _detectEncoding(head, encoding, encoding_hint)
+    text = codecs.getincrementaldecoder(encoding)().decode(head, final=final)
+    records = _splitRecords(text, limit=(rows + 1), final=final)
+    if not records:
+        return CsvProbe(',', '"', encoding, True, pd.DataFrame(), []), head
+
+    try:
+        dialect = csv.Sniffer().sniff(''.join(records[:20]), delimiters=',;\t|')
+        delimiter, quotechar = dialect.delimiter, (dialect.quotechar or '"')
+    except csv.Error:
+        try:
+            delimiter, quotechar = csv.Sniffer().sniff(records[0], delimiters=',;\t|').delimiter, '"'
+        except csv.Error:
+            delimiter, quotechar = ',', '"'
+    if quotechar != '"':
+        records = _splitRecords(text, quotechar, limit=(rows + 1), final=final)
+    first_row = next(csv.reader(records[:1], delimiter=delimiter, quotechar=quotechar), [])
+    header = not _looksLikeData(first_row)
+
+    sample = pd.read_csv(io.StringIO(''.join(records)), sep=delimiter, quotechar=quotechar,
+                         header=(0 if header else None))
+    return CsvProbe(delimiter, quotechar, encoding, header, sample, findCsvGeometryCandidates(sample)), head
+
+
+class _PrefixedStream(io.RawIOBase):
+    """A binary stream that replays an already consumed prefix, then continues with the underlying stream."""
+
+    def __init__(self, prefix, stream):
+        self._prefix = memoryview(prefix) if prefix else None
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._prefix is not None:
+            n = min(len(b), self._prefix.nbytes)
+            b[:n] = self._prefix[:n]
+            self._prefix = self._prefix[n:]
+            if not self._prefix.nbytes:
+                # Release the (replayed) prefix
+                self._prefix = None
+            return n
+        data = self._stream.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+
+def _parseGeometries(df, geometry_columns):
+    kind, columns = geometry_columns
+    try:
+        if kind == 'xy':
+            return gpd.points_from_xy(df[columns[0]], df[columns[1]])
+        elif kind == 'wkb':
+            return fromWkb(df[columns[0]])
+        return fromWkt(df[columns[0]])
+    except KeyError:
+        raise GeometricColumnNotFound(f'{", ".join(str(c) for c in columns)} is not the column containing'
+                                      f' the geometric information')
+
+
+def readCsvChunks(input_path, chunksize=5000, geom=None, encoding=None, on_read=None):
+    """Read a CSV file in chunks, parsing geometries from WKT, hex-encoded WKB, or longitude/latitude columns.
+
+    The file is streamed in batches of `chunksize` rows, so memory usage is bounded regardless
+    of the size of the file. The dialect, encoding, header and geometric column(s) (if not given)
+    are probed from a buffer at the start of the file; that buffer is then replayed to the reader
+    (i.e. the start of the file is read only once). A CSV file inside an archive is decompressed
+    while streaming.
+
+    Parameters:
+        input_path (str|ArchiveMember): The path of the CSV file, or a CSV file inside an archive.
+        chunksize (int): The (maximum) number of rows in each chunk.
+        geom (str, optional): The name of the geometric column (or a comma-separated pair of
+            longitude/latitude columns).
+        encoding (str, optional): The (expected) encoding of the file.
+        on_read (callable, optional): A function called after each chunk as ``on_read(bytes_read, rows_read)``,
+            with the bytes (as decompressed) and rows read so far.
+
+    Yields:
+        (GeoDataFrame) A chunk of features.
+    """
+    with _openBinary(input_path) as f:
+        probe, head = probeCsv(f, encoding, _encodingHint(input_path))
+        geometry_columns = findCsvGeometryColumns(probe.sample, geom, probe.candidates)
+        logger.debug('Probed %s: %s; geometric column(s): %s', input_path, probe, geometry_columns)
+
+        stream = io.TextIOWrapper(io.BufferedReader(_PrefixedStream(head, f)),
+                                  encoding=probe.encoding, newline='')
+        del head
+        reader = pd.read_csv(stream, chunksize=chunksize, dtype=probe.dtypes(), **probe.readOptions())
+        rows_read = 0
+        try:
+            for df in reader:
+                rows_read += len(df)
+                if on_read is not None:
+                    try:
+                        position = f.tell()
+                    except (OSError, ValueError):
+                        position = None
+                    on_read(position, rows_read)
+                df['geometry'] = _parseGeometries(df, geometry_columns)
+                yield gpd.GeoDataFrame(df, geometry='geometry')
+        finally:
+            reader.close()
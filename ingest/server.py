@@ -0,0 +1,10 @@
+"""Hooks of the WSGI server (gunicorn), loaded with ``gunicorn --config python:ingest.server``.
+
+Only server hooks (and settings) are read from this module; the application is loaded as usual.
+"""
+
+
+def post_worker_init(worker):
+    """Start the in-process queue worker, once a process of the server has loaded the application."""
+    from ingest.app import startQueueWorker
+    startQueueWorker()
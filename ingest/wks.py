@@ -0,0 +1,509 @@
+"""A registry of well-known schemata, and matching of dataset attributes into them.
+
+Well-known schemata are described by YAML files (see `ingest/schemata`). The registry parses each
+file once and keeps the (precomputed) column metadata; a file is parsed again only if its
+modification time changes.
+
+Matching against each schema is CPU-bound and independent of the other schemata, so schemata are
+matched in parallel on a (lazily started, long-lived) pool of processes. The pool is shared by all
+requests (of a process) and has a fixed size; each request caps the number of its own matches in
+flight, so that a single request does not occupy the whole pool.
+"""
+
+import multiprocessing
+import os
+import re
+import threading
+import time
+from hashlib import md5
+from collections import defaultdict, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from os import path, listdir
+
+import pandas as pd
+import sqlalchemy
+from yaml import safe_load
+
+from .logging import mainLogger
+logger = mainLogger.getChild('wks')
+
+SCHEMATA_DIR = path.join(path.dirname(path.abspath(__file__)), 'schemata')
+
+DEFAULT_MATCH_TIMEOUT = 60
+"""The default time (in seconds) allowed for matching into a single well-known schema"""
+
+MATCH_SAMPLE_SIZE = 1000
+"""The (maximum) number of rows sent to the matcher processes"""
+
+DEFAULT_MATCH_CANDIDATES = 3
+"""The default number of candidate schemata (ranked by the name index) that go through full matching"""
+
+MATCH_POOL_SIZE = int(os.getenv('WKS_MATCH_POOL_SIZE') or 0) or (os.cpu_count() or 1)
+"""The number of processes in the (shared) pool matching into well-known schemata"""
+
+RANK_CACHE_SIZE = 256
+"""The (maximum) number of header signatures whose ranked matches are cached"""
+
+
+WKS_TYPES = {
+    'integer': ('Int64', sqlalchemy.BigInteger),
+    'float': ('float64', lambda: sqlalchemy.Float(precision=53)),
+    'string': (object, sqlalchemy.Text),
+}
+"""The dtype and the SQL type for each attribute type of a well-known schema"""
+
+
+def castColumn(values, declared_type, lenient=False):
+    """Cast a column into the dtype of the declared (well-known schema) type, as a single vectorized step.
+
+    Integers are cast into a nullable integer dtype, and strings into an object column of `str` (integral
+    floats are formatted as integers). A value that cannot be cast (e.g. text, or a fraction for an integer)
+    is refused, unless casting is lenient: then it is set to null, and the number of such values is logged.
+
+    Parameters:
+        values (Series): The column.
+        declared_type (str): The declared type (a key of `WKS_TYPES`); other types are not cast.
+        lenient (bool, optional): If True, values that cannot be cast are set to null instead of refused.
+
+    Raises:
+        ValueError: If a value cannot be cast (and casting is not lenient).
+
+    Returns:
+        (Series) The cast column
+    """
+    if declared_type in ('integer', 'float'):
+        if declared_type == 'integer' and values.dtype.kind in 'iu':
+            return values.astype('Int64')
+        numeric = pd.to_numeric(values, errors='coerce')
+        invalid = values.notna() & numeric.isna()
+        if declared_type == 'integer':
+            invalid |= numeric.notna() & (numeric % 1 != 0)
+        if invalid.any():
+            if not lenient:
+                raise ValueError('Value {0} of column "{1}" cannot be cast into {2}'.format(
+                    repr(values[invalid].iloc[0]), values.name, declared_type))
+            logger.warning('Set %d value(s) of column "%s" that cannot be cast into %s to null (e.g. %s)',
+                           invalid.sum(), values.name, declared_type, repr(values[invalid].iloc[0]))
+            numeric = numeric.where(~invalid)
+        return numeric.astype(WKS_TYPES[declared_type][0])
+    if declared_type == 'string':
+        notna = values.notna()
+        if values.dtype.kind == 'f' and (values[notna] % 1 == 0).all():
+            values = values.round().astype('Int64')
+        return values.astype(str).astype(object).where(notna, None)
+    return values
+
+
+@dataclass(frozen=True)
+class WellKnownSchema:
+    """A well-known schema, as loaded from a YAML file."""
+    name: str
+    title: str
+    attributes: tuple
+    """A tuple of (name, type) pairs"""
+    columns: list = field(init=False, compare=False, repr=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'columns', [name for name, _ in self.attributes])
+
+    def template(self):
+        """Return an empty frame with the columns of the schema (as expected by the matchers)."""
+        return pd.DataFrame(columns=self.columns)
+
+    def sqlTypes(self):
+        """Return the SQL (SQLAlchemy) types of the columns of the schema, keyed on column names.
+
+        Columns of an unknown declared type are omitted (i.e. their type is left to be inferred).
+        """
+        return {name: WKS_TYPES[t][1]() for name, t in self.attributes if t in WKS_TYPES}
+
+
+@dataclass
+class ColumnMapping:
+    """A mapping of dataset columns into the columns of a well-known schema."""
+    schema: WellKnownSchema
+    columns: dict
+    """The source column keyed on the (matched) target column"""
+    score: float = 0.0
+    lenient: bool = False
+    """Whether values that cannot be cast into the declared types are set to null (instead of refused)"""
+
+    def apply(self, df):
+        """Map the columns of a frame into the well-known schema.
+
+        Parameters:
+            df (DataFrame): The frame (having the source columns).
+
+        Returns:
+            (DataFrame) A frame with the columns of the schema (unmatched columns are empty), cast
+            into the declared types (see `castColumn`).
+
+        Raises:
+            ValueError: If a value cannot be cast into the declared type (unless the mapping is lenient).
+        """
+        data = {}
+        for target, declared_type in self.schema.attributes:
+            source = self.columns.get(target)
+            if source is not None:
+                values = df[source]
+            else:
+                values = pd.Series(None, index=df.index, dtype=object)
+            data[target] = castColumn(values, declared_type, self.lenient)
+        return pd.DataFrame(data, index=df.index, columns=self.schema.columns)
+
+    def asDict(self):
+        """Return a (JSON-serializable) representation of the mapping."""
+        return {
+            'schema': self.schema.name,
+            'title': self.schema.title,
+            'score': round(float(self.score), 4),
+            'matched': len(self.columns),
+            'mapping': {str(target): str(source) for target, source in self.columns.items()},
+        }
+
+
+@dataclass
+class _Entry:
+    mtime: float
+    schema: WellKnownSchema = field(repr=False)
+
+
+def loadSchema(schema_path):
+    """Load a well-known schema from a YAML file."""
+    with open(schema_path, 'r') as schema_file:
+        spec = safe_load(schema_file)
+    attributes = tuple((str(a['name']), a.get('type')) for a in spec['attributes'])
+    name = path.splitext(path.basename(schema_path))[0]
+    return WellKnownSchema(name, spec.get('name', name), attributes)
+
+
+def headerSignature(df):
+    """Return a signature of the header of a frame (i.e. of its column names and types)."""
+    header = '\n'.join('{0}\t{1}'.format(c, df[c].dtype) for c in df.columns)
+    return md5(header.encode('utf-8')).hexdigest()
+
+
+def nameTerms(name, n=3):
+    """Return the index terms of an attribute name: its normalized tokens and character n-grams.
+
+    Names are split on non-alphanumeric characters and on camel-case boundaries, and lowercased
+    (e.g. 'streetName', 'STREET_NAME' and 'street name' share the tokens 'street' and 'name').
+    """
+    name = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', str(name))
+    tokens = [t for t in re.split(r'[^0-9a-zA-Z]+', name.lower()) if t]
+    terms = set('t:' + t for t in tokens)
+    joined = '^' + ''.join(tokens) + '$'
+    terms.update('g:' + joined[i:(i + n)] for i in range(max(1, len(joined) - n + 1)))
+    return terms
+
+
+class NameIndex(object):
+    """An inverted index of the attribute names of well-known schemata.
+
+    Each term (see `nameTerms`) is mapped to the attributes (of any schema) having it. Given the
+    column names of a dataset, schemata are ranked by the mean (over columns) of the best Jaccard
+    similarity between the terms of a column and the terms of an attribute of the schema.
+    """
+
+    def __init__(self, schemata):
+        self._postings = defaultdict(list)
+        self._sizes = {}
+        self._schemata = list(schemata)
+        for schema in self._schemata:
+            for column in schema.columns:
+                key = (schema.name, column)
+                terms = nameTerms(column)
+                self._sizes[key] = len(terms)
+                for term in terms:
+                    self._postings[term].append(key)
+
+    def rank(self, columns):
+        """Rank the schemata by the similarity of their attribute names to the given column names.
+
+        Parameters:
+            columns (list): The column names of a dataset.
+
+        Returns:
+            (list) A list of (schema, score) tuples, best first; scores are in [0, 1]
+        """
+        totals = defaultdict(float)
+        for column in columns:
+            terms = nameTerms(column)
+            shared = defaultdict(int)
+            for term in terms:
+                for key in self._postings.get(term, ()):
+                    shared[key] += 1
+            best = {}
+            for key, count in shared.items():
+                similarity = count / (len(terms) + self._sizes[key] - count)
+                if similarity > best.get(key[0], 0.0):
+                    best[key[0]] = similarity
+            for schema_name, similarity in best.items():
+                totals[schema_name] += similarity
+        n = max(1, len(columns))
+        ranked = [(schema, totals.get(schema.name, 0.0) / n) for schema in self._schemata]
+        return sorted(ranked, key=lambda r: r[1], reverse=True)
+
+
+class SchemaRegistry(object):
+    """A (thread-safe) registry of the well-known schemata found in a directory.
+
+    Parameters:
+        directory (str): The directory of the YAML files.
+        pool_size (int): The number of processes in the pool matching into schemata.
+    """
+
+    def __init__(self, directory=SCHEMATA_DIR, pool_size=MATCH_POOL_SIZE):
+        self.directory = directory
+        self.pool_size = pool_size
+        self._entries = {}
+        self._index = None
+        self._ranked = OrderedDict()
+        self._lock = threading.RLock()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._resetExecutorAfterFork)
+
+    def _resetExecutorAfterFork(self):
+        # The pool (and its management thread) belongs to the parent process
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _sharedExecutor(self):
+        """Return the (shared) process pool, starting it if needed."""
+        with self._executor_lock:
+            if self._executor is None:
+                # Spawn (instead of fork) workers, since the parent is multi-threaded
+                self._executor = ProcessPoolExecutor(max_workers=self.pool_size,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                # Workers are started on the first submission; start them now
+                self._executor.submit(os.getpid)
+            return self._executor
+
+    def _discardExecutor(self, executor):
+        """Discard a broken pool (e.g. a worker process died); a fresh one is started on demand."""
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _submit(self, fn, *args):
+        """Submit a call to the shared pool, replacing the pool if it is broken.
+
+        Returns:
+            (tuple) The future, and the pool it was submitted to
+        """
+        executor = self._sharedExecutor()
+        try:
+            return executor.submit(fn, *args), executor
+        except (BrokenProcessPool, RuntimeError):
+            self._discardExecutor(executor)
+            executor = self._sharedExecutor()
+            return executor.submit(fn, *args), executor
+
+    def schemata(self):
+        """Return the well-known schemata, reloading files that were added or modified.
+
+        Returns:
+            (list) A list of `WellKnownSchema`, ordered by name
+        """
+        with self._lock:
+            try:
+                filenames = sorted(f for f in listdir(self.directory) if f.endswith(('.yml', '.yaml')))
+            except FileNotFoundError:
+                logger.warning('The directory of well-known schemata (%s) does not exist', self.directory)
+                filenames = []
+            entries = {}
+            for filename in filenames:
+                schema_path = path.join(self.directory, filename)
+                try:
+                    mtime = path.getmtime(schema_path)
+                except OSError:
+                    continue
+                entry = self._entries.get(filename)
+                if entry is None or entry.mtime != mtime:
+                    try:
+                        entry = _Entry(mtime, loadSchema(schema_path))
+                    except Exception as e:
+                        logger.error('Failed to load well-known schema from %s: %s', schema_path, str(e))
+                        continue
+                    logger.debug('Loaded well-known schema "%s" from %s', entry.schema.name, schema_path)
+                entries[filename] = entry
+            if self._index is None or entries != self._entries:
+                self._index = NameIndex(entry.schema for entry in entries.values())
+                self._ranked.clear()
+            self._entries = entries
+            return [entry.schema for entry in entries.values()]
+
+    def candidates(self, columns, k=DEFAULT_MATCH_CANDIDATES):
+        """Pick the candidate schemata for a dataset by the names of its columns (with the name index).
+
+        Parameters:
+            columns (list): The column names of the dataset.
+            k (int, optional): The number of candidates; if None (or 0), all schemata are candidates.
+
+        Returns:
+            (list) A list of (schema, score) tuples, best first
+        """
+        self.schemata()
+        ranked = self._index.rank([str(c) for c in columns])
+        candidates = ranked[:k] if k else ranked
+        logger.info('Pruned %d of %d well-known schemata (%.0f%%); candidates: %s',
+            len(ranked) - len(candidates), len(ranked), 100.0 * (len(ranked) - len(candidates)) / max(1, len(ranked)),
+            ', '.join('%s (%.3f)' % (schema.name, score) for schema, score in candidates))
+        return candidates
+
+    def get(self, name):
+        """Return a well-known schema by its name (None if not found)."""
+        return next((s for s in self.schemata() if s.name == name), None)
+
+    def match(self, df, **kwargs):
+        """Match the columns of a frame into the best-matching well-known schema.
+
+        Parameters:
+            df (DataFrame): A sample of the dataset (its attributes).
+            **kwargs: Additional arguments for `rank`.
+
+        Returns:
+            (ColumnMapping) The mapping into the best-matching schema (None if nothing matches)
+        """
+        ranked = self.rank(df, **kwargs)
+        return ranked[0] if ranked else None
+
+    def rank(self, df, workers=None, timeout=DEFAULT_MATCH_TIMEOUT, candidates=DEFAULT_MATCH_CANDIDATES,
+             schemata=None, cached=False):
+        """Match the columns of a frame into well-known schemata, and rank the resulting mappings.
+
+        Only the top candidate schemata (see `candidates`) go through full matching. Those are
+        matched in parallel, in the shared pool of processes; a schema whose matching does not
+        complete in time is skipped.
+
+        Parameters:
+            df (DataFrame): A sample of the dataset (its attributes).
+            workers (int, optional): The maximum number of schemata matched concurrently for this call
+                (by default, one per schema up to the size of the pool). If 1, schemata are matched
+                sequentially in this process (and `timeout` is not enforced).
+            timeout (float, optional): The time (in seconds) allowed for matching each schema, since it was submitted.
+            candidates (int, optional): The number of candidate schemata; if None (or 0), all schemata
+                are matched.
+            schemata (list, optional): If given, only the schemata with these names are considered.
+            cached (bool, optional): If True, results are cached (and looked up) by the header signature
+                of the frame (see `headerSignature`); rankings with skipped schemata are not cached.
+
+        Returns:
+            (list) A list of `ColumnMapping`, best first (schemata without any matched column are omitted)
+        """
+        if not cached:
+            return self._rank(df, workers, timeout, candidates, schemata)[0]
+
+        key = (headerSignature(df), candidates, tuple(schemata or ()))
+        with self._lock:
+            self.schemata()
+            ranked = self._ranked.get(key)
+            if ranked is not None:
+                self._ranked.move_to_end(key)
+                return list(ranked)
+        ranked, complete = self._rank(df, workers, timeout, candidates, schemata)
+        if complete:
+            with self._lock:
+                self._ranked[key] = ranked
+                while len(self._ranked) > RANK_CACHE_SIZE:
+                    self._ranked.popitem(last=False)
+        return list(ranked)
+
+    def _rank(self, df, workers, timeout, candidates, schemata):
+        """Rank the mappings into schemata (see `rank`).
+
+        Returns:
+            (tuple) The ranked mappings, and whether every schema was matched (i.e. none timed out or failed)
+        """
+        if schemata is not None:
+            schemata = [schema for schema in self.schemata() if schema.name in schemata]
+        else:
+            schemata = [schema for schema, _ in self.candidates(df.columns, candidates)]
+        if not schemata:
+            return [], True
+        if workers is None:
+            workers = min(len(schemata), self.pool_size)
+        started = time.perf_counter()
+
+        # Only the columns and a small sample of values are needed by the matcher
+        sample = df.head(MATCH_SAMPLE_SIZE)
+        mappings = []
+        complete = True
+        if workers <= 1:
+            mappings = [matchSchema(schema, sample) for schema in schemata]
+        else:
+            # Keep at most `workers` matches in flight; each match is allowed `timeout` since it was submitted,
+            # and a match timing out is replaced by the next pending one
+            fan_out = min(workers, self.pool_size)
+            pending = list(schemata)
+            futures = {}
+            timed_out = []
+            while pending or futures:
+                while pending and len(futures) < fan_out:
+                    schema = pending.pop(0)
+                    future, executor = self._submit(matchSchema, schema, sample)
+                    deadline = None if timeout is None else time.monotonic() + timeout
+                    futures[future] = (schema, executor, deadline)
+                deadlines = [deadline for _, _, deadline in futures.values() if deadline is not None]
+                remaining = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                done, _ = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    schema, executor, _ = futures.pop(future)
+                    try:
+                        mappings.append(future.result())
+                    except Exception as e:
+                        complete = False
+                        logger.error('Failed to match into well-known schema "%s": %s', schema.name, str(e))
+                        if isinstance(e, BrokenProcessPool):
+                            self._discardExecutor(executor)
+                now = time.monotonic()
+                for future, (schema, _, deadline) in list(futures.items()):
+                    if deadline is not None and deadline <= now:
+                        # Only the matches of this call are cancelled; running ones are left to complete
+                        # (their results are discarded), as the pool is shared with other calls
+                        future.cancel()
+                        del futures[future]
+                        timed_out.append(schema.name)
+            if timed_out:
+                complete = False
+                logger.warning('Matching into well-known schemata [%s] timed out', ', '.join(timed_out))
+
+        ranked = sorted((m for m in mappings if m.columns), key=lambda m: m.schema.name)
+        ranked.sort(key=lambda m: (len(m.columns), m.score), reverse=True)
+        if ranked:
+            logger.info('Matched %d columns into well-known schema "%s" (out of %d candidates) in %.3fs',
+                len(ranked[0].columns), ranked[0].schema.name, len(schemata), time.perf_counter() - started)
+        return ranked, complete
+
+
+def matchSchema(schema, df):
+    """Match the columns of a frame into a well-known schema (with the Coma matcher).
+
+    Parameters:
+        schema (WellKnownSchema): The well-known schema.
+        df (DataFrame): A sample of the dataset (its attributes).
+
+    Returns:
+        (ColumnMapping) The mapping; its score is the total similarity of matched columns
+    """
+    from valentine import valentine_match
+    from valentine.algorithms import Coma
+
+    matches = valentine_match(schema.template(), df, Coma())
+    columns = {}
+    score = 0.0
+    # Matches are sorted by similarity (descending); keep the best match of each target column
+    for (target, source), similarity in matches.items():
+        if target[1] not in columns:
+            columns[target[1]] = source[1]
+            score += similarity
+    return ColumnMapping(schema, columns, score)
+
+
+registry = SchemaRegistry()
+"""The (process-wide) registry of well-known schemata"""
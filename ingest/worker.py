@@ -0,0 +1,428 @@
+"""A worker processing the deferred jobs of the queue table.
+
+Deferred requests are stored (along with the arguments of the job) into the queue table, so that they
+survive restarts and can be processed by any node (process) of the service. A worker claims pending jobs
+with ``SELECT ... FOR UPDATE SKIP LOCKED`` (so that each job is claimed by exactly one worker), and keeps
+sending heartbeats for the jobs it processes. The claims of a worker which stopped sending heartbeats
+(e.g. it was killed) are released, so that the jobs are claimed again by some other worker (up to a
+maximum number of attempts).
+
+Pending jobs are claimed in order of priority (e.g. small files ahead of large ones); a worker may reserve
+some of its slots for high-priority jobs, so that these are not held up behind long running jobs.
+Moreover, the number of jobs running (among all workers) on the same shard, or the same workspace,
+may be limited.
+
+Jobs are executed either on threads of the worker process (``thread`` mode), or on child processes
+(``process`` mode). In the latter mode, each slot is a pre-warmed child process (with the heavy modules
+already imported), which may be limited in memory and in CPU time (per job); a child that crashes, or
+exceeds its limits, only fails its own job, and is replaced by a fresh one. Jobs report their progress
+with `reportProgress`, which is relayed to the worker process in either mode.
+
+Limits are enforced by the worker process, which monitors (in ``/proc``) the resident memory and the CPU
+time of each child, including any subprocess it started (e.g. the JVM of the schema matcher); so, unlike
+limits on the address space (``RLIMIT_AS``), the virtual memory reserved by such subprocesses (or mapped
+by GDAL) does not count. A child exceeding its limits is killed (along with its subprocesses).
+"""
+
+import logging.config
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from importlib import import_module
+from uuid import uuid4
+
+from .logging import mainLogger
+logger = mainLogger.getChild('worker')
+
+DEFAULT_POLL_INTERVAL = 2.0
+"""The interval (in seconds) between polls of the queue table, if no job is pending"""
+
+DEFAULT_HEARTBEAT_INTERVAL = 10.0
+"""The interval (in seconds) between heartbeats for the running jobs"""
+
+DEFAULT_STALE_AFTER = 60.0
+"""The time (in seconds) without a heartbeat after which a claimed job is released"""
+
+DEFAULT_MAX_ATTEMPTS = 3
+"""The maximum number of claims for a job (after which it is marked as failed)"""
+
+EXECUTION_MODES = ('thread', 'process')
+"""The modes of executing jobs: on threads of the worker process, or on (pre-warmed) child processes"""
+
+_MONITOR_INTERVAL = 1.0
+"""The interval (in seconds) between checks of the resource usage of child processes"""
+
+_progress_sink = None
+
+_job_child = False
+
+
+def inJobChild():
+    """Check if this is a child process executing jobs (which never starts a worker of its own)."""
+    return _job_child
+
+
+def reportProgress(ticket, **progress):
+    """Report the progress of a job to the worker processing it (if any).
+
+    Parameters:
+        ticket (str): The ticket of the job.
+        **progress: The progress of the job (picklable values).
+    """
+    sink = _progress_sink
+    if sink is None:
+        return
+    try:
+        sink(ticket, progress)
+    except Exception as e:
+        logger.debug('Failed to report progress of job %s: %s', ticket, str(e))
+
+
+def _initChild(progress_queue, preload):
+    """Initialize a child process executing jobs."""
+    global _progress_sink, _job_child
+    # Set before any (preloaded) module is imported
+    _job_child = True
+    # Configure logging as the parent process (see wsgi.py)
+    logging_config = os.getenv('LOGGING_FILE_CONFIG', 'logging.conf')
+    if os.path.isfile(logging_config):
+        try:
+            logging.config.fileConfig(logging_config, disable_existing_loggers=False)
+        except Exception as e:
+            logger.warning('Failed to configure logging of child process: %s', str(e))
+    _progress_sink = lambda ticket, progress: progress_queue.put((ticket, progress))
+    for module in preload:
+        import_module(module)
+
+
+def _readStat(pid):
+    """Return the fields of ``/proc/<pid>/stat`` following the name of the command."""
+    with open('/proc/{0}/stat'.format(pid), 'r') as f:
+        stat = f.read()
+    return stat[(stat.rindex(')') + 2):].split()
+
+
+def _processTrees(pids):
+    """Return the processes of the trees rooted at the given processes (i.e. with their descendants)."""
+    children = defaultdict(list)
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                children[int(_readStat(entry)[1])].append(int(entry))
+            except (OSError, ValueError, IndexError):
+                continue
+    trees = {}
+    for pid in pids:
+        tree = [pid]
+        for member in tree:
+            tree.extend(children.get(member, ()))
+        trees[pid] = tree
+    return trees
+
+
+def _usage(tree):
+    """Return the resident memory (in bytes) and the CPU time (in seconds) of a tree of processes.
+
+    The CPU time includes the (reaped) children of the processes.
+    """
+    rss = ticks = 0
+    for pid in tree:
+        try:
+            stat = _readStat(pid)
+        except OSError:
+            continue
+        ticks += sum(int(t) for t in stat[11:15])
+        rss += int(stat[21])
+    return rss * os.sysconf('SC_PAGE_SIZE'), ticks / os.sysconf('SC_CLK_TCK')
+
+
+def _kill(tree):
+    """Kill a tree of processes (descendants first)."""
+    for pid in reversed(tree):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def workerName():
+    """Return a unique name for a worker (of this process)."""
+    return '{0}:{1}:{2}'.format(socket.gethostname(), os.getpid(), uuid4().hex[:8])
+
+
+class QueueWorker(object):
+    """A worker claiming and processing deferred jobs.
+
+    Parameters:
+        app (Flask): The application (each job, and each database action, runs in its context).
+        handler (callable): The function processing a job; called as ``handler(ticket, payload)``. In
+            ``process`` mode, it must be a (picklable) module-level function.
+        callback (callable): The function called as ``callback(future, worker)`` with the (completed) future
+            of a job and the name of the worker; the job is completed only if still claimed by the worker.
+        failed (callable, optional): The function called as ``failed(ticket, message)`` if a job raised
+            (e.g. its child process crashed); its result is passed to `callback` as the result of the job.
+        progress (callable, optional): The function called as ``progress(ticket, progress, worker)`` with the
+            progress reported by a job.
+        slots (int): The number of jobs processed concurrently.
+        name (str): The name of the worker (recorded as the claimer of a job).
+        poll_interval (float): The interval between polls, if no job is pending.
+        heartbeat_interval (float): The interval between heartbeats.
+        stale_after (float): The time without a heartbeat after which a job is released.
+        max_attempts (int): The maximum number of claims for a job.
+        reserved_slots (int): The number of slots reserved for high priority jobs.
+        max_per_shard (int): The maximum number of running jobs (of all workers) per shard.
+        max_per_workspace (int): The maximum number of running jobs (of all workers) per workspace.
+        mode (str): The mode of execution (one of `EXECUTION_MODES`).
+        memory_limit (int): The maximum resident memory (in bytes) of a child process, and its subprocesses
+            (``process`` mode).
+        cpu_limit (int): The maximum CPU time (in seconds) of a job, including its subprocesses (``process`` mode).
+        preload (list): The modules imported by a child process before executing jobs (``process`` mode).
+    """
+
+    def __init__(self, app, handler, callback, failed=None, progress=None, slots=1, name=None,
+                 poll_interval=DEFAULT_POLL_INTERVAL, heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL,
+                 stale_after=DEFAULT_STALE_AFTER, max_attempts=DEFAULT_MAX_ATTEMPTS, reserved_slots=0,
+                 max_per_shard=None, max_per_workspace=None, mode='thread', memory_limit=None, cpu_limit=None,
+                 preload=()):
+        if mode not in EXECUTION_MODES:
+            raise ValueError('Unknown execution mode: {0}'.format(mode))
+        self.app = app
+        self.handler = handler
+        self.callback = callback
+        self.failed = failed
+        self.progress = progress
+        self.slots = max(1, int(slots))
+        self.name = name or workerName()
+        self.poll_interval = float(poll_interval)
+        self.heartbeat_interval = float(heartbeat_interval)
+        self.stale_after = float(stale_after)
+        self.max_attempts = max(1, int(max_attempts))
+        self.reserved_slots = min(max(0, int(reserved_slots)), self.slots - 1)
+        self.max_per_shard = max_per_shard or None
+        self.max_per_workspace = max_per_workspace or None
+        self.mode = mode
+        self.memory_limit = memory_limit or None
+        self.cpu_limit = cpu_limit or None
+        self.preload = list(preload)
+        self._pools = []
+        self._pids = {}
+        self._killed = {}
+        self._lost = set()
+        self._progress_queue = None
+        self._running = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    @property
+    def running(self):
+        """(list) The tickets of the jobs being processed."""
+        with self._lock:
+            return list(self._running.keys())
+
+    def notify(self):
+        """Wake up the worker (e.g. a job was just enqueued)."""
+        self._wakeup.set()
+
+    def start(self):
+        """Start the worker on a background (daemon) thread."""
+        if _job_child:
+            raise RuntimeError('A worker cannot be started in a child process executing jobs')
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run, daemon=True, name='queue-worker')
+        self._thread.start()
+
+    def stop(self, wait=True):
+        """Stop claiming jobs.
+
+        Parameters:
+            wait (bool): Whether to wait for the running jobs to finish.
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+        with self._lock:
+            pools = list(self._pools) + [pool for _, pool, _ in self._running.values() if pool is not None]
+        for pool in pools:
+            pool.shutdown(wait=wait)
+
+    def _newPool(self):
+        """Create a child process, pre-warmed (i.e. with the preloaded modules imported)."""
+        pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_initChild, initargs=(self._progress_queue, self.preload))
+        self._pids[pool] = pool.submit(os.getpid)
+        return pool
+
+    def _monitor(self):
+        """Kill the child processes (and their subprocesses) of jobs exceeding their limits."""
+        while not self._stopped.wait(_MONITOR_INTERVAL):
+            with self._lock:
+                jobs = [(ticket, pool, cpu_start) for ticket, (_, pool, cpu_start) in self._running.items()
+                        if ticket not in self._killed]
+            if not jobs:
+                continue
+            try:
+                pids = {ticket: self._pids[pool].result() for ticket, pool, _ in jobs}
+                trees = _processTrees(pids.values())
+                for ticket, pool, cpu_start in jobs:
+                    tree = trees[pids[ticket]]
+                    rss, cpu = _usage(tree)
+                    if self.memory_limit and rss > self.memory_limit:
+                        message = 'Job exceeded its memory limit ({0} MB)'.format(self.memory_limit // 1024 ** 2)
+                    elif self.cpu_limit and cpu - cpu_start > self.cpu_limit:
+                        message = 'Job exceeded its CPU time limit ({0}s)'.format(self.cpu_limit)
+                    else:
+                        continue
+                    logger.error('%s: killing the child process of job %s', message, ticket)
+                    with self._lock:
+                        self._killed[ticket] = message
+                    _kill(tree)
+            except Exception as e:
+                logger.warning('Failed to check the resource usage of jobs: %s', str(e))
+
+    def _relayProgress(self):
+        """Relay the progress reported by child processes."""
+        while not self._stopped.is_set():
+            try:
+                ticket, progress = self._progress_queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            self._progress(ticket, progress)
+
+    def _progress(self, ticket, progress):
+        if self.progress is None:
+            return
+        try:
+            with self.app.app_context():
+                self.progress(ticket, progress, self.name)
+        except Exception as e:
+            logger.warning('Failed to record progress of job %s: %s', ticket, str(e))
+
+    def run(self):
+        """Claim and process jobs, until stopped."""
+        if _job_child:
+            raise RuntimeError('A worker cannot be started in a child process executing jobs')
+        from .database.actions import db_claim_job, db_heartbeat_jobs, db_requeue_stale_jobs
+        from .database.model import PRIORITY_CLASSES
+        global _progress_sink
+        logger.info('Worker %s started (%d slots, %s mode)', self.name, self.slots, self.mode)
+        if self.mode == 'process':
+            self._progress_queue = multiprocessing.get_context('spawn').Queue()
+            self._pools = [self._newPool() for _ in range(self.slots)]
+            threading.Thread(target=self._relayProgress, daemon=True, name='queue-progress').start()
+            if self.memory_limit or self.cpu_limit:
+                if os.path.isdir('/proc'):
+                    threading.Thread(target=self._monitor, daemon=True, name='queue-monitor').start()
+                else:
+                    logger.warning('Memory and CPU time limits of jobs are not enforced (no /proc)')
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix='queue-job')
+            _progress_sink = self._progress
+        last_heartbeat = last_requeue = 0.0
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            now = time.monotonic()
+            try:
+                with self.app.app_context():
+                    if now - last_heartbeat >= self.heartbeat_interval:
+                        running = self.running
+                        lost = set(running) - set(db_heartbeat_jobs(self.name, running))
+                        with self._lock:
+                            # A job may have just completed; others were released meanwhile (as stale)
+                            lost = set(t for t in lost if t in self._running and t not in self._lost)
+                            self._lost.update(lost)
+                        if lost:
+                            logger.warning('Worker %s lost the claim of jobs [%s] (released as stale); '
+                                           'their results will be ignored', self.name, ', '.join(sorted(lost)))
+                        last_heartbeat = now
+                    if now - last_requeue >= self.stale_after / 2:
+                        requeued, failed = db_requeue_stale_jobs(self.stale_after, self.max_attempts)
+                        if requeued or failed:
+                            logger.warning('Released %d stale jobs (%d failed after %d attempts)',
+                                           requeued + failed, failed, self.max_attempts)
+                        last_requeue = now
+                    claimed = False
+                    while len(self.running) < self.slots and not self._stopped.is_set():
+                        # The last free slots are reserved for high priority jobs
+                        reserved = self.slots - len(self.running) <= self.reserved_slots
+                        job = db_claim_job(self.name, max_priority=(PRIORITY_CLASSES['high'] if reserved else None),
+                                           max_per_shard=self.max_per_shard, max_per_workspace=self.max_per_workspace)
+                        if job is None:
+                            break
+                        self._submit(*job)
+                        claimed = True
+            except Exception as e:
+                logger.error('Worker %s failed to poll the queue: %s', self.name, str(e))
+                claimed = False
+            if not claimed:
+                self._wakeup.wait(min(self.poll_interval, self.heartbeat_interval))
+        logger.info('Worker %s stopped', self.name)
+
+    def _submit(self, ticket, payload, priority):
+        logger.info('Worker %s claimed job %s (priority %d)', self.name, ticket, priority)
+        with self._lock:
+            pool = self._pools.pop() if self.mode == 'process' else None
+        cpu_start = None
+        if pool is not None and self.cpu_limit:
+            # The CPU time of the child (before this job), once it is started
+            try:
+                cpu_start = _usage([self._pids[pool].result()])[1]
+            except Exception:
+                cpu_start = 0.0
+        with self._lock:
+            if pool is not None:
+                future = pool.submit(self.handler, ticket, payload)
+            else:
+                future = self._executor.submit(self._process, ticket, payload)
+            self._running[ticket] = (future, pool, cpu_start)
+        future.add_done_callback(lambda future: self._done(ticket, future))
+
+    def _process(self, ticket, payload):
+        with self.app.app_context():
+            return self.handler(ticket, payload)
+
+    def _done(self, ticket, future):
+        error = future.exception()
+        with self._lock:
+            _, pool, _ = self._running[ticket]
+            killed = self._killed.pop(ticket, None)
+        if error is not None:
+            message = str(error) or type(error).__name__
+            if isinstance(error, BrokenProcessPool):
+                # The child process crashed (or was killed, having exceeded its limits); replace it
+                logger.error('Child process of job %s terminated abruptly', ticket)
+                message = killed or 'Job terminated abruptly (its child process crashed)'
+                pool.shutdown(wait=False)
+                self._pids.pop(pool, None)
+                pool = self._newPool() if not self._stopped.is_set() else None
+        if error is not None and self.failed is not None:
+            future = Future()
+            future.set_result(self.failed(ticket, message))
+        try:
+            with self.app.app_context():
+                self.callback(future, self.name)
+        except Exception as e:
+            logger.error('Failed to complete job %s: %s', ticket, str(e))
+        finally:
+            with self._lock:
+                self._running.pop(ticket, None)
+                self._lost.discard(ticket)
+                if pool is not None:
+                    self._pools.append(pool)
+            # A slot is free
+            self._wakeup.set()
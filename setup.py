@@ -12,7 +12,7 @@ setuptools.setup(
         # moved to requirements.txt
     ],
     package_data={'ingest': [
-        'logging.conf', 'schema.sql'
+        'logging.conf', 'schema.sql', 'schemata/*.yml'
     ]},
     python_requires='>=3.7',
     zip_safe=False,
@@ -0,0 +1,129 @@
+import logging
+import json
+import os
+import tarfile
+import tempfile
+import time
+import unittest
+import uuid
+import zipfile
+
+import sqlalchemy
+
+from ingest.app import app
+from ingest.postgres import Postgres
+from ingest.readers import AVAILABLE_READ_ENGINES
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+postgis = Postgres.makeFromEnv()
+
+workspace = '_' + str(uuid.uuid4())
+
+dirname = os.path.dirname(__file__)
+input_dir = os.path.join(dirname, '..', 'test_data')
+
+
+def _table_name_for_input(input_name):
+    return 'x_{0}_{1:d}'.format(uuid.uuid5(uuid.NAMESPACE_URL, input_name), int(1000 * time.time()))
+
+def _column_type(table, column):
+    with postgis.engineFor().connect() as con:
+        return con.execute(sqlalchemy.text("SELECT data_type FROM information_schema.columns"
+            " WHERE table_schema = :schema AND table_name = :table AND column_name = :column"),
+            schema=workspace, table=table, column=column).scalar()
+
+def _columns(table):
+    with postgis.engineFor().connect() as con:
+        res = con.execute(sqlalchemy.text("SELECT column_name, data_type FROM information_schema.columns"
+            " WHERE table_schema = :schema AND table_name = :table ORDER BY column_name"), schema=workspace, table=table)
+        return [tuple(row) for row in res]
+
+def _ingest(endpoint='/ingest', **data):
+    with app.test_client() as client:
+        return client.post(endpoint, data=dict(workspace=workspace, **data))
+
+# Setup/Teardown
+
+def setup_module():
+    print(" == Setting up tests for {0} [workspace={1}]".format(__name__, workspace))
+    app.config['TESTING'] = True
+
+def teardown_module():
+    print(" == Tearing down tests for %s"  % (__name__))
+    with postgis.engineFor().begin() as con:
+        con.execute('DROP SCHEMA IF EXISTS "{0}" CASCADE'.format(workspace))
+
+# Tests
+
+def test_ingest_csv():
+    table_name = _table_name_for_input('1.csv')
+    res = _ingest(resource='1.csv', table=table_name)
+    assert res.status_code == 200
+    r = res.get_json()
+    assert (r.get('schema'), r.get('table'), r.get('length')) == (workspace, table_name, 3)
+    assert postgis.checkIfTableExists(table_name, workspace)
+
+def test_ingest_wks_with_mapping():
+    table_name = _table_name_for_input('1.csv')
+    mapping = {'FIRMA': 'name', 'PLZ': 'postcode'}
+    res = _ingest('/ingest_wks', resource='1.csv', table=table_name, wks='herold_yellow_pages',
+                  mapping=json.dumps(mapping))
+    assert res.status_code == 200
+    assert res.get_json().get('length') == 3
+    # The table is created with the declared types of the schema
+    assert _column_type(table_name, 'PLZ') == 'bigint'
+    assert _column_type(table_name, 'FIRMA') == 'text'
+
+def test_ingest_wks_uncastable_values():
+    mapping = json.dumps({'FIRMA': 'name', 'PLZ': 'postcode'})
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = os.path.join(tmpdir, 'postcodes.csv')
+        with open(input_path, 'w') as f:
+            f.write('name,postcode,wkt\nA,1010,POINT (16.36 48.21)\nB,A-1020,POINT (16.39 48.21)\n')
+        table_name = _table_name_for_input(input_path)
+        with open(input_path, 'rb') as f:
+            res = _ingest('/ingest_wks', resource=f, table=table_name, wks='herold_yellow_pages', mapping=mapping)
+        assert res.status_code == 400
+        assert 'postcode' in res.get_json()['error'] and 'A-1020' in res.get_json()['error']
+        assert not postgis.checkIfTableExists(table_name, workspace)
+        # Lenient casting sets such values to null
+        with open(input_path, 'rb') as f:
+            res = _ingest('/ingest_wks', resource=f, table=table_name, wks='herold_yellow_pages', mapping=mapping,
+                          lenient='true')
+        assert res.status_code == 200
+        assert res.get_json().get('length') == 2
+
+def test_ingest_archives():
+    csv_path = os.path.join(input_dir, '1.csv')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tar_path = os.path.join(tmpdir, '1.tar.gz')
+        with tarfile.open(tar_path, 'w:gz') as archive:
+            archive.add(csv_path, arcname='data/1.csv')
+        zip_path = os.path.join(tmpdir, '1.zip')
+        with zipfile.ZipFile(zip_path, 'w') as archive:
+            archive.writestr('metadata.json', json.dumps({'title': 'Vienna'}))
+            archive.write(csv_path, arcname='1.csv')
+        for input_path in (tar_path, zip_path):
+            table_name = _table_name_for_input(input_path)
+            with open(input_path, 'rb') as f:
+                res = _ingest(resource=f, table=table_name)
+            assert res.status_code == 200
+            assert res.get_json().get('length') == 3
+    # A zipped shapefile is read in place
+    res = _ingest(resource='1.zip', table=_table_name_for_input('1.zip'))
+    assert res.status_code == 200
+    assert res.get_json().get('length') == 3
+
+def test_ingest_pyogrio_engine():
+    if 'pyogrio' not in AVAILABLE_READ_ENGINES:
+        raise unittest.SkipTest('The pyogrio read engine is not available')
+    tables = {}
+    for engine in ('fiona', 'pyogrio'):
+        tables[engine] = _table_name_for_input('1.zip')
+        res = _ingest(resource='1.zip', table=tables[engine], engine=engine)
+        assert res.status_code == 200
+        assert res.get_json().get('length') == 3
+    # Both engines create the same table
+    assert _columns(tables['pyogrio']) == _columns(tables['fiona'])
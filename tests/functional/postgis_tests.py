@@ -0,0 +1,134 @@
+import logging
+import os
+import time
+import uuid
+
+import sqlalchemy
+
+from ingest.postgres import Postgres, STAGING_TABLE_PREFIX, stagingTableName
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+postgis = Postgres.makeFromEnv()
+
+workspace = '_' + str(uuid.uuid4())
+
+dirname = os.path.dirname(__file__)
+input_dir = os.path.join(dirname, '..', 'test_data')
+
+
+def _table_name(prefix='x'):
+    return '{0}_{1}_{2:d}'.format(prefix, uuid.uuid4().hex[:8], int(1000 * time.time()))
+
+def _count(table):
+    with postgis.engineFor().connect() as con:
+        return con.execute('SELECT count(*) FROM "{0}"."{1}"'.format(workspace, table)).scalar()
+
+def _staging_tables():
+    with postgis.engineFor().connect() as con:
+        res = con.execute(sqlalchemy.text("SELECT tablename FROM pg_tables WHERE schemaname = :schema"), schema=workspace)
+        return [name for (name,) in res if name.startswith(STAGING_TABLE_PREFIX)]
+
+def _indices(table):
+    with postgis.engineFor().connect() as con:
+        res = con.execute(sqlalchemy.text("SELECT indexname FROM pg_indexes WHERE schemaname = :schema AND tablename = :table"),
+            schema=workspace, table=table)
+        return [name for (name,) in res]
+
+# Setup/Teardown
+
+def setup_module():
+    print(" == Setting up tests for {0} [workspace={1}]".format(__name__, workspace))
+
+def teardown_module():
+    print(" == Tearing down tests for %s"  % (__name__))
+    with postgis.engineFor().begin() as con:
+        con.execute('DROP SCHEMA IF EXISTS "{0}" CASCADE'.format(workspace))
+
+# Tests
+
+def test_parallelism_capped_below_pool_capacity():
+    capped = Postgres(postgis.url_template, postgis.username, postgis.password, postgis.port_map,
+                      pool_options={'pool_size': 2, 'max_overflow': 1}, max_parallelism=8)
+    assert capped.max_parallelism == 2
+    table = _table_name()
+    _, _, rows, _, _ = capped.ingest(os.path.join(input_dir, '1.kml'), table, workspace, chunksize=1, parallelism=8)
+    assert rows == 3
+    assert _count(table) == 3
+
+def test_ingest_reports_timings():
+    table = _table_name()
+    schema, name, rows, load_time, index_time = postgis.ingest(os.path.join(input_dir, '1.kml'), table, workspace)
+    assert (schema, name, rows) == (workspace, table, 3)
+    assert load_time > 0 and index_time > 0
+
+def test_ingest_parallel():
+    for loader in ('copy', 'copy_binary', 'to_sql'):
+        table = _table_name()
+        _, _, rows, _, _ = postgis.ingest(os.path.join(input_dir, '1.kml'), table, workspace, chunksize=1,
+                                          parallelism=2, loader=loader)
+        assert rows == 3
+        assert _count(table) == 3
+        assert _staging_tables() == []
+        # Replace
+        _, _, rows, _, _ = postgis.ingest(os.path.join(input_dir, '1.kml'), table, workspace, chunksize=1,
+                                          parallelism=2, loader=loader, replace=True)
+        assert rows == 3
+        assert _count(table) == 3
+        assert _staging_tables() == []
+
+def test_ingest_parallel_into_existing_table():
+    table = _table_name()
+    postgis.ingest(os.path.join(input_dir, '1.kml'), table, workspace)
+    try:
+        postgis.ingest(os.path.join(input_dir, '1.kml'), table, workspace, chunksize=1, parallelism=2)
+    except ValueError:
+        pass
+    else:
+        assert False, 'An existing table should not be replaced'
+    assert _count(table) == 3
+    assert _staging_tables() == []
+
+def test_ingest_parallel_without_commit():
+    table = _table_name()
+    postgis.ingest(os.path.join(input_dir, '1.kml'), table, workspace, chunksize=1, parallelism=2, commit=False)
+    assert not postgis.checkIfTableExists(table, workspace)
+    assert _staging_tables() == []
+
+def test_drop_orphan_staging_tables():
+    engine = postgis.engineFor()
+    orphan, in_use = stagingTableName(), stagingTableName()
+    with engine.begin() as con:
+        con.execute('CREATE SCHEMA IF NOT EXISTS "{0}"'.format(workspace))
+        for name in (orphan, in_use):
+            con.execute('CREATE TABLE "{0}"."{1}" (id integer)'.format(workspace, name))
+    with engine.connect() as con:
+        # A staging table in use is locked by the session of its ingest
+        postgis._lockStagingTable(con, in_use)
+        try:
+            dropped = postgis.dropOrphanStagingTables()
+            assert '"{0}"."{1}"'.format(workspace, orphan) in dropped
+            assert _staging_tables() == [in_use]
+        finally:
+            postgis._lockStagingTable(con, in_use, lock=False)
+    assert '"{0}"."{1}"'.format(workspace, in_use) in postgis.dropOrphanStagingTables()
+    assert _staging_tables() == []
+
+def test_ingest_replace_swaps_staging_table():
+    table = _table_name()
+    postgis.ingest(os.path.join(input_dir, '1.kml'), table, workspace)
+    _, _, rows, _, _ = postgis.ingest(os.path.join(input_dir, '1.kml'), table, workspace, replace=True, chunksize=2)
+    assert rows == 3
+    assert _count(table) == 3
+    assert _staging_tables() == []
+    # Indices are renamed after the target table
+    assert all(not name.startswith(STAGING_TABLE_PREFIX) for name in _indices(table))
+    assert len(_indices(table)) >= 1
+
+def test_ingest_replace_without_commit_keeps_table():
+    table = _table_name()
+    postgis.ingest(os.path.join(input_dir, '1.kml'), table, workspace)
+    postgis.ingest(os.path.join(input_dir, '1.kml'), table, workspace, replace=True, commit=False)
+    assert _count(table) == 3
+    assert _staging_tables() == []
@@ -0,0 +1,164 @@
+import logging
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import ingest.app
+from ingest.app import app
+from ingest.database.actions import db_queue, db_enqueue_job, db_claim_job, db_update_queue_status, db_heartbeat_jobs
+from ingest.database.model import PRIORITY_CLASSES
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+workspace = '_' + str(uuid.uuid4())
+
+
+def _job(priority='normal', workspace=workspace):
+    """Create a (pending) deferred job, with a payload never to be run."""
+    with app.app_context():
+        queue = db_queue(request='test')
+        db_enqueue_job(queue['ticket'], json.dumps({}), priority=PRIORITY_CLASSES[priority], workspace=workspace)
+    return queue['ticket']
+
+def _claim(worker, **kwargs):
+    with app.app_context():
+        claimed = db_claim_job(worker, **kwargs)
+    return claimed[0] if claimed is not None else None
+
+def _complete(ticket, worker=None, delay=0.0):
+    if delay:
+        time.sleep(delay)
+    with app.app_context():
+        return db_update_queue_status(ticket, worker=worker, completed=True, success=True,
+                                      result=json.dumps({'schema': workspace, 'table': 't', 'loadTime': 1.0, 'indexTime': 0.5}))
+
+def _drain(worker):
+    """Claim (and complete) any pending job, so that claims of a test are not mixed with other jobs."""
+    while True:
+        ticket = _claim(worker)
+        if ticket is None:
+            break
+        _complete(ticket, worker)
+
+def _parseEvents(text):
+    events = []
+    for block in text.split('\n\n'):
+        lines = [line for line in block.split('\n') if line and not line.startswith(':')]
+        if lines:
+            fields = dict(line.split(': ', 1) for line in lines)
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+# Setup/Teardown
+
+def setup_module():
+    print(" == Setting up tests for {0} [workspace={1}]".format(__name__, workspace))
+    app.config['TESTING'] = True
+
+def teardown_module():
+    print(" == Tearing down tests for %s"  % (__name__))
+
+# Tests
+
+def test_import_starts_no_worker():
+    assert ingest.app.queue_worker is None
+    assert all(t.name != 'queue-worker' for t in threading.enumerate())
+
+def test_claim_job_concurrently():
+    _drain('test-drain')
+    tickets = set(_job() for _ in range(8))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        claimed = list(pool.map(lambda k: _claim('test-{0}'.format(k)), range(12)))
+    claimed = [ticket for ticket in claimed if ticket is not None]
+    # Every job is claimed exactly once
+    assert sorted(claimed) == sorted(tickets)
+    with app.app_context():
+        for ticket in tickets:
+            db_update_queue_status(ticket, completed=True, success=False, error_msg='test')
+
+def test_complete_only_by_claimer():
+    _drain('test-drain')
+    ticket = _job()
+    assert _claim('test-1') == ticket
+    with app.app_context():
+        assert db_heartbeat_jobs('test-2', [ticket]) == []
+        assert db_heartbeat_jobs('test-1', [ticket]) == [ticket]
+    assert _complete(ticket, 'test-2') is None
+    assert _complete(ticket, 'test-1') is not None
+    # Already completed
+    assert _complete(ticket, 'test-1') is None
+
+def test_claim_job_in_order_of_priority():
+    _drain('test-drain')
+    normal = _job('normal')
+    low = _job('low')
+    high = _job('high')
+    assert _claim('test-1', max_priority=PRIORITY_CLASSES['high']) == high
+    assert _claim('test-1', max_priority=PRIORITY_CLASSES['high']) is None
+    assert _claim('test-2') == normal
+    assert _claim('test-3') == low
+    assert _claim('test-4') is None
+    for ticket, worker in ((high, 'test-1'), (normal, 'test-2'), (low, 'test-3')):
+        assert _complete(ticket, worker) is not None
+
+def test_claim_job_per_workspace_limit():
+    _drain('test-drain')
+    first, second = _job(workspace=workspace), _job(workspace=workspace)
+    other = _job(workspace=workspace + '_other')
+    assert _claim('test-1', max_per_workspace=1) == first
+    # The second job of the workspace is skipped, while the first is running
+    assert _claim('test-2', max_per_workspace=1) == other
+    assert _claim('test-3', max_per_workspace=1) is None
+    assert _complete(first, 'test-1') is not None
+    assert _claim('test-3', max_per_workspace=1) == second
+    for ticket, worker in ((other, 'test-2'), (second, 'test-3')):
+        assert _complete(ticket, worker) is not None
+
+def test_status_long_poll():
+    ticket = _job()
+    with app.test_client() as client:
+        res = client.get('/status/{0}'.format(ticket))
+        assert res.status_code == 200
+        assert res.get_json()['completed'] == False
+        assert res.get_json()['progress'] == {'stage': 'queued'}
+        # Completed (and notified) while waiting
+        completion = threading.Thread(target=_complete, args=(ticket,), kwargs={'delay': 1.0})
+        completion.start()
+        started = time.monotonic()
+        res = client.get('/status/{0}'.format(ticket), query_string={'wait': 30})
+        elapsed = time.monotonic() - started
+        completion.join()
+        assert res.status_code == 200
+        r = res.get_json()
+        assert r['completed'] == True
+        assert r['loadTime'] == 1.0 and r['indexTime'] == 0.5
+        assert 0.5 < elapsed < 15.0
+        # Completed already
+        started = time.monotonic()
+        res = client.get('/status/{0}'.format(ticket), query_string={'wait': 30})
+        assert res.status_code == 200
+        assert time.monotonic() - started < 5.0
+        res = client.get('/status/{0}'.format(uuid.uuid4().hex), query_string={'wait': 1})
+        assert res.status_code == 404
+        res = client.get('/status/{0}'.format(ticket), query_string={'wait': 'x'})
+        assert res.status_code == 400
+
+def test_status_events():
+    ticket = _job()
+    with app.test_client() as client:
+        completion = threading.Thread(target=_complete, args=(ticket,), kwargs={'delay': 1.0})
+        completion.start()
+        res = client.get('/status/{0}/events'.format(ticket))
+        assert res.status_code == 200
+        assert res.mimetype == 'text/event-stream'
+        # The stream ends when the process is completed
+        events = _parseEvents(res.get_data(as_text=True))
+        completion.join()
+        assert all(event == 'status' for event, _ in events)
+        assert events[0][1]['completed'] == False
+        assert events[-1][1]['completed'] == True
+        res = client.get('/status/{0}/events'.format(uuid.uuid4().hex))
+        assert res.status_code == 404
@@ -0,0 +1,54 @@
+import logging
+import multiprocessing
+import threading
+
+import ingest.app
+from ingest.app import app, makeQueueWorker
+from ingest.worker import QueueWorker
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _childState():
+    """Return the state of a child process (executed in the child)."""
+    import ingest.app
+    from ingest.worker import inJobChild
+    try:
+        ingest.app.makeQueueWorker().start()
+        started = True
+    except RuntimeError:
+        started = False
+    return {
+        'in_job_child': inJobChild(),
+        'queue_worker': ingest.app.startQueueWorker(),
+        'started': started,
+        'threads': [t.name for t in threading.enumerate()],
+    }
+
+# Setup/Teardown
+
+def setup_module():
+    print(" == Setting up tests for {0}".format(__name__))
+    app.config['TESTING'] = True
+
+def teardown_module():
+    print(" == Tearing down tests for %s"  % (__name__))
+
+# Tests
+
+def test_process_child_starts_no_worker():
+    worker = makeQueueWorker()
+    worker = QueueWorker(app, worker.handler, worker.callback, mode='process', preload=['ingest.app'])
+    worker._progress_queue = multiprocessing.get_context('spawn').Queue()
+    pool = worker._newPool()
+    try:
+        state = pool.submit(_childState).result(timeout=120)
+    finally:
+        pool.shutdown()
+    assert state['in_job_child']
+    assert state['queue_worker'] is None
+    assert not state['started']
+    assert 'queue-worker' not in state['threads']
+    # The parent is not affected
+    assert ingest.app.queue_worker is None
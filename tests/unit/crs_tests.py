@@ -0,0 +1,22 @@
+from ingest import crs
+from ingest.crs import resolveCrs, sridFor, DEFAULT_SRID
+
+# Tests
+
+def test_resolve_crs():
+    value, srid = resolveCrs('EPSG:2100')
+    assert srid == 2100
+    assert value.to_epsg() == 2100
+    assert resolveCrs(4326)[1] == 4326
+
+def test_resolve_crs_caching():
+    crs._resolve.cache_clear()
+    first = resolveCrs(3857)
+    assert resolveCrs('3857') is first
+    assert resolveCrs(' 3857 ') is first
+    info = crs._resolve.cache_info()
+    assert info.misses == 1 and info.hits == 2
+
+def test_srid_for():
+    assert sridFor(None) == DEFAULT_SRID
+    assert sridFor(resolveCrs(2100)[0]) == 2100
@@ -0,0 +1,133 @@
+import csv
+import io
+import struct
+
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import Point
+
+from ingest.loaders import CopyLoader, Loader, GEOMETRY_COLUMN, makeLoader
+
+COLUMN_TYPES = {'name': 'text', 'n': 'bigint', 'x': 'double precision', GEOMETRY_COLUMN: 'geometry'}
+
+
+def _chunk(name, n, x):
+    df = pd.DataFrame({'name': name, 'n': n, 'x': x})
+    df[GEOMETRY_COLUMN] = gpd.GeoSeries([Point(k, k) for k in range(len(df))]).values
+    return df
+
+def _ewkbSrid(b):
+    """The SRID of an EWKB geometry (None if it has no SRID)."""
+    order = '<' if b[0] == 1 else '>'
+    gtype, = struct.unpack(order + 'I', b[1:5])
+    if not gtype & 0x20000000:
+        return None
+    return struct.unpack(order + 'I', b[5:9])[0]
+
+def _readBinaryCopy(buf):
+    """Parse a payload in binary COPY format into a list of rows (of raw field values)."""
+    data = buf.getvalue()
+    assert data.startswith(b'PGCOPY\n\377\r\n\0')
+    position = 19
+    rows = []
+    while True:
+        n, = struct.unpack('>h', data[position:(position + 2)])
+        position += 2
+        if n == -1:
+            break
+        row = []
+        for _ in range(n):
+            size, = struct.unpack('>i', data[position:(position + 4)])
+            position += 4
+            if size == -1:
+                row.append(None)
+            else:
+                row.append(data[position:(position + size)])
+                position += size
+        rows.append(row)
+    assert position == len(data)
+    return rows
+
+# Tests
+
+def test_loader_is_abstract():
+    try:
+        Loader()
+    except TypeError:
+        pass
+    else:
+        assert False, 'Loader should not be instantiated'
+
+def test_make_loader():
+    assert makeLoader('copy').format == 'text'
+    assert makeLoader('copy_binary').format == 'binary'
+    try:
+        makeLoader('bulk')
+    except ValueError:
+        pass
+    else:
+        assert False, 'An unknown loader should be refused'
+
+def test_encode_text_nulls_and_quoting():
+    df = _chunk(['', None, 'a, "b"\nc'], [1, 2, 3], [0.5, None, 2.0])
+    encoded = CopyLoader('text').encode(df, 4326, COLUMN_TYPES)
+    assert encoded.format == 'text'
+    assert encoded.rows == 3
+    assert encoded.columns == ['name', 'n', 'x', GEOMETRY_COLUMN]
+    rows = list(csv.reader(io.StringIO(encoded.data.getvalue())))
+    assert len(rows) == 3
+    # An empty string is not NULL
+    assert rows[0][0] == '' and encoded.null != ''
+    assert rows[1][0] == encoded.null
+    assert rows[1][2] == encoded.null
+    assert rows[2][0] == 'a, "b"\nc'
+    assert _ewkbSrid(bytes.fromhex(rows[0][3])) == 4326
+
+def test_encode_text_null_never_matches_a_value():
+    df = _chunk(['\\N', None], [1, 2], [0.0, 1.0])
+    encoded = CopyLoader('text').encode(df, 4326, COLUMN_TYPES)
+    rows = list(csv.reader(io.StringIO(encoded.data.getvalue())))
+    assert encoded.null != '\\N'
+    assert rows[0][0] == '\\N'
+    assert rows[1][0] == encoded.null
+
+def test_encode_text_integers_from_floats():
+    df = _chunk(['a', 'b', 'c'], [1.0, None, 3.0], [0.0, 1.0, 2.0])
+    encoded = CopyLoader('text').encode(df, 4326, COLUMN_TYPES)
+    rows = list(csv.reader(io.StringIO(encoded.data.getvalue())))
+    assert [r[1] for r in rows] == ['1', encoded.null, '3']
+
+def test_encode_text_refuses_fractional_integers():
+    df = _chunk(['a'], [1.5], [0.0])
+    try:
+        CopyLoader('text').encode(df, 4326, COLUMN_TYPES)
+    except ValueError as e:
+        assert '"n"' in str(e)
+    else:
+        assert False, 'A fractional value should not be written into an integer column'
+
+def test_encode_binary():
+    df = _chunk(['a', None], pd.array([7, None], dtype='Int64'), [0.5, None])
+    encoded = CopyLoader('binary').encode(df, 2100, COLUMN_TYPES)
+    assert encoded.format == 'binary'
+    rows = _readBinaryCopy(encoded.data)
+    assert len(rows) == 2
+    assert rows[0][0] == b'a'
+    assert struct.unpack('>q', rows[0][1])[0] == 7
+    assert struct.unpack('>d', rows[0][2])[0] == 0.5
+    assert _ewkbSrid(rows[0][3]) == 2100
+    assert rows[1][:3] == [None, None, None]
+
+def test_encode_binary_refuses_fractional_integers():
+    df = _chunk(['a'], [2.5], [0.0])
+    try:
+        CopyLoader('binary').encode(df, 4326, COLUMN_TYPES)
+    except ValueError as e:
+        assert '"n"' in str(e)
+    else:
+        assert False, 'A fractional value should not be written into an integer column'
+
+def test_encode_binary_falls_back_to_text():
+    df = _chunk(['a'], [1], [0.0])
+    encoded = CopyLoader('binary').encode(df, 4326, dict(COLUMN_TYPES, name='jsonb'))
+    assert encoded.format == 'text'
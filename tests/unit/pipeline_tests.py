@@ -0,0 +1,79 @@
+import threading
+import time
+
+from ingest.pipeline import Pipeline
+
+
+def _source(n, produced=None, closed=None):
+    try:
+        for k in range(n):
+            if produced is not None:
+                produced.append(k)
+            yield k
+    finally:
+        if closed is not None:
+            closed.set()
+
+def _failOn(value):
+    def function(item):
+        if item == value:
+            raise ValueError('Failed on {0}'.format(item))
+        return item
+    return function
+
+# Tests
+
+def test_pipeline_order():
+    with Pipeline(_source(20), [('double', lambda x: 2 * x), ('inc', lambda x: x + 1)], depth=2) as pipeline:
+        items = list(pipeline)
+    assert items == [2 * k + 1 for k in range(20)]
+
+def test_pipeline_stage_error():
+    closed = threading.Event()
+    received = []
+    with Pipeline(_source(1000, closed=closed), [('fail', _failOn(5))]) as pipeline:
+        try:
+            for item in pipeline:
+                received.append(item)
+        except ValueError as e:
+            assert str(e) == 'Failed on 5'
+        else:
+            assert False, 'The error of a stage should be raised to the consumer'
+    assert received == [0, 1, 2, 3, 4]
+    assert closed.wait(1.0)
+
+def test_pipeline_source_error():
+    def source():
+        yield 1
+        raise IOError('Read failed')
+    with Pipeline(source(), [('id', lambda x: x)]) as pipeline:
+        try:
+            list(pipeline)
+        except IOError as e:
+            assert str(e) == 'Read failed'
+        else:
+            assert False, 'The error of the source should be raised to the consumer'
+
+def test_pipeline_consumer_stops_early():
+    produced = []
+    closed = threading.Event()
+    with Pipeline(_source(10000, produced, closed), [('id', lambda x: x)], depth=2) as pipeline:
+        for item in pipeline:
+            if item == 3:
+                break
+    assert closed.wait(1.0)
+    assert all(not t.is_alive() for t in pipeline._threads)
+    # Bounded queues: the source is not read far ahead of the consumer
+    assert len(produced) < 20
+
+def test_pipeline_cancel():
+    closed = threading.Event()
+    with Pipeline(_source(10000, closed=closed), [('slow', lambda x: time.sleep(0.01) or x)]) as pipeline:
+        items = []
+        for item in pipeline:
+            items.append(item)
+            if item == 2:
+                pipeline.cancel()
+    assert closed.wait(1.0)
+    assert len(items) < 10000
+    assert all(not t.is_alive() for t in pipeline._threads)
@@ -0,0 +1,59 @@
+from ingest.progress import Progress
+
+
+class Reports(list):
+
+    def __call__(self, **progress):
+        self.append(progress)
+
+# Tests
+
+def test_progress_throttling():
+    reports = Reports()
+    progress = Progress(reports, interval=60.0)
+    progress.start('loading', total_rows=100)
+    assert len(reports) == 1
+    assert reports[-1]['stage'] == 'loading' and reports[-1]['total_rows'] == 100
+    # Rows are reported at most once per interval
+    for _ in range(10):
+        progress.advance(10)
+    assert len(reports) == 1
+    assert progress.rows == 100
+    # A change of stage is reported immediately
+    progress.start('indexing')
+    assert len(reports) == 2
+    assert reports[-1] == {'stage': 'indexing', 'rows': 100, 'bytes': None, 'total_rows': 100, 'total_bytes': None}
+
+def test_progress_without_throttling():
+    reports = Reports()
+    progress = Progress(reports, interval=0.0)
+    progress.start('loading')
+    progress.advance(5)
+    progress.advance(5)
+    assert [r['rows'] for r in reports] == [0, 5, 10]
+
+def test_progress_estimates():
+    progress = Progress(interval=60.0)
+    progress.start('reading', total_bytes=1000)
+    progress.read(100, 20)
+    assert progress.total_rows == 200
+    # Known totals are not estimated
+    progress = Progress(interval=60.0)
+    progress.start('reading', total_rows=50, total_bytes=1000)
+    progress.read(100, 20)
+    assert progress.total_rows == 50
+    # Bytes are estimated from the rows loaded
+    progress.advance(25)
+    assert progress.asDict()['bytes'] == 100
+    progress = Progress(interval=60.0)
+    progress.start('loading', total_rows=50, total_bytes=1000)
+    progress.advance(25)
+    assert progress.asDict()['bytes'] == 500
+
+def test_progress_report_failure():
+    def report(**progress):
+        raise RuntimeError('Report failed')
+    progress = Progress(report, interval=0.0)
+    progress.start('loading')
+    progress.advance(1)
+    assert progress.rows == 1
@@ -0,0 +1,111 @@
+import codecs
+import io
+import os
+import tempfile
+import zipfile
+
+import pandas as pd
+from shapely.geometry import Point
+
+from ingest.readers import findArchiveMember, probeCsv, readCsvChunks, findCsvGeometryCandidates, GeometryColumns, InvalidEncoding
+
+
+def _probe(text, encoding='utf-8', **kwargs):
+    data = text.encode(encoding) if isinstance(text, str) else text
+    probe, head = probeCsv(io.BytesIO(data), **kwargs)
+    assert head == data
+    return probe
+
+# Tests
+
+def test_read_csv_chunks_settled_types():
+    # The types of `value` and `note` only change after the first chunk (and after the sample)
+    lines = ['id,value,note,wkt']
+    for k in range(1200):
+        value = '12.5' if k == 1100 else str(k)
+        note = 'text' if k >= 1100 else ''
+        lines.append('{0},{1},{2},POINT ({0} 1)'.format(k, value, note))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = os.path.join(tmpdir, 'types.csv')
+        with open(input_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        chunks = list(readCsvChunks(input_path, chunksize=500))
+    assert [len(df) for df in chunks] == [500, 500, 200]
+    for df in chunks:
+        assert df['value'].dtype == 'float64'
+        assert df['note'].dtype == object
+    assert chunks[-1]['value'].iloc[100] == 12.5
+    assert chunks[-1]['note'].iloc[100] == 'text'
+    assert chunks[0].geometry.iloc[1] == Point(1, 1)
+
+def test_find_archive_member_csv_with_json_metadata():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = os.path.join(tmpdir, 'data.zip')
+        with zipfile.ZipFile(input_path, 'w') as archive:
+            archive.writestr('metadata.json', '{"title": "Points"}')
+            archive.writestr('data.csv', 'id,wkt\n1,POINT (1 2)\n')
+        member = findArchiveMember(input_path)
+        assert (member.kind, member.name) == ('zip', 'data.csv')
+        chunks = list(readCsvChunks(member))
+    assert len(chunks) == 1 and chunks[0].geometry.iloc[0] == Point(1, 2)
+
+def test_find_geometry_candidates_hex_wkb():
+    wkb = [Point(k, k).wkb_hex for k in range(3)]
+    sample = pd.DataFrame({'id': [1, 2, 3], 'shape': wkb, 'name': ['a', 'b', 'c']})
+    assert findCsvGeometryCandidates(sample) == [GeometryColumns('wkb', ('shape',))]
+
+def test_find_geometry_candidates_lon_lat():
+    sample = pd.DataFrame({'Lat': [37.9, 38.0], 'Lon': [23.7, 23.8], 'name': ['a', 'b']})
+    assert findCsvGeometryCandidates(sample) == [GeometryColumns('xy', ('Lon', 'Lat'))]
+    # Out of range
+    sample = pd.DataFrame({'lat': [37.9, 380.0], 'lon': [23.7, 23.8]})
+    assert findCsvGeometryCandidates(sample) == []
+
+def test_find_geometry_candidates_order():
+    wkt = ['POINT (1 2)', 'LINESTRING (0 0, 1 1)', 'SRID=4326;POINT (3 4)']
+    sample = pd.DataFrame({'geom_a': wkt, 'wkt': wkt, 'x': [1.0, 2.0, 3.0], 'y': [1.0, 2.0, 3.0]})
+    assert findCsvGeometryCandidates(sample) == [
+        GeometryColumns('wkt', ('wkt',)), GeometryColumns('wkt', ('geom_a',)), GeometryColumns('xy', ('x', 'y'))]
+
+def test_probe_csv_delimiter_and_header():
+    probe = _probe('id;name;wkt\n1;a;POINT (1 2)\n2;"b;c";POINT (3 4)\n')
+    assert probe.delimiter == ';'
+    assert probe.header
+    assert list(probe.sample.columns) == ['id', 'name', 'wkt']
+    assert probe.sample['name'].tolist() == ['a', 'b;c']
+    assert probe.candidates == [GeometryColumns('wkt', ('wkt',))]
+
+def test_probe_csv_without_header():
+    probe = _probe('1\tPOINT (1 2)\n2\tPOINT (3 4)\n')
+    assert probe.delimiter == '\t'
+    assert not probe.header
+    assert len(probe.sample) == 2
+    assert probe.readOptions()['header'] is None
+
+def test_probe_csv_quoted_newlines():
+    probe = _probe('id,comment,wkt\n1,"line 1\nline 2",POINT (1 2)\n2,x,POINT (3 4)\n', rows=2)
+    assert probe.sample['comment'].tolist() == ['line 1\nline 2', 'x']
+
+def test_probe_csv_bom():
+    probe = _probe(codecs.BOM_UTF8 + 'name,wkt\nά,POINT (1 2)\n'.encode('utf-8'))
+    assert probe.encoding == 'utf-8-sig'
+    assert list(probe.sample.columns) == ['name', 'wkt']
+    probe = _probe('name,wkt\nά,POINT (1 2)\n', encoding='utf-16')
+    assert probe.encoding == 'utf-16'
+    assert probe.sample['name'].tolist() == ['ά']
+
+def test_probe_csv_encoding():
+    text = 'name,wkt\nΑθήνα,POINT (1 2)\n'
+    probe = _probe(text, encoding='iso-8859-7', encoding_hint='iso-8859-7')
+    assert probe.sample['name'].tolist() == ['Αθήνα']
+    try:
+        _probe(text, encoding='iso-8859-7')
+    except InvalidEncoding:
+        pass
+    else:
+        assert False, 'Contents not valid for the default encoding should be refused'
+
+def test_probe_csv_empty():
+    probe = _probe('')
+    assert probe.sample.empty
+    assert probe.candidates == []
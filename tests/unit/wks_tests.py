@@ -0,0 +1,126 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from ingest.wks import ColumnMapping, NameIndex, SchemaRegistry, WellKnownSchema, castColumn, nameTerms
+
+ADDRESSES = WellKnownSchema('addresses', 'Addresses',
+    (('street_name', 'string'), ('house_number', 'string'), ('postcode', 'string'), ('city', 'string')))
+
+POIS = WellKnownSchema('pois', 'Points of interest',
+    (('name', 'string'), ('category', 'string'), ('opening_hours', 'string')))
+
+ROADS = WellKnownSchema('roads', 'Roads',
+    (('name', 'string'), ('lanes', 'integer'), ('max_speed', 'float')))
+
+
+class SlowRegistry(SchemaRegistry):
+    """A registry of fixed schemata, matching on threads; matches into `slow` schemata block until released."""
+
+    def __init__(self, schemata, slow, pool_size=2):
+        super().__init__(pool_size=pool_size)
+        self._fixed = schemata
+        self.slow = slow
+        self.released = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=len(schemata))
+
+    def schemata(self):
+        return self._fixed
+
+    def _match(self, schema, df):
+        if schema.name in self.slow:
+            self.released.wait()
+        return ColumnMapping(schema, {schema.columns[0]: df.columns[0]})
+
+    def _submit(self, fn, *args):
+        return self.executor.submit(self._match, *args), self.executor
+
+# Tests
+
+def test_rank_timeout_per_match():
+    registry = SlowRegistry([ADDRESSES, POIS, ROADS], slow={'addresses', 'pois'})
+    try:
+        started = time.monotonic()
+        ranked, complete = registry._rank(pd.DataFrame({'name': ['a']}), workers=2, timeout=0.5,
+                                          candidates=None, schemata=['addresses', 'pois', 'roads'])
+        elapsed = time.monotonic() - started
+    finally:
+        registry.released.set()
+        registry.executor.shutdown()
+    # The slow matches time out on their own; the pending one takes their place (and completes)
+    assert not complete
+    assert [m.schema.name for m in ranked] == ['roads']
+    assert elapsed < 2.0
+
+def test_name_terms():
+    assert nameTerms('streetName') & nameTerms('STREET_NAME') >= {'t:street', 't:name'}
+    assert 't:street' in nameTerms('street name')
+
+def test_name_index_rank():
+    index = NameIndex([ADDRESSES, POIS, ROADS])
+    ranked = index.rank(['StreetName', 'HOUSE_NUMBER', 'postcode', 'City'])
+    assert [schema.name for schema, _ in ranked][0] == 'addresses'
+    assert ranked[0][1] == 1.0
+    assert all(0.0 <= score <= 1.0 for _, score in ranked)
+    assert [score for _, score in ranked] == sorted((score for _, score in ranked), reverse=True)
+    ranked = index.rank(['name', 'lanes', 'maxspeed'])
+    assert ranked[0][0].name == 'roads'
+    assert ranked[1][0].name == 'pois'
+
+def test_name_index_rank_unknown_columns():
+    index = NameIndex([ADDRESSES, POIS])
+    ranked = index.rank(['qqq', 'zzz'])
+    assert [score for _, score in ranked] == [0.0, 0.0]
+    assert [score for _, score in index.rank([])] == [0.0, 0.0]
+
+def test_cast_integer():
+    cast = castColumn(pd.Series(['1', '3', None]), 'integer')
+    assert str(cast.dtype) == 'Int64'
+    assert cast[:2].tolist() == [1, 3]
+    assert cast[2:].isna().all()
+    cast = castColumn(pd.Series([1, 2], dtype='int32'), 'integer')
+    assert str(cast.dtype) == 'Int64'
+    cast = castColumn(pd.Series([1.0, np.nan]), 'integer')
+    assert cast[0] == 1 and cast[1:].isna().all()
+
+def test_cast_integer_refused():
+    for values in (['1', 'x'], ['1', '2.6']):
+        try:
+            castColumn(pd.Series(values, name='lanes'), 'integer')
+        except ValueError as e:
+            assert 'lanes' in str(e) and repr(values[1]) in str(e)
+        else:
+            assert False, 'A value that cannot be cast into an integer should be refused'
+
+def test_cast_integer_lenient():
+    cast = castColumn(pd.Series(['1', '2.6', 'x', None]), 'integer', lenient=True)
+    assert str(cast.dtype) == 'Int64'
+    assert cast[0] == 1
+    assert cast[1:].isna().all()
+
+def test_cast_float():
+    cast = castColumn(pd.Series(['1.5', None]), 'float')
+    assert cast.dtype == np.float64
+    assert cast[0] == 1.5
+    assert cast[1:].isna().all()
+    try:
+        castColumn(pd.Series(['1.5', 'x'], name='max_speed'), 'float')
+    except ValueError as e:
+        assert 'max_speed' in str(e)
+    else:
+        assert False, 'A value that cannot be cast into a float should be refused'
+    cast = castColumn(pd.Series(['1.5', 'x']), 'float', lenient=True)
+    assert cast[0] == 1.5 and cast[1:].isna().all()
+
+def test_cast_string():
+    cast = castColumn(pd.Series([1.0, 2.0, np.nan]), 'string')
+    assert cast.tolist() == ['1', '2', None]
+    cast = castColumn(pd.Series([1.5, np.nan]), 'string')
+    assert cast.tolist() == ['1.5', None]
+
+def test_cast_unknown_type():
+    values = pd.Series([1, 2])
+    assert castColumn(values, 'date') is values
@@ -8,9 +8,12 @@ import logging.config
 
 logging.config.fileConfig(os.getenv('LOGGING_FILE_CONFIG', 'logging.conf'));
 
-from ingest.app import app
+from ingest.app import app, startQueueWorker
 
 if __name__ == '__main__':
+    # Process deferred jobs along with the server (in the serving process, if the reloader is used)
+    if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN'):
+        startQueueWorker();
     ssl_context = None
     port = 5000
     tls_cert = os.environ.get('TLS_CERTIFICATE');